@@ -0,0 +1,256 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Submit, monitor and collect the function calls listed in a manifest in bulk:
+
+    python -m lsf_faas manifest.jsonl --output results
+
+Each entry of the manifest names a function as 'module:function' and gives its arguments, either inline
+as a JSON list or as a dill/pickle file holding the argument list. A JSONL manifest has one JSON object per line:
+
+    {"id": "a1", "function": "mymod:myfun", "args": [1, "x"]}
+    {"id": "a2", "function": "mymod:myfun", "args_file": "args/a2.pkl", "files": "/tmp/a.txt"}
+
+A CSV manifest has the same columns, with 'args' written as a JSON list. The id is optional, the line number is used by default.
+
+The progress is appended to the state file (manifest.state by default). Running the same command again
+resumes: finished entries are skipped, submitted ones are monitored without being submitted again, and the
+ones that failed are submitted again.
+"""
+
+import argparse
+import csv
+import getpass
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lsf_faas import lsf
+
+
+FINAL_STATES = ('Done', 'Exit', 'failed')
+# the status checks in a row not finding a job before it is failed: LSF forgets the jobs finished long ago
+LOST_CHECKS = 3
+
+
+def readManifest(path):
+    entries = []
+    f = open(path, 'r', newline = '')
+    try:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if len(line.strip()) > 0]
+    finally:
+        f.close()
+
+    for number, row in enumerate(rows, 1):
+        entry = {}
+        entry['key'] = str(row.get('id') or number)
+        entry['function'] = row['function']
+        args = row.get('args')
+        if isinstance(args, str):
+            args = json.loads(args) if len(args) > 0 else None
+        entry['args'] = args
+        entry['args_file'] = row.get('args_file') or None
+        entry['files'] = row.get('files') or None
+        entries.append(entry)
+    return entries
+
+
+def readState(path):
+    # the last record of a key wins
+    state = {}
+    if os.path.exists(path):
+        f = open(path, 'r')
+        for line in f:
+            if len(line.strip()) > 0:
+                record = json.loads(line)
+                state[record['key']] = record
+        f.close()
+    return state
+
+
+def loadFunction(name):
+    module_name, func_name = name.split(':', 1)
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    func = importlib.import_module(module_name)
+    for attr in func_name.split('.'):
+        func = getattr(func, attr)
+    return func
+
+
+def loadArguments(entry):
+    if entry['args_file'] is not None:
+        import dill
+        f = open(entry['args_file'], 'rb')
+        args = dill.load(f)
+        f.close()
+        return tuple(args)
+    if entry['args'] is None:
+        return ()
+    return tuple(entry['args'])
+
+
+class Campaign(object):
+    """
+    Drive the entries of a manifest through submission, monitoring and collection, recording the progress in the state file.
+    """
+
+    def __init__(self, entries, state_file, output_dir, workers):
+        self.entries = entries
+        self.state = readState(state_file)
+        self.state_file = state_file
+        self.output_dir = output_dir
+        self.workers = workers
+        self.__lock = threading.Lock()
+        self.__functions = {}
+        # key -> the status checks in a row that did not find its job
+        self.__missing = {}
+
+    def record(self, key, new = False, **fields):
+        # a new record does not keep the fields of the previous submission
+        with self.__lock:
+            record = {} if new else dict(self.state.get(key, {}))
+            record.update(fields)
+            record['key'] = key
+            self.state[key] = record
+            f = open(self.state_file, 'a')
+            f.write(json.dumps(record) + '\n')
+            f.close()
+
+    def submit(self, entry):
+        try:
+            with self.__lock:
+                if entry['function'] not in self.__functions:
+                    self.__functions[entry['function']] = loadFunction(entry['function'])
+                func = self.__functions[entry['function']]
+            func_id = lsf.sub(func, *loadArguments(entry), files = entry['files'])
+        except Exception as e:
+            self.record(entry['key'], new = True, status = 'failed', message = str(e))
+            return
+        jobid = None if func_id is None else lsf.jobId(func_id)
+        if jobid is None:
+            self.record(entry['key'], new = True, status = 'failed', message = 'Failed to submit.')
+        else:
+            # the job id is only known to the cluster of the session
+            self.record(entry['key'], new = True, status = 'submitted', jobid = jobid, session = lsf.jobSession(func_id))
+
+    def poll(self, pending):
+        # one status request per session, return the (key, status) of the finished entries
+        sessions = {}
+        for key in pending:
+            record = self.state[key]
+            if record.get('jobid') is None:
+                self.record(key, status = 'failed', message = 'No job id was recorded.')
+                continue
+            sessions.setdefault(record.get('session'), {})[int(record['jobid'])] = key
+        finished = []
+        for session, jobs in sessions.items():
+            statuses = lsf.statuses(list(jobs), session = session)
+            if statuses is None:
+                continue
+            for jobid, key in jobs.items():
+                status = statuses.get(jobid)
+                if status is not None:
+                    self.__missing.pop(key, None)
+                    if status in ('Done', 'Exit'):
+                        finished.append((key, status))
+                    continue
+                self.__missing[key] = self.__missing.get(key, 0) + 1
+                if self.__missing[key] >= LOST_CHECKS:
+                    self.record(key, status = 'failed', message = 'Cannot find the job %d.' % jobid)
+        return finished
+
+    def collect(self, finished):
+        import dill
+        key, status = finished
+        record = self.state[key]
+        output = lsf.get(int(record['jobid']), session = record.get('session'))
+        if status == 'Done':
+            f = open(os.sep.join([self.output_dir, key + '.out']), 'wb')
+            dill.dump(output, f)
+            f.close()
+        else:
+            f = open(os.sep.join([self.output_dir, key + '.err']), 'w')
+            f.write(str(output))
+            f.close()
+        self.record(key, status = status)
+
+    def progress(self):
+        counts = {}
+        for entry in self.entries:
+            status = self.state.get(entry['key'], {}).get('status', 'new')
+            counts[status] = counts.get(status, 0) + 1
+        print('%s total: %d, %s' % (time.strftime('%H:%M:%S'), len(self.entries),
+                                    ', '.join('%s: %d' % (k, counts[k]) for k in sorted(counts))))
+        sys.stdout.flush()
+        return counts
+
+    def run(self, interval):
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        pool = ThreadPoolExecutor(max_workers = self.workers)
+        try:
+            # the entries that failed in a previous run are submitted again
+            todo = [entry for entry in self.entries if self.state.get(entry['key'], {}).get('status', 'failed') == 'failed']
+            list(pool.map(self.submit, todo))
+            while True:
+                pending = [key for key, record in self.state.items() if record.get('status') not in FINAL_STATES]
+                list(pool.map(self.collect, self.poll(pending)))
+                counts = self.progress()
+                if sum(counts.get(status, 0) for status in FINAL_STATES) >= len(self.entries):
+                    break
+                time.sleep(interval)
+        finally:
+            pool.shutdown()
+
+        return 0 if self.progress().get('failed', 0) == 0 else 1
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m lsf_faas', description = 'Submit, monitor and collect the function calls listed in a manifest.')
+    parser.add_argument('manifest', help = 'JSONL or CSV manifest of function calls.')
+    parser.add_argument('--output', default = None, help = 'Directory of the results. By default, it is the manifest name with ".results".')
+    parser.add_argument('--state', default = None, help = 'State file to resume from. By default, it is the manifest name with ".state".')
+    parser.add_argument('--workers', type = int, default = 8, help = 'Number of concurrent requests. By default, it is 8.')
+    parser.add_argument('--interval', type = float, default = lsf.interval, help = 'Seconds between two status checks.')
+    parser.add_argument('--no-bundle', action = 'store_true', help = 'Do not ship the local modules of the functions.')
+    parser.add_argument('--host', default = None, help = 'Log on this AC web server first. By default, the current session is used.')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--username', default = getpass.getuser())
+    parser.add_argument('--https', action = 'store_true')
+    args = parser.parse_args(argv)
+
+    if args.host is not None:
+        # the password is read from the environment for unattended runs
+        password = os.environ.get('LSF_FAAS_PASSWORD') or getpass.getpass('Password: ')
+        if not lsf.logon(args.username, password, args.host, args.port, args.https):
+            return 2
+
+    base = os.path.splitext(args.manifest)[0]
+    lsf.bundle = not args.no_bundle
+    campaign = Campaign(readManifest(args.manifest), args.state or base + '.state', args.output or base + '.results', args.workers)
+    return campaign.run(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
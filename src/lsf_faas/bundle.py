@@ -0,0 +1,215 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import site
+import sys
+import sysconfig
+import threading
+import types
+
+
+BUNDLE_DIR_NAME = 'bundles'
+# fixed timestamp, so the same sources always give the same zip
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def systemPaths():
+    paths = set()
+    for name in ('stdlib', 'platstdlib', 'purelib', 'platlib'):
+        path = sysconfig.get_paths().get(name)
+        if path:
+            paths.add(os.path.realpath(path))
+    try:
+        for path in site.getsitepackages():
+            paths.add(os.path.realpath(path))
+        paths.add(os.path.realpath(site.getusersitepackages()))
+    except Exception:
+        pass
+    return paths
+
+
+def isLocalModule(module, system_paths):
+    if not isinstance(module, types.ModuleType):
+        return False
+    name = module.__name__.split('.')[0]
+    if name in ('__main__', 'lsf_faas') or name in sys.builtin_module_names:
+        return False
+    path = getattr(module, '__file__', None)
+    if path is None or not path.endswith('.py'):
+        return False
+    path = os.path.realpath(path)
+    for system_path in system_paths:
+        if path.startswith(system_path + os.sep):
+            return False
+    return True
+
+
+def codeNames(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= codeNames(const)
+    return names
+
+
+def collectModules(func):
+    """
+    Find the local (not installed) modules the function depends on.
+
+    Return a tuple (roots, imports): roots maps the top level module name to its file or package directory,
+      imports is the list of import lines recreating the globals the function uses from those modules.
+    """
+    system_paths = systemPaths()
+    roots = {}
+    imports = []
+    scanned = set()
+
+    def addRoot(module):
+        if module.__name__ in scanned:
+            return
+        scanned.add(module.__name__)
+        name = module.__name__.split('.')[0]
+        if name not in roots:
+            top = sys.modules.get(name, module)
+            if hasattr(top, '__path__'):
+                roots[name] = os.path.dirname(os.path.realpath(top.__file__))
+                # the whole package is shipped, so are the modules its submodules use
+                for sub_name in list(sys.modules):
+                    if sub_name.startswith(name + '.') and isLocalModule(sys.modules[sub_name], system_paths):
+                        addRoot(sys.modules[sub_name])
+            else:
+                roots[name] = os.path.realpath(top.__file__)
+        # modules used by a local module must be shipped too
+        for value in list(vars(module).values()):
+            owner = value if isinstance(value, types.ModuleType) else sys.modules.get(getattr(value, '__module__', None) or '')
+            if isLocalModule(owner, system_paths):
+                addRoot(owner)
+
+    func_globals = getattr(func, '__globals__', {})
+    for name in sorted(codeNames(func.__code__)):
+        if name not in func_globals:
+            continue
+        value = func_globals[name]
+        if isinstance(value, types.ModuleType):
+            if isLocalModule(value, system_paths):
+                addRoot(value)
+                if name == value.__name__:
+                    imports.append('import %s' % name)
+                else:
+                    imports.append('import %s as %s' % (value.__name__, name))
+        else:
+            module = sys.modules.get(getattr(value, '__module__', None) or '')
+            if isLocalModule(module, system_paths) and getattr(value, '__name__', None):
+                addRoot(module)
+                if name == value.__name__:
+                    imports.append('from %s import %s' % (module.__name__, name))
+                else:
+                    imports.append('from %s import %s as %s' % (module.__name__, value.__name__, name))
+
+    return roots, imports
+
+
+def collectImports(func):
+    """
+    Return the import lines recreating the globals the function uses from installed modules,
+      so the job script works without the import lines captured in IPython.
+    """
+    system_paths = systemPaths()
+    imports = []
+    func_globals = getattr(func, '__globals__', {})
+    for name in sorted(codeNames(func.__code__)):
+        if name not in func_globals:
+            continue
+        value = func_globals[name]
+        if isinstance(value, types.ModuleType):
+            if value.__name__.split('.')[0] in ('__main__', 'lsf_faas') or isLocalModule(value, system_paths):
+                continue
+            if name == value.__name__:
+                imports.append('import %s' % name)
+            else:
+                imports.append('import %s as %s' % (value.__name__, name))
+        else:
+            module_name = getattr(value, '__module__', None)
+            value_name = getattr(value, '__name__', None)
+            module = sys.modules.get(module_name or '')
+            if module is None or value_name is None or module_name.split('.')[0] in ('__main__', 'lsf_faas', 'builtins'):
+                continue
+            if isLocalModule(module, system_paths) or getattr(module, value_name, None) is not value:
+                continue
+            if name == value_name:
+                imports.append('from %s import %s' % (module_name, name))
+            else:
+                imports.append('from %s import %s as %s' % (module_name, value_name, name))
+    return imports
+
+
+def bundleSources(roots):
+    sources = []
+    for name in sorted(roots):
+        path = roots[name]
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+                for filename in sorted(filenames):
+                    if filename.endswith('.py'):
+                        full_path = os.path.join(dirpath, filename)
+                        arcname = '/'.join([name] + os.path.relpath(full_path, path).split(os.sep))
+                        sources.append((arcname, full_path))
+        else:
+            sources.append((name + '.py', path))
+    return sources
+
+
+def buildBundle(roots, work_dir):
+    """
+    Build the bytecode zip of the modules, cached in work_dir/bundles by content hash.
+
+    Return a tuple (success, content): content is the zip path if success, otherwise the error message.
+    """
+    import hashlib
+    import importlib.util
+    import marshal
+    import zipfile
+    try:
+        sources = []
+        digest = hashlib.sha1()
+        for arcname, path in bundleSources(roots):
+            f = open(path, 'rb')
+            data = f.read()
+            f.close()
+            sources.append((arcname, data))
+            digest.update(arcname.encode('utf-8'))
+            digest.update(data)
+
+        bundle_dir = os.sep.join([work_dir, BUNDLE_DIR_NAME])
+        zip_path = os.sep.join([bundle_dir, digest.hexdigest() + '.zip'])
+        if os.path.exists(zip_path):
+            return True, zip_path
+
+        if not os.path.exists(bundle_dir):
+            os.makedirs(bundle_dir)
+        tmp_path = '%s.%d.%d' % (zip_path, os.getpid(), threading.get_ident())
+        zf = zipfile.ZipFile(tmp_path, 'w')
+        for arcname, data in sources:
+            zf.writestr(zipfile.ZipInfo(arcname, ZIP_DATE_TIME), data)
+            # unchecked hash based pyc (PEP 552): zipimport loads it without comparing to the source
+            code = compile(data, arcname, 'exec', dont_inherit = True)
+            pyc = importlib.util.MAGIC_NUMBER + (1).to_bytes(4, 'little') + importlib.util.source_hash(data) + marshal.dumps(code)
+            zf.writestr(zipfile.ZipInfo(arcname + 'c', ZIP_DATE_TIME), pyc)
+        zf.close()
+        os.replace(tmp_path, zip_path)
+        return True, zip_path
+    except Exception as e:
+        return False, 'Failed to bundle the modules: %s' % str(e)
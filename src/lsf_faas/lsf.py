@@ -15,15 +15,19 @@
 # limitations under the License.
 
 
-from concurrent.futures import ThreadPoolExecutor
+import collections
 import datetime
 import errno
 import functools
 from functools import wraps
 import getpass
 import inspect
-from IPython import get_ipython
+import json
+from lsf_faas.bundle import *
 from lsf_faas.lsflib import *
+from lsf_faas.markers import *
+from lsf_faas import native as nativelib
+from lsf_faas.util import *
 import os
 import shutil
 import signal
@@ -32,51 +36,368 @@ import threading
 import time
 import uuid
 
+OBJECT_DIR_NAME = 'objects'
+# in the error of a job not finding a staged file, see __stagePrelude()
+STAGED_MISSING = 'is not available on the cluster'
+# the intermediate results of map_reduce() in staging_dir
+REDUCE_DIR_NAME = 'reduce'
+
+class ObjectRef(object):
+    """
+    A reference to an object stored by lsf.put(). Pass it as an argument of sub(), exe() or map() instead of the object.
+    """
+
+    def __init__(self, name, size, path):
+        # the staged name, the serialized size of the object and its local file
+        self.name = name
+        self.size = size
+        self.path = path
+
+    def __repr__(self):
+        return 'ObjectRef(%s, %d bytes)' % (self.name, self.size)
+
+
+class ArrayShard(ObjectRef):
+    """
+    A slice of an array stored by lsf.scatter(). Pass it as an argument of sub(), exe() or map(): the job gets
+      a read-only numpy.memmap of the slice only.
+    """
+
+    def __init__(self, name, size, path, offset, shape, descr):
+        # size is the bytes of the slice, offset its position in the .npy file; descr is its dtype as
+        #   numpy.lib.format.dtype_to_descr() gives it
+        ObjectRef.__init__(self, name, size, path)
+        self.offset = offset
+        self.shape = shape
+        self.descr = descr
+
+    def __repr__(self):
+        return 'ArrayShard(%s, offset %d, shape %s)' % (self.name, self.offset, str(self.shape))
+
+
 class lsf(object):
     """
     This class allows you to send function calls(especially for time-consuming) as jobs to LSF without blocking.
+
+    One client can be used by many threads at once: the calls on different functions do not wait for each other,
+      the calls on the same function (get(), and the background download of its output) are serialized,
+      and the session is logged on again by one thread only.
     """
 
     interval = 5
+    # ship the local modules the function depends on as a bytecode zip, which is uploaded only when it changes
+    bundle = False
+    # the directory on the cluster keeping the files uploaded once and shared by the jobs
+    staging_dir = '~/.lsf_faas/staging'
+    # how long (in seconds) a job waits for a staged file
+    stage_timeout = 600
+    # a callable returning the logon arguments (username, password, host, port, isHttps), used to
+    # log on again transparently when the session expires. A named session keeps its own host, port and isHttps
+    credential_provider = None
+    # micro-batching: when batch_window (in milliseconds) is set, the sub() calls of the same function within
+    # the window, or up to batch_size calls, are packed into one job, run on batch_slots slots (see map())
+    batch_window = None
+    batch_size = 100
+    batch_slots = None
+    # background prefetching: the results of the finished jobs are downloaded (and deserialized, if prefetch_load)
+    # by prefetch_workers threads at no more than prefetch_bandwidth bytes per second, so get() returns at once
+    prefetch = False
+    prefetch_workers = 4
+    prefetch_bandwidth = None
+    prefetch_load = True
+    # the outputs kept in memory, including those of the local pool, are limited to cache_size bytes (serialized size), the least recently used
+    # are dropped and reloaded from work_dir on demand. By default, it is None which is unlimited.
+    cache_size = None
+    # with several named sessions (see logon), each call goes to the available session with the shortest
+    # observed queue wait ('queue') or the fewest running functions for its limit ('load')
+    routing = 'queue'
+    # speculative execution: a task running longer than speculative_threshold times the median runtime of
+    # its group is duplicated, at most speculative_budget (fraction of the group size) duplicates per group
+    speculative_threshold = 2.0
+    speculative_budget = 0.1
+    # a callable receiving the function id (or the staged name) and the progress of each upload and download:
+    # a dict of 'direction', 'name', 'bytes', 'total', 'elapsed', 'rate' (bytes per second) and 'eta' (seconds)
+    progress = None
+    # run the calls of sub() and exe() in a local pool of local_workers processes instead of LSF: True runs them all
+    # locally, 'auto' keeps a call local when its function runs (as learnt from a first call run by LSF, then from its
+    # local calls) in no more than local_runtime seconds and its serialized arguments are no more than local_payload bytes
+    local = False
+    local_workers = None
+    local_runtime = 1.0
+    local_payload = 1024 * 1024
+    # completion markers: each job writes <function id>.done in marker_dir, a directory shared by the execution hosts
+    #   and this host, when it exits. It is watched with inotify where available (it sees the markers written on this
+    #   host only) and scanned every marker_scan seconds, so a finished function is downloaded without polling its status
+    marker_dir = None
+    marker_scan = 0.5
+    # with tail_output, the job script copies its output to segment files, each one closed when it is tail_period
+    #   seconds old or tail_segment bytes long, and tail() downloads each segment once
+    tail_output = False
+    tail_period = 2
+    tail_segment = 1024 * 1024
+
+    def __init__(self, capture_imports = True):
+        """
+        Create the client. It is cheap: no request is sent to the server until a call needs it,
+          and IPython is only used when it is running.
 
-    def __init__(self):
+        Parameters:
+        capture_imports: Whether register the IPython 'post_run_cell' hook recording the import lines of your cells,
+          which are recreated in the job scripts. It takes effect only in an IPython context.
+        """
         self.__input_module_set=set()
+        # function id -> what is known about it. Each entry is set at once, the updates of one function are
+        #   made under its lock from __func_locks, picked by the hash of the id
         self.__func_d = {}
+        self.__func_locks = [threading.RLock() for i in range(64)]
+        # session -> staged name -> True if it is known to be on the cluster, or the id of the staging job
+        self.__staged = {}
+        # session -> its limit, the ids of its running functions and its observed queue wait.
+        #   None is the default session, used when no named session is logged on
+        self.__sessions = {}
+        self.__session_lock = threading.Lock()
+        self.__stage_lock = threading.Lock()
+        # (session, name) -> when the status of its staging job was asked, see __stagingFailed()
+        self.__stage_checked = {}
+        # reentrant: the token is verified under it, and a failed verification logs on again
+        self.__logon_lock = threading.RLock()
+        # (func, files, tags) -> the calls waiting to be packed into one job
+        self.__batches = {}
+        self.__batch_lock = threading.Lock()
+        self.__prefetcher = None
+        self.__prefetch_lock = threading.Lock()
+        # when the bandwidth reserved by the downloads so far is used up
+        self.__prefetch_next = 0
+        # id -> serialized size of the outputs in memory, the least recently used first
+        self.__cache = collections.OrderedDict()
+        self.__cache_bytes = 0
+        self.__cache_lock = threading.Lock()
+        # the function id of the last exe() with profile, see profile()
+        self.__last_profiled = None
+        self.__local_pool = None
+        self.__local_lock = threading.Lock()
+        # (module, name) of a function -> its observed runtime; or when the runtime is not known yet,
+        #   the time the call measuring it started
+        self.__runtimes = {}
+        self.__probes = {}
+        # function id -> its completion marker, None until it is found; the functions watched by __watcher
+        self.__markers = {}
+        self.__marker_cond = threading.Condition()
+        # how many markers were found
+        self.__marker_found = 0
+        self.__watcher = None
         if os.name == 'nt':
             self.work_dir = os.sep.join([os.environ['HOMEDRIVE'], os.environ['HOMEPATH'], WORK_DIR_NAME])
         else:
             self.work_dir = os.sep.join([os.environ['HOME'], WORK_DIR_NAME])
 
-        is_exists = os.path.exists(self.work_dir)
-        if is_exists:
-            # delete sub-dir more than 30 days (modify date) in work_dir.
-            father = list(os.listdir(self.work_dir))
-            for i in range(len(father)):
-                subidr = os.sep.join([self.work_dir , father[i]])
-                if os.path.isdir(subidr):
-                    path_date = os.path.getmtime(subidr)
-                    current = time.time()
-                    num = (current - path_date)/60/60/24
-                    if num >= 30:
-                        try:
-                            shutil.rmtree(subidr)
-                            fomrat_date = datetime.datetime.fromtimestamp(path_date).strftime('%Y-%m-%d')
-                            print("Deleted %s: %s" % (subidr, fomrat_date))
-                        except Exception as e:
-                            print(e)
-        else:
+        if not os.path.exists(self.work_dir):
             os.makedirs(self.work_dir)
 
-        ipython = get_ipython()
-        ipython.events.register('post_run_cell', self.__postRunCell)
+        # the directories of the sessions using the LSF commands instead of the AC web server
+        self.__native = set()
+        if os.path.exists(os.sep.join([self.work_dir, NATIVE_FILE])):
+            self.__native.add(self.work_dir)
+        self.__addSession(None)
+        session_dir = os.sep.join([self.work_dir, SESSION_DIR_NAME])
+        if os.path.isdir(session_dir):
+            for name in sorted(os.listdir(session_dir)):
+                if os.path.exists(os.sep.join([session_dir, name, NATIVE_FILE])):
+                    self.__native.add(os.sep.join([session_dir, name]))
+                elif not os.path.exists(os.sep.join([session_dir, name, TOKEN_FILE])):
+                    continue
+                self.__addSession(name)
+
+        if capture_imports and 'IPython' in sys.modules:
+            from IPython import get_ipython
+            ipython = get_ipython()
+            if ipython is not None:
+                ipython.events.register('post_run_cell', self.__postRunCell)
+
+        # None: the token is not verified yet, it is done when a call needs the server
+        self.__is_logged = None
+        self.__is_cleaned = False
 
-        success, output = verifyToken(self.work_dir)
-        if success:
-            self.__is_logged = True
-        else:
-            self.__is_logged = False
+        self.__thread_pool = None
+        self.__pool_lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # threads do not survive fork, a worker process creates its own pool on demand
+            os.register_at_fork(after_in_child = self.__afterFork)
 
+
+    def __afterFork(self):
         self.__thread_pool = None
+        self.__prefetcher = None
+        self.__local_pool = None
+        self.__watcher = None
+
+
+    def __funcLock(self, id):
+        return self.__func_locks[hash(id) % len(self.__func_locks)]
+
+
+    def __progress(self, id):
+        # the callback given to the lsflib transfers of the function
+        if self.progress is None:
+            return None
+        progress = self.progress
+        return lambda info: progress(id, info)
+
+
+    def __threadPool(self):
+        # created on demand, shared by the asynchronous uploads and downloads
+        with self.__pool_lock:
+            if self.__thread_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.__thread_pool = ThreadPoolExecutor(max_workers=5)
+            return self.__thread_pool
+
+
+    def __sessionDir(self, session):
+        # the directory of the token of the session, given to the lsflib functions
+        if session is None:
+            return self.work_dir
+        return os.sep.join([self.work_dir, SESSION_DIR_NAME, session])
+
+
+    def __addSession(self, session, limit = None):
+        staged = {}
+        staged_file = os.sep.join([self.__sessionDir(session), STAGED_FILE])
+        if os.path.exists(staged_file):
+            f = open(staged_file, 'r')
+            for name in f.read().split('\n'):
+                if len(name) > 0:
+                    staged[name] = True
+            f.close()
+        with self.__session_lock:
+            self.__staged[session] = staged
+            record = self.__sessions.setdefault(session, {'limit': None, 'running': set(), 'queue': None})
+            record['limit'] = limit
+            # the server the session logged on to, logged on again by __relogon()
+            record['url'] = getToken(self.__sessionDir(session))[0]
+
+
+    def __isLogged(self):
+        if self.__is_logged is False and self.credential_provider is not None and len(self.__sessions) == 1:
+            # the default session is only logged on again when no named session is used
+            self.__relogon(None, getToken(self.work_dir))
+        if self.__is_logged is None:
+            # verified by one thread, the others wait for the answer
+            with self.__logon_lock:
+                if self.__is_logged is None:
+                    success, output = self.__request(verifyToken, self.work_dir)
+                    if success:
+                        self.__is_logged = True
+                    elif output == CANNOT_CONNECT_SERVER or output == SERVER_UNAVAILABLE:
+                        # cannot tell yet, the request fails later with the reason if the server is still down
+                        return True
+                    else:
+                        self.__is_logged = False
+        # the named sessions are checked by their requests
+        return self.__is_logged or len(self.__sessions) > 1
+
+
+    def __relogon(self, session, token):
+        # token: the (url, token) the failed request of the session was sent with. A named session is logged on
+        #   again to its own server, with the username and password of credential_provider
+        import urllib.parse
+        session_dir = self.__sessionDir(session)
+        with self.__logon_lock:
+            if getToken(session_dir) != token and getToken(session_dir)[1] != '':
+                # another thread has already logged on again
+                if session is None:
+                    self.__is_logged = True
+                return True
+            try:
+                username, password, host, port, isHttps = self.credential_provider()
+                url = self.__sessions.get(session, {}).get('url') or token[0]
+                if session is not None and url != '':
+                    url = urllib.parse.urlsplit(url)
+                    host, port, isHttps = url.hostname, url.port, url.scheme == 'https'
+                success, content = logonAC(username, password, host, port, isHttps, session_dir)
+            except Exception as e:
+                success, content = False, str(e)
+            if not success:
+                print('Failed to log on again%s: %s' % ('' if session is None else ' to the session ' + session, content))
+                return False
+            if session is None:
+                self.__is_logged = True
+            return True
+
+
+    def __backend(self, fn, arguments):
+        # the function of native instead of lsflib when the request is for a session using the LSF commands
+        for argument in arguments:
+            if isinstance(argument, str) and argument in self.__native:
+                return getattr(nativelib, fn.__name__)
+        return fn
+
+
+    def __request(self, fn, *arguments):
+        # call the lsflib function; if the session has expired and a credential provider is set,
+        # log on again and replay the call once
+        fn = self.__backend(fn, arguments)
+        session, session_dir = self.__requestSession(arguments)
+        token = getToken(session_dir) if session_dir is not None else None
+        success, content = fn(*arguments)
+        # only a session logged on before is logged on again
+        if not success and self.credential_provider is not None and session_dir is not None and \
+                self.__sessions.get(session, {}).get('url') and \
+                (SESSION_LOGOUT in str(content) or TOKEN_IS_DELETED == content):
+            if self.__relogon(session, token):
+                success, content = fn(*arguments)
+        return success, content
+
+
+    def __requestSession(self, arguments):
+        # the (session, session directory) a request is sent to, (None, None) if it is for no session
+        dirs = {}
+        for session in list(self.__sessions):
+            dirs[self.__sessionDir(session)] = session
+        for argument in arguments:
+            if isinstance(argument, str) and argument in dirs:
+                return dirs[argument], argument
+        return None, None
+
+
+    def __cleanWorkDir(self):
+        # delete sub-dir more than 30 days (modify date) in work_dir.
+        # It is run in background once a day at most, as it scans the whole work_dir.
+        stamp = os.sep.join([self.work_dir, CLEANED_FILE])
+        current = time.time()
+        if os.path.exists(stamp) and (current - os.path.getmtime(stamp)) < 60*60*24:
+            return
+        open(stamp, 'w').close()
+
+        father = list(os.listdir(self.work_dir))
+        for i in range(len(father)):
+            subidr = os.sep.join([self.work_dir , father[i]])
+            if os.path.isdir(subidr) and father[i] not in (SESSION_DIR_NAME, nativelib.NATIVE_JOB_DIR_NAME):
+                path_date = os.path.getmtime(subidr)
+                num = (current - path_date)/60/60/24
+                if num >= 30:
+                    try:
+                        shutil.rmtree(subidr)
+                        fomrat_date = datetime.datetime.fromtimestamp(path_date).strftime('%Y-%m-%d')
+                        print("Deleted %s: %s" % (subidr, fomrat_date))
+                    except Exception as e:
+                        print(e)
+
+        # the jobs of the sessions using the LSF commands, the jobs directory is in use
+        for session_dir in set(self.__native) | set([self.work_dir]):
+            for path in nativelib.cleanJobs(session_dir, 30):
+                print('Deleted %s' % path)
+
+        if self.marker_dir is not None:
+            # the markers of the functions not watched any more
+            marker_dir = os.path.expanduser(self.marker_dir)
+            for name in scanMarkers(marker_dir):
+                try:
+                    if (current - os.path.getmtime(os.sep.join([marker_dir, name])))/60/60/24 >= 30:
+                        os.remove(os.sep.join([marker_dir, name]))
+                except OSError:
+                    pass
+
 
     def __postRunCell(self, result):
         try:
@@ -111,30 +432,268 @@ class lsf(object):
             return
 
 
-    def __generateScript(self, script_name, func, *arguments):
+    def __scriptMarker(self, marker):
+        # the completion marker is written last at exit, atomically: next to the output, and as <marker>.done
+        #   in marker_dir if it is set. The job did not finish well if it has no output
+        paths = ['"' + MARKER_FILE_NAME + '"']
+        if self.marker_dir is not None:
+            paths.append('os.path.join(os.path.expanduser(' + json.dumps(self.marker_dir) + '), "' + marker + MARKER_SUFFIX + '")')
+        return ['def _lsf_faas_marker():',
+                '    import json, os',
+                '    done = os.path.exists("' + OUTPUT_FILE_NAME + '")',
+                '    marker = json.dumps({"status": "Done" if done else "Exit", "size": os.path.getsize("' + OUTPUT_FILE_NAME + '") if done else 0,',
+                '                         "jobid": os.environ.get("LSB_JOBID"), "time": _lsf_faas_time.time()})',
+                '    for path in [' + ', '.join(paths) + ']:',
+                '        try:',
+                '            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)',
+                '            temporary = "%s.%d.tmp" % (path, os.getpid())',
+                '            f = open(temporary, "w")',
+                '            f.write(marker)',
+                '            f.close()',
+                '            os.replace(temporary, path)',
+                '        except Exception:',
+                '            pass',
+                '']
+
+
+    def __scriptTail(self):
+        # the output written to sys.stdout and sys.stderr is also written to the segments read by tail(), the current
+        #   one is hidden until it is closed. The processes of the map() pool only write to the original streams.
+        #   A segment is deleted when it has been closed for longer than a tail() following the function waits
+        #   between two reads. The job exits at once, leaving the segments closed last in its directory, see __tailRead()
+        retention = 2 * max(float(self.interval), float(self.tail_period))
+        return ['class _LsfFaasSegments(object):',
+                '    def __init__(self):',
+                '        import os, threading',
+                '        self.pid = os.getpid()',
+                '        self.lock = threading.Lock()',
+                '        self.index = 0',
+                '        self.file = None',
+                '        self.flusher = None',
+                '        # (index, when it was closed) of the segments not deleted yet',
+                '        self.closed = []',
+                '        # no segment is written once closed at exit',
+                '        self.ended = False',
+                '',
+                '    def write(self, text):',
+                '        import os, threading',
+                '        if os.getpid() != self.pid or len(text) == 0 or self.ended:',
+                '            return',
+                '        with self.lock:',
+                '            if self.ended:',
+                '                return',
+                '            if self.file is None:',
+                '                self.file = open(".' + TAIL_FILE_NAME + '.%d" % self.index, "w", encoding = "utf-8", errors = "replace")',
+                '                self.opened = _lsf_faas_time.time()',
+                '                self.length = 0',
+                '            self.file.write(text)',
+                '            self.length += len(text)',
+                '            if self.length >= ' + str(int(self.tail_segment)) + ':',
+                '                self.rotate()',
+                '            if self.flusher is None:',
+                '                self.flusher = threading.Thread(target = self.flush, daemon = True)',
+                '                self.flusher.start()',
+                '',
+                '    def rotate(self):',
+                '        import os',
+                '        if self.file is not None:',
+                '            self.file.close()',
+                '            os.replace(".' + TAIL_FILE_NAME + '.%d" % self.index, "' + TAIL_FILE_NAME + '.%d" % self.index)',
+                '            self.closed.append((self.index, _lsf_faas_time.time()))',
+                '            self.index += 1',
+                '            self.file = None',
+                '',
+                '    def expire(self, age):',
+                '        # the index of the first segment left is written to ' + TAIL_FILE_NAME + ', for a tail() behind',
+                '        import os',
+                '        expired = False',
+                '        while len(self.closed) > 0 and _lsf_faas_time.time() - self.closed[0][1] >= age:',
+                '            expired = True',
+                '            try:',
+                '                os.remove("' + TAIL_FILE_NAME + '.%d" % self.closed.pop(0)[0])',
+                '            except OSError:',
+                '                pass',
+                '        if expired:',
+                '            f = open("' + TAIL_FILE_NAME + '.tmp", "w")',
+                '            f.write("%d" % (self.closed[0][0] if len(self.closed) > 0 else self.index))',
+                '            f.close()',
+                '            os.replace("' + TAIL_FILE_NAME + '.tmp", "' + TAIL_FILE_NAME + '")',
+                '',
+                '    def flush(self):',
+                '        while True:',
+                '            _lsf_faas_time.sleep(' + repr(float(self.tail_period)) + ' / 2)',
+                '            with self.lock:',
+                '                if self.ended:',
+                '                    return',
+                '                if self.file is not None and _lsf_faas_time.time() - self.opened >= ' + repr(float(self.tail_period)) + ':',
+                '                    self.rotate()',
+                '                self.expire(' + repr(retention) + ')',
+                '',
+                '    def close(self):',
+                '        import os',
+                '        if os.getpid() == self.pid:',
+                '            with self.lock:',
+                '                self.rotate()',
+                '                self.ended = True',
+                '                # the job does not wait: the last segments are left for a tail() behind',
+                '                self.expire(' + repr(retention) + ')',
+                '',
+                'class _LsfFaasTee(object):',
+                '    def __init__(self, stream, segments):',
+                '        self.stream = stream',
+                '        self.segments = segments',
+                '',
+                '    def write(self, text):',
+                '        count = self.stream.write(text)',
+                '        self.segments.write(text)',
+                '        return count',
+                '',
+                '    def __getattr__(self, name):',
+                '        return getattr(self.stream, name)',
+                '']
+
+
+    def __scriptTelemetry(self, marker = None, tail = False):
+        # first lines of the script: the times are taken from the start, the telemetry is written at exit,
+        #   even if the function raises. The pool workers of map() do not write it.
+        #   The completion marker (see __scriptMarker()) is registered first, so it is written after the telemetry
+        lines = ['import atexit as _lsf_faas_atexit',
+                 'import time as _lsf_faas_time',
+                 '_lsf_faas_times = {"start": _lsf_faas_time.time()}',
+                 '',
+                 'def _lsf_faas_telemetry():',
+                 '    import json, os, platform, socket',
+                 '    times = _lsf_faas_times',
+                 '    end = _lsf_faas_time.time()',
+                 '    cpu = os.times()',
+                 '    telemetry = {"host": socket.gethostname(), "python": platform.python_version(), "wall": end - times["start"],',
+                 '                 "cpu": cpu[0] + cpu[1] + cpu[2] + cpu[3], "import": times.get("call", end) - times["start"]}',
+                 '    if "call_end" in times:',
+                 '        telemetry["call"] = times["call_end"] - times["call"]',
+                 '    try:',
+                 '        import resource',
+                 '        # in KB on Linux',
+                 '        telemetry["max_rss"] = 1024 * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)',
+                 '    except Exception:',
+                 '        pass',
+                 '    f = open("' + TELEMETRY_FILE_NAME + '", "w")',
+                 '    f.write(json.dumps(telemetry))',
+                 '    f.close()',
+                 '']
+        if marker is not None:
+            lines.extend(self.__scriptMarker(marker))
+        if tail:
+            lines.extend(self.__scriptTail())
+        lines.append('if __name__ == "__main__":')
+        if marker is not None:
+            lines.append('    _lsf_faas_atexit.register(_lsf_faas_marker)')
+        lines.append('    _lsf_faas_atexit.register(_lsf_faas_telemetry)')
+        if tail:
+            lines.extend(['    import sys as _lsf_faas_sys',
+                          '    _lsf_faas_segments = _LsfFaasSegments()',
+                          '    _lsf_faas_sys.stdout = _LsfFaasTee(_lsf_faas_sys.stdout, _lsf_faas_segments)',
+                          '    _lsf_faas_sys.stderr = _LsfFaasTee(_lsf_faas_sys.stderr, _lsf_faas_segments)',
+                          '    # the last segment is closed first at exit',
+                          '    _lsf_faas_atexit.register(_lsf_faas_segments.close)'])
+        lines.append('')
+        return lines
+
+
+    def __scriptHeader(self, func, prelude = [], marker = None, tail = False):
+        lines = self.__scriptTelemetry(marker, tail)
+        lines.extend(prelude)
+        # make sure we import the right modules
+        for line in self.__input_module_set:
+            if 'lsf_faas' in line:
+                pass
+            else:
+                lines.append(line)
+        lines.extend(collectImports(func))
+
+        lines.append('import os ')
+        lines.append('import base64 ')
+        lines.append('import dill ')
+        lines.append('')
+        # remove symbol of decorator
+        for line in inspect.getsource(func).split('\n'):
+            if (line.startswith('@')) == False:
+                lines.append(line)
+
+        lines.append('')
+        return lines
+
+
+    def __scriptResult(self, target = None):
+        if target is not None:
+            # an intermediate result of map_reduce(), kept in staging_dir for the next reduction;
+            #   the output is None
+            return ['path = os.path.join(os.path.expanduser(' + json.dumps(self.staging_dir) + '), ' + json.dumps(target) + ')',
+                    'os.makedirs(os.path.dirname(path), exist_ok = True)',
+                    'f = open(path + "." + str(os.getpid()), "wb")',
+                    'dill.dump(result, f)',
+                    'f.close()',
+                    'os.replace(path + "." + str(os.getpid()), path)',
+                    'f = open("' + OUTPUT_FILE_NAME + '", "wb")',
+                    'f.write(base64.b64encode(dill.dumps(None)))',
+                    'f.close()',
+                    '']
+        # a numpy array of numbers is written in the .npy format, see gather()
+        return ['if type(result).__module__ == "numpy" and type(result).__name__ == "ndarray" and not result.dtype.hasobject:',
+                '    import io, numpy',
+                '    str = io.BytesIO()',
+                '    numpy.save(str, result, allow_pickle = False)',
+                '    str = str.getvalue()',
+                'else:',
+                '    str = dill.dumps(result)',
+                'f = open("' + OUTPUT_FILE_NAME + '", "wb")',
+                'f.write(base64.b64encode(str))',
+                'f.close()',
+                '']
+
+
+    def __scriptReducer(self, reducer):
+        # the reducer of map_reduce() is passed by value, it may be a lambda or a builtin such as operator.add
+        import dill
+        return ['import functools',
+                '_lsf_faas_reducer = dill.loads(base64.b64decode(bytes("' + str(base64.b64encode(dill.dumps(reducer, recurse = True)), 'utf-8') + '", encoding = "utf8")))',
+                '']
+
+
+    def __scriptBytes(self, lines):
+        # the script is kept in memory and sent as it is, see submitJob()
         try:
-            tmp_file = open(script_name, "a")
-            # make sure we import the right modules
-            for line in self.__input_module_set:
-                if 'lsf_faas' in line:
-                    pass
-                else:
-                    tmp_file.write(line + '\n')
-
-            tmp_file.write('import os \n')
-            tmp_file.write('import base64 \n')
-            tmp_file.write('import dill \n')
-            tmp_file.write('\n')
-            # remove symbol of decorator
-            lines = inspect.getsource(func).split('\n')
-            output =''
-            for line in lines:
-                if (line.startswith('@')) == False:
-                    output += line
-                    output += '\n'
-            tmp_file.write(output)
+            return True, ('\n'.join(lines) + '\n').encode('utf-8')
+        except Exception as e:
+            return False, 'Found error when generate data: %s' % e
+
 
-            tmp_file.write('\n')
+    def __scriptProfile(self, call, profile):
+        # run the call under cProfile (and tracemalloc if profile is 'memory'), the stats are written
+        #   to PROFILE_FILE_NAME even if the function raises
+        lines = ['import cProfile']
+        if profile == 'memory':
+            lines.extend(['import tracemalloc', 'tracemalloc.start()'])
+        lines.extend(['_lsf_faas_profiler = cProfile.Profile()',
+                      '_lsf_faas_profiler.enable()',
+                      'try:',
+                      '    ' + call,
+                      'finally:',
+                      '    _lsf_faas_profiler.disable()',
+                      '    _lsf_faas_profiler.create_stats()',
+                      '    _lsf_faas_profile = {"stats": _lsf_faas_profiler.stats}'])
+        if profile == 'memory':
+            lines.extend(['    _lsf_faas_profile["peak"] = tracemalloc.get_traced_memory()[1]',
+                          '    _lsf_faas_profile["memory"] = [(str(stat.traceback), stat.size, stat.count) for stat in tracemalloc.take_snapshot().statistics("lineno")[:100]]'])
+        lines.extend(['    f = open("' + PROFILE_FILE_NAME + '", "wb")',
+                      '    f.write(base64.b64encode(dill.dumps(_lsf_faas_profile)))',
+                      '    f.close()'])
+        return lines
+
+
+    def __generateScript(self, func, *arguments, prelude = [], profile = False, marker = None, tail = False):
+        import dill
+        try:
+            lines = self.__scriptHeader(func, prelude, marker, tail)
 
             counts = 1
             args_strings = ''
@@ -142,6 +701,12 @@ class lsf(object):
             # 1. keep the orginal data type
             # 2. the generate script file will be transfered from/to socket, so must change the bytes to str
             for tmp in arguments:
+                if isinstance(tmp, ObjectRef):
+                    # loaded from the staged copy, see put()
+                    lines.append('arg' + str(counts) + ' = ' + self.__refArgument(tmp))
+                    args_strings = args_strings + 'arg' + str(counts) + ', '
+                    counts +=1
+                    continue
                 # serializable:
                 # dill.dumps(): returns the encapsulated object(tmp) as a byte object,
                 # base64.b64encode(): return the b'strings', since the characters in 3.x are unicode encodings and the arguments to the b64encode function are of type byte
@@ -151,47 +716,307 @@ class lsf(object):
                 # bytes(): change the str to type bytes
                 # base64.b64decode()
                 # dill.loads(): return object
-                tmp_file.write('arg'+ str(counts) + ' = \"' + str(base64.b64encode(dill.dumps(tmp)),'utf-8') + '\" \n')
-                args_strings = args_strings + 'dill.loads(base64.b64decode(bytes(arg' + str(counts) +', encoding = "utf8"))), '
+                lines.append('arg'+ str(counts) + ' = \"' + str(base64.b64encode(dill.dumps(tmp)),'utf-8') + '\" ')
+                if profile:
+                    # decoded before the profiler starts, so only the function is profiled
+                    lines.append('arg' + str(counts) + ' = dill.loads(base64.b64decode(bytes(arg' + str(counts) + ', encoding = "utf8")))')
+                    args_strings = args_strings + 'arg' + str(counts) + ', '
+                else:
+                    args_strings = args_strings + 'dill.loads(base64.b64decode(bytes(arg' + str(counts) +', encoding = "utf8"))), '
 
                 counts +=1
 
-            tmp_file.write('result = ' + func.__name__ + '(' )
             # remove the last chars ","
             if len(args_strings) > 2:
-                tmp_file.write(args_strings[:-2])
+                args_strings = args_strings[:-2]
+            call = 'result = ' + func.__name__ + '(' + args_strings + ') '
+            lines.append('_lsf_faas_times["call"] = _lsf_faas_time.time()')
+            if profile:
+                lines.extend(self.__scriptProfile(call, profile))
             else:
-                tmp_file.write(args_strings)
+                lines.append(call)
+            lines.append('_lsf_faas_times["call_end"] = _lsf_faas_time.time()')
+            lines.extend(self.__scriptResult())
+
+        except Exception as e:
+            return False, 'Found error when generate data: %s' % e
+
+        return self.__scriptBytes(lines)
 
-            tmp_file.write(') \n')
 
-            tmp_file.write('str = dill.dumps(result)\n')
-            tmp_file.write('f = open("' + OUTPUT_FILE_NAME + '", "wb")\n')
-            tmp_file.write('f.write(base64.b64encode(str))\n')
-            tmp_file.write('f.close()\n')
-            tmp_file.write('\n')
+    def __generateMapScript(self, func, chunk, prelude = [], marker = None, reducer = None, target = None, tail = False, isolate = False):
+        # each element of chunk is the argument tuple of one call. The whole chunk is run by one job and
+        # fanned out over a local process pool sized from the slots LSF allocated on the execution host.
+        # With a reducer, the results are reduced to one, kept as target in staging_dir if it is given.
+        # With isolate, a call raising does not fail the job: each result is (True, value) or (False, traceback)
+        import dill
+        try:
+            lines = self.__scriptHeader(func, prelude, marker, tail)
+            if reducer is not None:
+                lines.extend(self.__scriptReducer(reducer))
+            # every call and its result is passed through dill, so the pool workers can handle
+            # anything the caller can serialize
+            # the object references are passed by name with their positions, and loaded in the worker;
+            # the array shards by their descriptor
+            lines.append('def _lsf_faas_call(data):')
+            lines.append('    args, refs = dill.loads(data)')
+            lines.append('    for i in refs:')
+            lines.append('        args[i] = _lsf_faas_load_shard(*args[i]) if isinstance(args[i], tuple) else _lsf_faas_load_ref(args[i])')
+            lines.append('    return dill.dumps(' + func.__name__ + '(*args))')
+            lines.append('')
+            if isolate:
+                lines.append('_lsf_faas_run = _lsf_faas_call')
+                lines.append('')
+                lines.append('def _lsf_faas_call(data):')
+                lines.append('    try:')
+                lines.append('        return dill.dumps((True, dill.loads(_lsf_faas_run(data))))')
+                lines.append('    except Exception:')
+                lines.append('        import traceback')
+                lines.append('        traceback.print_exc()')
+                lines.append('        return dill.dumps((False, traceback.format_exc()))')
+                lines.append('')
+            calls = []
+            for args in chunk:
+                refs = [i for i, arg in enumerate(args) if isinstance(arg, ObjectRef)]
+                calls.append(dill.dumps(([self.__refDescriptor(arg) if isinstance(arg, ObjectRef) else arg for arg in args], refs)))
+            lines.append('if __name__ == "__main__":')
+            lines.append('    chunk = \"' + str(base64.b64encode(dill.dumps(calls)),'utf-8') + '\" ')
+            lines.append('    chunk = dill.loads(base64.b64decode(bytes(chunk, encoding = "utf8")))')
+            lines.append('    _lsf_faas_times["call"] = _lsf_faas_time.time()')
+            lines.append('    workers = min(int(os.environ.get("LSB_DJOB_NUMPROC", "1")), len(chunk))')
+            lines.append('    if workers > 1:')
+            lines.append('        from concurrent.futures import ProcessPoolExecutor')
+            lines.append('        with ProcessPoolExecutor(max_workers = workers) as pool:')
+            lines.append('            result = list(pool.map(_lsf_faas_call, chunk, chunksize = max(1, len(chunk) // (workers * 4))))')
+            lines.append('    else:')
+            lines.append('        result = [_lsf_faas_call(data) for data in chunk]')
+            lines.append('    result = [dill.loads(data) for data in result]')
+            if reducer is not None:
+                lines.append('    result = functools.reduce(_lsf_faas_reducer, result)')
+            lines.append('    _lsf_faas_times["call_end"] = _lsf_faas_time.time()')
+            lines.extend(['    ' + line for line in self.__scriptResult(target)])
 
         except Exception as e:
-            tmp_file.close()
             return False, 'Found error when generate data: %s' % e
 
-        finally:
-            tmp_file.close()
-        return True, script_name
+        return self.__scriptBytes(lines)
+
+
+    def __generateReduceScript(self, func, reducer, sources, target = None, prelude = [], marker = None, tail = False):
+        # reduce the intermediate results sources of map_reduce(), in order, and remove them.
+        #   func is the mapper, so the script has the same imports as the map jobs
+        try:
+            lines = self.__scriptHeader(func, prelude, marker, tail)
+            lines.extend(self.__scriptReducer(reducer))
+            lines.append('if __name__ == "__main__":')
+            lines.append('    _lsf_faas_times["call"] = _lsf_faas_time.time()')
+            lines.append('    paths = [_lsf_faas_staged(name) for name in ' + repr(sources) + ']')
+            lines.append('    result = []')
+            lines.append('    for path in paths:')
+            lines.append('        f = open(path, "rb")')
+            lines.append('        result.append(dill.load(f))')
+            lines.append('        f.close()')
+            lines.append('    result = functools.reduce(_lsf_faas_reducer, result)')
+            lines.append('    _lsf_faas_times["call_end"] = _lsf_faas_time.time()')
+            lines.extend(['    ' + line for line in self.__scriptResult(target)])
+            lines.append('    for path in paths:')
+            lines.append('        os.remove(path)')
+            lines.append('    try:')
+            lines.append('        # by the last reduce job, then reduce/ once no other reduction uses it')
+            lines.append('        os.rmdir(os.path.dirname(paths[0]))')
+            lines.append('        os.rmdir(os.path.dirname(os.path.dirname(paths[0])))')
+            lines.append('    except OSError:')
+            lines.append('        pass')
+
+        except Exception as e:
+            return False, 'Found error when generate data: %s' % e
+
+        return self.__scriptBytes(lines)
+
+
+    def __stagePrelude(self):
+        # must be the first lines of the script: the staged files may be needed by the imports
+        return ['import os',
+                'import sys',
+                'import time',
+                '',
+                'def _lsf_faas_staged(name):',
+                '    path = os.path.join(os.path.expanduser(' + json.dumps(self.staging_dir) + '), name)',
+                '    end_time = time.time() + ' + str(self.stage_timeout),
+                '    while not os.path.exists(path):',
+                '        if time.time() > end_time:',
+                '            raise FileNotFoundError("The staged file %s ' + STAGED_MISSING + '." % path)',
+                '        time.sleep(1)',
+                '    return path',
+                '']
+
+
+    def __refLoader(self):
+        return ['import getpass',
+                'import mmap',
+                'import shutil',
+                'import tempfile',
+                '',
+                '_lsf_faas_refs = {}',
+                '',
+                'def _lsf_faas_load_ref(name):',
+                '    # the staged object is copied once to the local disk of the host, shared by the jobs running there,',
+                '    # and unpickled from a read-only memory map of that copy',
+                '    if name not in _lsf_faas_refs:',
+                '        local = os.path.join(tempfile.gettempdir(), "lsf_faas-" + getpass.getuser(), name)',
+                '        if not os.path.exists(local):',
+                '            os.makedirs(os.path.dirname(local), exist_ok = True)',
+                '            shutil.copyfile(_lsf_faas_staged(name), local + "." + str(os.getpid()))',
+                '            os.replace(local + "." + str(os.getpid()), local)',
+                '        f = open(local, "rb")',
+                '        m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)',
+                '        import dill',
+                '        _lsf_faas_refs[name] = dill.Unpickler(m).load()',
+                '        m.close()',
+                '        f.close()',
+                '    return _lsf_faas_refs[name]',
+                '',
+                'def _lsf_faas_load_shard(name, offset, shape, descr):',
+                '    # only the slice of the staged array is mapped, read-only and without copy',
+                '    import numpy',
+                '    dtype = numpy.lib.format.descr_to_dtype(descr)',
+                '    if 0 in shape:',
+                '        return numpy.empty(shape, dtype)',
+                '    return numpy.memmap(_lsf_faas_staged(name), dtype = dtype, mode = "r", offset = offset, shape = shape)',
+                '']
+
+
+    def __refDescriptor(self, ref):
+        # an ObjectRef argument of a map() call, see __generateMapScript()
+        if isinstance(ref, ArrayShard):
+            return (ref.name, ref.offset, ref.shape, ref.descr)
+        return ref.name
+
+
+    def __refArgument(self, ref):
+        # how the job script loads an ObjectRef argument
+        if isinstance(ref, ArrayShard):
+            return '_lsf_faas_load_shard(%r, %d, %r, %r)' % (ref.name, ref.offset, ref.shape, ref.descr)
+        return '_lsf_faas_load_ref(%r)' % ref.name
+
+
+    def __stage(self, path, name, session = None):
+        # upload the file once by a staging job, which copies it to staging_dir/name on the cluster of
+        # the session, then all the jobs there use the staged copy
+        known = self.__staged[session].get(name)
+        if known is True:
+            return True, name
+        if known is not None:
+            if not self.__stagingFailed(name, known, session):
+                return True, name
+            # staged again
+            self.__dropStaged([name], session)
+        with self.__stage_lock:
+            return self.__submitStage(path, name, session)
+
+
+    def __stagingFailed(self, name, jobid, session):
+        # whether the staging job exited; it is asked at most every interval seconds
+        key = (session, name)
+        now = time.time()
+        with self.__stage_lock:
+            if now - self.__stage_checked.get(key, 0) < self.interval:
+                return False
+            self.__stage_checked[key] = now
+        success, content = self.__request(getJobStatus, jobid, self.__sessionDir(session))
+        if not success:
+            return False
+        if content['status'] == 'Done':
+            self.__confirmStaged([name], session)
+        return content['status'] == 'Exit'
+
+
+    def __submitStage(self, path, name, session):
+        if name in self.__staged[session]:
+            return True, name
+
+        success, script = self.__scriptBytes([
+            'import os',
+            'import shutil',
+            '',
+            'path = os.path.join(os.path.expanduser(' + json.dumps(self.staging_dir) + '), ' + json.dumps(name) + ')',
+            'if not os.path.exists(path):',
+            '    os.makedirs(os.path.dirname(path), exist_ok = True)',
+            '    shutil.copyfile(' + json.dumps(os.path.basename(path)) + ', path + "." + str(os.getpid()))',
+            '    os.replace(path + "." + str(os.getpid()), path)'])
+        if not success:
+            return False, script
+
+        success, content = self.__request(submitJob, script, path, self.__sessionDir(session), False, None, self.__progress(name))
+        if success:
+            self.__staged[session][name] = int(content)
+            return True, name
+        else:
+            return False, content
+
+
+    def __settleStaged(self, names, status, message, session = None):
+        # a job using the staged files is done, so they are on the cluster. When it exits, the files not confirmed
+        #   yet (their staging job may have failed) and the ones it did not find (staging_dir was cleaned) are
+        #   dropped, so the next call using them stages them again
+        if status == 'Done':
+            self.__confirmStaged(names, session)
+        elif status == 'Exit':
+            staged = self.__staged.get(session, {})
+            missing = STAGED_MISSING in str(message)
+            self.__dropStaged([name for name in names if staged.get(name) is not True or missing and name in str(message)], session)
+
+
+    def __dropStaged(self, names, session = None):
+        staged = self.__staged.get(session, {})
+        with self.__session_lock:
+            names = [name for name in names if name in staged]
+            if len(names) == 0:
+                return
+            for name in names:
+                del staged[name]
+            # the file keeps the names confirmed
+            path = os.sep.join([self.__sessionDir(session), STAGED_FILE])
+            try:
+                f = open(path + '.' + str(os.getpid()), 'w')
+                f.write(''.join(name + '\n' for name, known in staged.items() if known is True))
+                f.close()
+                os.replace(path + '.' + str(os.getpid()), path)
+            except Exception as e:
+                pass
+
+
+    def __confirmStaged(self, names, session = None):
+        # a job using the staged files is done, so they are on the cluster
+        staged = self.__staged.get(session, {})
+        for name in names:
+            if staged.get(name) is True:
+                continue
+            with self.__session_lock:
+                if staged.get(name) is True:
+                    continue
+                staged[name] = True
+                try:
+                    f = open(os.sep.join([self.__sessionDir(session), STAGED_FILE]), 'a')
+                    f.write(name + '\n')
+                    f.close()
+                except Exception as e:
+                    pass
 
 
-    def __checkMessage(self, message):
+    def __checkMessage(self, message, session = None):
         if SESSION_LOGOUT in message:
             print(message)
-            self.__is_logged = False
-            removeToken(self.work_dir)
-        elif CANNOT_CONNECT_SERVER == message:
-            print(message +'The server may be terminated. Please make sure the IBM Spectrum Application Center is running and then logon again.')
-            self.__is_logged = False
-            removeToken(self.work_dir)
+            if session is None:
+                self.__is_logged = False
+            removeToken(self.__sessionDir(session))
+        elif CANNOT_CONNECT_SERVER == message or SERVER_UNAVAILABLE == message:
+            # keep the token: the session is still valid if the server comes back
+            print(message +' The server may be terminated or overloaded. Please make sure the IBM Spectrum Application Center is running and then try again.')
         elif TOKEN_IS_DELETED == message:
             print(message +'Please logon again.')
-            self.__is_logged = False
+            if session is None:
+                self.__is_logged = False
         else:
             print(message)
 
@@ -207,36 +1032,46 @@ class lsf(object):
         return
 
 
-    def __getSubmitResult(self, future, func_id, cur_workdir):
+    def __getSubmitResult(self, future, func_id):
 
         success, content = future.result()
-        value = {}
+        value = self.__func_d[func_id]
         if success:
             jobid = int(content)
-            value['jobid'] = jobid
-            value['status'] = 'Send'
-            value['output'] = None
-            self.__func_d[func_id] = value
+            with self.__funcLock(func_id):
+                value['jobid'] = jobid
+                value['output'] = None
+                value['status'] = 'Send'
+            self.__running(func_id, value)
+            self.__startPrefetch()
             return func_id
         else:
-            self.__checkMessage(content)
-            shutil.rmtree(cur_workdir)
+            # not to be reported as uploading for ever
+            with self.__funcLock(func_id):
+                value['status'] = 'Exit'
+                value['message'] = content
+            with self.__session_lock:
+                self.__sessions[value['session']]['running'].discard(func_id)
+            self.__observe(func_id, value, 'Exit')
+            self.__checkMessage(content, value['session'])
             return None
 
 
-    def __waitFinish(self, id, func_id, timeout, cur_workdir):
+    def __waitFinish(self, id, func_id, timeout, cur_workdir, staged = [], session = None):
         is_interrupted = False
         output = {}
         output['jobid'] = id
         output['status'] = 'Send'
+        output['session'] = session
         print('Waiting...')
 
         # To reduce waiting error, use timestamp to calculate
         end_time = time.time() + timeout
         while time.time() < end_time:
             try:
-                success, content = getJobOutput(id, cur_workdir, self.work_dir)
+                success, content = self.__getJobOutput(id, func_id, cur_workdir, session)
                 if success:
+                    self.__settleStaged(staged, content['status'], content.get('message'), session)
                     if content['status'] == 'Done':
                         print('Done.')
                         return content['output']
@@ -245,10 +1080,10 @@ class lsf(object):
                         return content['message']
 
                 else:
-                    self.__checkMessage(content)
+                    self.__checkMessage(content, session)
                     return None
 
-                time.sleep(self.interval)
+                self.__waitMarker(func_id, self.interval)
 
             except KeyboardInterrupt:
                 is_interrupted = True
@@ -260,16 +1095,21 @@ class lsf(object):
             print('Timeout. The task will be canceled.')
 
         self.__func_d[func_id] = output
-        success, content = doAction(str(id), 'kill', self.work_dir)
+        self.__unwatch(func_id)
+        success, content = self.__request(doAction, str(id), 'kill', self.__sessionDir(session))
         # if timeout or interrupted, should always return the func_id after kill it
         return func_id
 
 
-    def __submit(self, func, *arguments, files = None, block = False, timeout = 60, asynchronous = False):
-        if not self.__is_logged:
+    def __submit(self, func, *arguments, files = None, block = False, timeout = 60, asynchronous = False, chunk = None, slots = None, tags = None, profile = False, session = None, reduce = None, isolate = False, learn = None):
+        if not self.__isLogged():
             print ('Please logon before using this function.')
             return None
 
+        if not self.__is_cleaned:
+            self.__is_cleaned = True
+            threading.Thread(target = self.__cleanWorkDir, daemon = True).start()
+
         paths = None
         if files != None:
             if files != '':
@@ -281,191 +1121,1327 @@ class lsf(object):
                     return None
 
         func_id = str(uuid.uuid4())
-
+        # created when the output is downloaded
         cur_workdir = os.sep.join([self.work_dir, func_id])
-        os.makedirs(cur_workdir)
-
-        script_name = os.sep.join([cur_workdir ,SCRIPT_FILE_NAME])
 
-        success, content = self.__generateScript(script_name, func, *arguments)
+        prelude = []
+        staged = []
+        # (path, name) of the files to stage on the cluster the function is sent to
+        uploads = []
+        if self.bundle:
+            roots, imports = collectModules(func)
+            if len(roots) > 0:
+                success, content = buildBundle(roots, self.work_dir)
+                if not success:
+                    print(content)
+                    return None
+                name = BUNDLE_DIR_NAME + '/' + os.path.basename(content)
+                uploads.append((content, name))
+                staged.append(name)
+                prelude = self.__stagePrelude()
+                prelude.append('sys.path.insert(0, _lsf_faas_staged("' + name + '"))')
+                prelude.extend(imports)
+                prelude.append('')
+
+        calls = [arguments] if chunk is None else chunk
+        refs = {}
+        for args in calls:
+            for arg in args:
+                if isinstance(arg, ObjectRef):
+                    refs[arg.name] = arg.path
+        if len(refs) > 0:
+            if len(prelude) == 0:
+                prelude = self.__stagePrelude()
+            prelude.extend(self.__refLoader())
+            for name in sorted(refs):
+                uploads.append((refs[name], name))
+                staged.append(name)
+
+        # read once, the script and the entry of the function agree
+        tail = self.tail_output
+        if reduce is not None and chunk is None:
+            # a node of a map_reduce() tree
+            if len(prelude) == 0:
+                prelude = self.__stagePrelude()
+            success, script = self.__generateReduceScript(func, reduce['reducer'], reduce['sources'], reduce['target'], prelude = prelude, marker = func_id, tail = tail)
+        elif chunk is None:
+            success, script = self.__generateScript(func, *arguments, prelude = prelude, profile = profile, marker = func_id, tail = tail)
+        elif reduce is not None:
+            success, script = self.__generateMapScript(func, chunk, prelude = prelude, marker = func_id, reducer = reduce['reducer'], target = reduce['target'], tail = tail)
+        else:
+            success, script = self.__generateMapScript(func, chunk, prelude = prelude, marker = func_id, tail = tail, isolate = isolate)
         if not success:
-            print(content)
+            print(script)
             return None
 
-        os.chmod(script_name, 0o744)
         value = {}
-        # only for upload file
-        if not block and paths != None and asynchronous:
-            if self.__thread_pool is None:
-                self.__thread_pool = ThreadPoolExecutor(max_workers=5)
-            future_task = self.__thread_pool.submit(submitJob, script_name, paths, self.work_dir, asynchronous)
-            future_task.add_done_callback(functools.partial(self.__getSubmitResult, func_id = func_id, cur_workdir = cur_workdir))
-            value['status'] = 'uploading'
-            print('uploading')
-            self.__func_d[func_id] = value
-            return func_id
+        value['staged'] = staged
+        value['func'] = func.__name__
+        # kept to submit the same job again while it runs, see speculate(); the script is not kept in memory
+        value['paths'] = paths
+        value['slots'] = slots
+        if chunk is not None:
+            # the number of results, see gather()
+            value['calls'] = len(chunk)
+        value['profile'] = profile
+        if tail:
+            # the next segment to read, see tail()
+            value['tail'] = 0
+        if reduce is not None:
+            value['reduce'] = reduce['tree']
+        if learn is not None:
+            # its runtime is learnt once it is done, see __probe()
+            value['learn'] = learn
+        if tags is None:
+            value['tags'] = set()
+        elif isinstance(tags, str):
+            value['tags'] = set([tags])
+        else:
+            value['tags'] = set(tags)
+
+        if session is None:
+            candidates = self.__route()
+        elif session in self.__sessions:
+            candidates = [session]
+        else:
+            print('Unknown session %s, please logon with it first.' % session)
+            return None
+        for session in candidates:
+            value['session'] = session
+            session_dir = self.__sessionDir(session)
+            success, content = True, ''
+            for path, name in uploads:
+                success, content = self.__stage(path, name, session)
+                if not success:
+                    break
+            if not success:
+                pass
+            # only for upload file
+            elif not block and paths != None and asynchronous:
+                # known before the upload starts, the callback may run at once
+                value['status'] = 'uploading'
+                self.__func_d[func_id] = value
+                future_task = self.__threadPool().submit(self.__request, submitJob, script, paths, session_dir, asynchronous, slots, self.__progress(func_id))
+                future_task.add_done_callback(functools.partial(self.__getSubmitResult, func_id = func_id))
+                print('uploading')
+                return func_id
+            else:
+                success, content = self.__request(submitJob, script, paths, session_dir, asynchronous, slots, self.__progress(func_id))
+            # fail over to the next session when the server is down
+            if success or content not in (CANNOT_CONNECT_SERVER, SERVER_UNAVAILABLE):
+                break
 
-        success, content = submitJob(script_name, paths, self.work_dir, asynchronous)
         if success:
             jobid = int(content)
+            self.__running(func_id, value)
             if block:
-                return self.__waitFinish(jobid, func_id, timeout, cur_workdir)
+                if profile:
+                    # kept for profile(), as exe() returns the output
+                    value['jobid'] = jobid
+                    value['status'] = 'Send'
+                    self.__func_d[func_id] = value
+                    self.__last_profiled = func_id
+                output = self.__waitFinish(jobid, func_id, timeout, cur_workdir, staged, session)
+                value['jobid'] = jobid
+                self.__observe(func_id, value, 'Done')
+                return output
             else:
                 value['jobid'] = jobid
                 value['status'] = 'Send'
                 value['output'] = None
                 self.__func_d[func_id] = value
+                self.__startPrefetch()
                 return func_id
         else:
-            self.__checkMessage(content)
-            shutil.rmtree(cur_workdir)
+            self.__checkMessage(content, session)
             return None
 
 
-    def logon(self, username = getpass.getuser(), password = '123456', host = 'localhost', port=8080, isHttps = False):
-        """
-        Use the specified username/password to log on the specified AC web server.
-
-        Return True if success, otherwise return false.
-        """
-        # remove old token
-        removeToken(self.work_dir)
-        # always logon as server may be shutdown or terminated
-        success, content = logonAC(username, password, host, port, isHttps, self.work_dir)
-        if success:
-            self.__is_logged = True
-            return True
+    def __route(self):
+        # the sessions to try in order. When all the available sessions have reached their limit,
+        #   wait for some of their functions to finish
+        with self.__session_lock:
+            names = [name for name in self.__sessions if name is not None]
+        if len(names) == 0:
+            return [None]
+        while True:
+            available = [name for name in names if isAvailable(self.__sessionDir(name))]
+            if len(available) == 0:
+                # the requests fail with the reason
+                return names
+            free = [name for name in available if not self.__isFull(name)]
+            if len(free) == 0:
+                for name in available:
+                    self.__refreshSession(name)
+                free = [name for name in available if not self.__isFull(name)]
+            if len(free) > 0:
+                break
+            time.sleep(self.interval)
+
+        def load(name):
+            record = self.__sessions[name]
+            if record['limit']:
+                return len(record['running']) / float(record['limit'])
+            return len(record['running'])
+        if self.routing == 'load':
+            free.sort(key = load)
         else:
-            print(content)
-            self.__is_logged = False
-            return False
+            # a session without observed queue wait is tried first
+            free.sort(key = lambda name: (self.__sessions[name]['queue'] or 0, load(name)))
+        return free + [name for name in available if name not in free]
+
+
+    def __isFull(self, session):
+        record = self.__sessions[session]
+        return record['limit'] is not None and len(record['running']) >= record['limit']
+
+
+    def __running(self, func_id, value):
+        value['submitted'] = time.time()
+        with self.__session_lock:
+            self.__sessions[value['session']]['running'].add(func_id)
+        self.__watch(func_id)
+
+
+    def __observe(self, func_id, value, status):
+        # track the running functions of the sessions and their queue wait, from the status seen
+        if status in ('Done', 'Exit'):
+            self.__unwatch(func_id)
+            key = value.pop('learn', None)
+            if key is not None and status == 'Done':
+                self.__threadPool().submit(self.__learn, func_id, value, key)
+            elif key is not None:
+                with self.__local_lock:
+                    self.__probes.pop(key, None)
+        record = self.__sessions.get(value.get('session'))
+        if record is None or 'submitted' not in value:
+            return
+        with self.__session_lock:
+            if status not in ('Send', 'Pend', 'PSUSP', 'uploading') and 'started' not in value:
+                value['started'] = time.time()
+                wait = value['started'] - value['submitted']
+                record['queue'] = wait if record['queue'] is None else 0.8 * record['queue'] + 0.2 * wait
+            if status in ('Done', 'Exit'):
+                record['running'].discard(func_id)
+
+
+    def __refreshSession(self, session):
+        jobs = {}
+        for func_id in list(self.__sessions[session]['running']):
+            value = self.__func_d.get(func_id)
+            if value is None or value.get('jobid') is None:
+                continue
+            jobs[value['jobid']] = func_id
+        if len(jobs) == 0:
+            return
+        success, content = self.__request(getJobsStatus, list(jobs), self.__sessionDir(session))
+        if not success:
+            return
+        for jobid, func_id in jobs.items():
+            # the jobs the server does not know any more are finished
+            self.__observe(func_id, self.__func_d[func_id], content.get(jobid, 'Done'))
 
 
-    def logout(self):
-        """
-        Log out from AC web server.
-        """
-        if self.__is_logged:
-            success, content = logoutAC(self.work_dir)
-            # no matter success or not, also force logout
-            self.__is_logged =False
-            removeToken(self.work_dir)
-            if self.__thread_pool != None:
-                self.__thread_pool.shutdown()
-            if not success:
-                print(content)
-        else:
-            print ('You are not logged yet.' )
+    def __watch(self, func_id):
+        # wait for the completion marker of the function, see marker_dir
+        if self.marker_dir is None:
+            return
+        with self.__marker_cond:
+            self.__markers[func_id] = None
+            if self.__watcher is None:
+                self.__watcher = threading.Thread(target = self.__watchLoop, daemon = True)
+                self.__watcher.start()
 
 
-    def get(self,id):
-        """
-        Get the output based on the specified function id (which returned by sub()).
+    def __unwatch(self, func_id):
+        with self.__marker_cond:
+            self.__markers.pop(func_id, None)
 
-        Return the return value(if any) of function if succeeds, or error string if error found,
-          or 'None' if function is uploading/pending/running...
 
-        As this routine returns an indefinite number of values. To avoid number of arguments does not match,
-          please use an argument to receive the return value. If no error message is printed, then iterate the output on demand.
-        """
-        # assume the id is func_id by default
-        if id is None:
-            print('Input id is null.')
-            return None
+    def __marker(self, func_id):
+        # the completion marker of the function, None if it is not found (yet)
+        with self.__marker_cond:
+            return self.__markers.get(func_id)
+
+
+    def __waitMarker(self, func_id, timeout, found = None):
+        # sleep until the completion marker of the function is found, or the timeout. If func_id is None,
+        #   until any marker is found after the first found markers (see __marker_found)
+        with self.__marker_cond:
+            if func_id is None:
+                self.__marker_cond.wait_for(lambda: self.__marker_found != found, timeout)
+            else:
+                self.__marker_cond.wait_for(lambda: self.__markers.get(func_id) is not None, timeout)
+
+
+    def __watchLoop(self):
+        marker_dir = os.path.expanduser(self.marker_dir)
         try:
-            value = self.__func_d[id]
-            status = value['status']
-            if status == 'Done':
-                return  value['output']
-            if status == 'Exit':
-                print('Task status is %s' % status)
-                return value['message']
-            if status == 'uploading':
-                 print('uploading...')
-                 return None
+            if not os.path.exists(marker_dir):
+                os.makedirs(marker_dir)
+        except OSError:
+            pass
+        fd = openWatch(marker_dir)
+        scanned = 0
+        try:
+            while True:
+                with self.__marker_cond:
+                    if all(marker is not None for marker in self.__markers.values()):
+                        # watched again by a new watcher
+                        self.__watcher = None
+                        return
+                names = waitEvents(fd, self.marker_scan)
+                if time.time() - scanned >= self.marker_scan:
+                    # inotify does not see the markers written by the other hosts
+                    scanned = time.time()
+                    names.extend(scanMarkers(marker_dir))
+                found = {}
+                for name in set(names):
+                    func_id = name[:-len(MARKER_SUFFIX)]
+                    if not name.endswith(MARKER_SUFFIX) or func_id not in self.__markers:
+                        # written by another client
+                        continue
+                    marker = readMarker(os.sep.join([marker_dir, name]))
+                    if marker is not None:
+                        found[func_id] = marker
+                        try:
+                            os.remove(os.sep.join([marker_dir, name]))
+                        except OSError:
+                            pass
+                if len(found) > 0:
+                    with self.__marker_cond:
+                        for func_id, marker in found.items():
+                            if func_id in self.__markers:
+                                self.__markers[func_id] = marker
+                                self.__marker_found += 1
+                        self.__marker_cond.notify_all()
+        finally:
+            if fd is not None:
+                os.close(fd)
 
-            # if task is not finished, just receive status from the server
-            jobid = value['jobid']
-            cur_workdir = os.sep.join([self.work_dir , str(id)])
-        except Exception as e:
-            # no key exists: try to restore data from work_dir
-            cur_workdir = os.sep.join([self.work_dir, str(id)])
-            is_exists = os.path.exists(cur_workdir)
-            if is_exists:
-                value = {}
-                for root,dirs,files in os.walk(cur_workdir):
-                    for file in files:
-                        if LSF_ERRPUT_FILE_NAME in file:
-                            f = open(os.sep.join([cur_workdir , file]), "rb")
-                            content = f.read().decode('utf-8')
-                            f.close()
-                            value['message'] =  content
-                            if len(content) > 0:
-                                print('Task status is Exit')
-                                value['status'] = 'Exit'
-                                self.__func_d[id] = value
-                                return value['message']
-                        if OUTPUT_FILE_NAME in file:
-                            f = open(os.sep.join([cur_workdir , file]), "rb")
-                            value['output'] =  dill.load(f)
-                            f.close()
-                            if len(content) > 0:
-                                value['status'] = 'Done'
-                                self.__func_d[id] = value
-                                return value['output']
 
-            # may be the id is job id.
-            for value in self.__func_d.values():
-                jobid = value['jobid']
-                if id == jobid:
-                    status = value['status']
+    def __getJobOutput(self, id, func_id, cur_workdir, session):
+        # as getJobOutput(), but a job known to be finished from its completion marker is downloaded at once
+        marker = self.__marker(func_id)
+        session_dir = self.__sessionDir(session)
+        if marker is not None:
+            try:
+                if not os.path.exists(cur_workdir):
+                    os.makedirs(cur_workdir)
+                success, content = self.__request(downloadFiles, str(id), cur_workdir, OUTPUT_FILE_NAME + ',' + LSF_ERRPUT_FILE_NAME, session_dir, False, self.__progress(func_id))
+                if success:
+                    content = readJobOutput(cur_workdir)
+                    content['jobid'] = id
+                    content['status'] = marker['status']
+                    return True, content
+            except Exception:
+                pass
+            # asked to the server as usual
+            self.__unwatch(func_id)
+        return self.__request(getJobOutput, id, cur_workdir, session_dir, self.__progress(func_id))
+
+
+    def __isPrefetching(self, value):
+        # whether the prefetcher still has to watch the function
+        if value.get('jobid') is None or value['status'] in ('Done', 'Exit'):
+            return False
+        return not ('prefetched' in value or value.get('speculating') or 'batch' in value or 'reduce' in value)
+
+
+    def __startPrefetch(self):
+        if not self.prefetch:
+            return
+        with self.__prefetch_lock:
+            if self.__prefetcher is None:
+                self.__prefetcher = threading.Thread(target = self.__prefetchLoop, daemon = True)
+                self.__prefetcher.start()
+
+
+    def __prefetchLoop(self):
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers = self.prefetch_workers)
+        fetching = set()
+        polled = 0
+        try:
+            while True:
+                found = self.__marker_found
+                with self.__prefetch_lock:
+                    # decided under the lock, so a function submitted meanwhile starts a new prefetcher
+                    # session -> job id -> function id, the job ids are given by each cluster
+                    sessions = {}
+                    # the functions known to be finished from their completion marker
+                    finished = []
+                    for func_id, value in list(self.__func_d.items()):
+                        if func_id not in fetching and self.__isPrefetching(value):
+                            marker = self.__marker(func_id)
+                            if marker is not None:
+                                finished.append((func_id, value['jobid'], marker['status']))
+                            else:
+                                sessions.setdefault(value.get('session'), {})[value['jobid']] = func_id
+                    if len(sessions) == 0 and len(finished) == 0 and len(fetching) == 0 or not self.prefetch:
+                        self.__prefetcher = None
+                        return
+
+                for func_id, jobid, status in finished:
+                    self.__observe(func_id, self.__func_d[func_id], status)
+                    fetching.add(func_id)
+                    pool.submit(self.__prefetchOne, func_id, jobid, status, fetching)
+                # woken by the markers, the status is still polled every interval
+                if time.time() - polled >= self.interval:
+                    polled = time.time()
+                    for session, jobs in sessions.items():
+                        success, content = self.__request(getJobsStatus, list(jobs), self.__sessionDir(session))
+                        if success:
+                            for jobid, status in content.items():
+                                if jobid not in jobs:
+                                    continue
+                                self.__observe(jobs[jobid], self.__func_d[jobs[jobid]], status)
+                                if status in ('Done', 'Exit'):
+                                    fetching.add(jobs[jobid])
+                                    pool.submit(self.__prefetchOne, jobs[jobid], jobid, status, fetching)
+                self.__waitMarker(None, max(0, polled + self.interval - time.time()), found)
+        finally:
+            pool.shutdown(wait = False)
+
+
+    def __prefetchOne(self, func_id, jobid, status, fetching):
+        value = self.__func_d[func_id]
+        size = 0
+        try:
+            # a get() of the same function waits, not to download the files at the same time
+            with self.__funcLock(func_id):
+                if value['status'] in ('Done', 'Exit'):
+                    # got meanwhile
+                    return
+                cur_workdir = os.sep.join([self.work_dir, func_id])
+                if not os.path.exists(cur_workdir):
+                    os.makedirs(cur_workdir)
+                success, content = self.__request(downloadFiles, str(jobid), cur_workdir, OUTPUT_FILE_NAME + ',' + LSF_ERRPUT_FILE_NAME, self.__sessionDir(value.get('session')), False, self.__progress(func_id))
+                if not success:
+                    # get() downloads it as usual
+                    value['prefetched'] = False
+                    return
+                size = sum(os.path.getsize(os.sep.join([cur_workdir, name])) for name in (OUTPUT_FILE_NAME, LSF_ERRPUT_FILE_NAME)
+                           if os.path.exists(os.sep.join([cur_workdir, name])))
+                if self.prefetch_load and value.get('jobid') == jobid:
+                    value.update(readJobOutput(cur_workdir))
+                    value['status'] = status
+                    self.__settleStaged(value.get('staged', []), status, value.get('message'), value.get('session'))
                     if status == 'Done':
-                        return  value['output']
-                    if status == 'Exit':
-                        print('Task status is %s' % status)
-                        return value['message']
+                        self.__cacheOutput(func_id, value)
+                else:
+                    # get() loads the downloaded files without asking the server
+                    value['prefetched'] = status
+        except Exception as e:
+            value['prefetched'] = False
+        finally:
+            fetching.discard(func_id)
+        self.__throttle(size)
 
 
-        # not found: we will send request to the server to recontruct the data
-        if not self.__is_logged:
-            print('Please logon before using this function.')
+    def __throttle(self, size):
+        # keep the average download rate under prefetch_bandwidth; httplib2 reads a response at once,
+        #   so the worker waits after the download for the time it should have taken
+        if not self.prefetch_bandwidth:
+            return
+        with self.__prefetch_lock:
+            now = time.time()
+            self.__prefetch_next = max(now, self.__prefetch_next) + size / float(self.prefetch_bandwidth)
+            delay = self.__prefetch_next - now
+        time.sleep(delay)
+
+
+    def __localPayload(self, func, arguments):
+        # the serialized call if it is to run in the local pool, otherwise None
+        import dill
+        key = (getattr(func, '__module__', None), getattr(func, '__qualname__', func.__name__))
+        if self.local == 'auto':
+            with self.__local_lock:
+                runtime = self.__runtimes.get(key)
+                started = self.__probes.get(key)
+            if runtime is None or runtime > self.local_runtime:
+                # a function never measured runs on LSF first, where it can be canceled however long it runs
+                return None
+        elif not self.local:
             return None
 
-        if not isinstance(jobid,int):
-            print('You must use job id when you want to reconstruct the data.')
+        refs = {}
+        args = list(arguments)
+        for i, arg in enumerate(args):
+            if isinstance(arg, ArrayShard):
+                refs[i] = (arg.path, arg.offset, arg.shape, arg.descr)
+                args[i] = None
+            elif isinstance(arg, ObjectRef):
+                refs[i] = arg.path
+                args[i] = None
+        try:
+            payload = dill.dumps((func, args, refs))
+        except Exception as e:
+            # cannot be sent to a process, the job script reports it
+            return None
+        if self.local == 'auto' and len(payload) > self.local_payload:
             return None
+        return payload
 
-        success, content = getJobOutput(jobid, cur_workdir, self.work_dir)
-        if success :
-            self.__func_d[id] = content
-            status = content['status']
-            if status == 'Done':
-                return content['output']
-            elif status == 'Exit':
-                print('Task status is %s' % status)
-                return content['message']
-            else:
-                return None
-        else:
-            self.__checkMessage(content)
+
+    def __probe(self, func):
+        # the key of the function if its call is to measure its runtime on LSF for local = 'auto', otherwise None.
+        #   One call of a function measures it at a time
+        if self.local != 'auto':
             return None
+        key = (getattr(func, '__module__', None), getattr(func, '__qualname__', func.__name__))
+        with self.__local_lock:
+            if key in self.__runtimes or key in self.__probes:
+                return None
+            self.__probes[key] = time.time()
+        return key
 
 
-    def download(self, id, files, destination = None, asynchronous = False):
-        """
-        Download function data files from AC server to the specified destination.
-        Currently, only can download files that belong to the specified function id (the files must be the function input/output files).
+    def __learn(self, func_id, value, key):
+        # the runtime of a function measured by its job, see __probe()
+        telemetry = self.__telemetry(func_id, value)
+        with self.__local_lock:
+            self.__probes.pop(key, None)
+            if telemetry is not None and key not in self.__runtimes:
+                self.__runtimes[key] = telemetry.get('call', telemetry['wall'])
 
-        Return True if success, otherwise return false.
 
-        Parameters:
-        id: The function id.
-        files: Only support relative path(eg: a.txt or ./a.txt). To specify multiple files, separate with a comma(,).
-        destination: Specify the absolute path. If destination is None, download to work_dir/id.
-        asynchronous: Whether download the files your specified asynchronously. Only use with the 'files' parameter specified.
+    def __submitLocal(self, func, payload, block = False, timeout = 60, tags = None):
+        from concurrent.futures import ProcessPoolExecutor
+        func_id = str(uuid.uuid4())
+        key = (getattr(func, '__module__', None), getattr(func, '__qualname__', func.__name__))
+        value = {}
+        value['func'] = func.__name__
+        value['local'] = True
+        value['jobid'] = None
+        value['status'] = 'Run'
+        value['output'] = None
+        if tags is None:
+            value['tags'] = set()
+        elif isinstance(tags, str):
+            value['tags'] = set([tags])
+        else:
+            value['tags'] = set(tags)
+        with self.__local_lock:
+            if self.__local_pool is None:
+                self.__local_pool = ProcessPoolExecutor(max_workers = self.local_workers)
+            if key not in self.__runtimes:
+                self.__probes.setdefault(key, time.time())
+            value['future'] = self.__local_pool.submit(runLocal, payload)
+        self.__func_d[func_id] = value
+        future = value['future']
+        future.add_done_callback(functools.partial(self.__localDone, func_id = func_id, key = key))
+        if not block:
+            return func_id
 
-        Examples:
-        # Download the function' file a.txt to /tmp/
+        # the callbacks run in order, so the output is set when it is called
+        finished = threading.Event()
+        future.add_done_callback(lambda future: finished.set())
+        try:
+            is_finished = finished.wait(timeout)
+        except KeyboardInterrupt:
+            is_finished = None
+        if not is_finished:
+            # a running process cannot be stopped, only a call not started yet is canceled
+            print('Interrupted. The task will be canceled.' if is_finished is None else 'Timeout. The task will be canceled.')
+            future.cancel()
+            return func_id
+        if value['status'] == 'Exit':
+            print('Exit.')
+            return value['message']
+        return value['output']
+
+
+    def __localDone(self, future, func_id, key):
+        import dill
+        value = self.__func_d[func_id]
+        try:
+            success, content, telemetry = future.result()
+        except Exception as e:
+            # canceled, or the process died
+            success, content, telemetry = False, 'The local function failed: %s' % (str(e) or type(e).__name__), None
+        if telemetry is not None:
+            with self.__local_lock:
+                runtime = self.__runtimes.get(key)
+                self.__runtimes[key] = telemetry['wall'] if runtime is None else 0.8 * runtime + 0.2 * telemetry['wall']
+                self.__probes.pop(key, None)
+            telemetry.update({'func': value['func'], 'jobid': None, 'session': None, 'local': True})
+            value['telemetry'] = telemetry
+        if success:
+            try:
+                output = dill.loads(content)
+            except Exception as e:
+                success, content = False, 'Failed to load the output: %s' % str(e)
+        with self.__funcLock(func_id):
+            if success:
+                value['output'] = output
+                # written to work_dir, so it is counted by cache_size and reloaded once dropped
+                self.__keepOutput(func_id, content)
+            else:
+                value['message'] = content
+            value.pop('future', None)
+            value['status'] = 'Done' if success else 'Exit'
+            if success:
+                self.__cacheOutput(func_id, value)
+
+
+    def __batch(self, func, arguments, files, tags):
+        func_id = str(uuid.uuid4())
+        value = {}
+        value['status'] = 'batched'
+        value['batch'] = None
+        value['func'] = func.__name__
+        if tags is None:
+            value['tags'] = set()
+        elif isinstance(tags, str):
+            value['tags'] = set([tags])
+        else:
+            value['tags'] = set(tags)
+        key = (func, files, tags if tags is None or isinstance(tags, str) else tuple(tags))
+        with self.__batch_lock:
+            batch = self.__batches.get(key)
+            if batch is None:
+                batch = {'ids': [], 'args': []}
+                # not a daemon thread: the calls are submitted before the program exits
+                batch['timer'] = threading.Timer(self.batch_window / 1000.0, self.__flushBatch, args = (key,))
+                self.__batches[key] = batch
+                batch['timer'].start()
+            value['index'] = len(batch['ids'])
+            batch['ids'].append(func_id)
+            batch['args'].append(arguments)
+            self.__func_d[func_id] = value
+            is_full = len(batch['ids']) >= self.batch_size
+        if is_full:
+            self.__flushBatch(key)
+        return func_id
+
+
+    def __flushBatch(self, key):
+        with self.__batch_lock:
+            batch = self.__batches.pop(key, None)
+        if batch is None:
+            return
+        batch['timer'].cancel()
+        func, files, tags = key
+        # a call raising only fails its own handle
+        batch_id = self.__submit(func, files = files, chunk = batch['args'], slots = self.batch_slots, tags = tags, isolate = True)
+        for func_id in batch['ids']:
+            value = self.__func_d[func_id]
+            with self.__funcLock(func_id):
+                if batch_id is None:
+                    value['status'] = 'Exit'
+                    value['message'] = 'Failed to submit the batch of the function.'
+                else:
+                    value['status'] = 'Send'
+                    value['batch'] = batch_id
+
+
+    def __unbatch(self, ids):
+        # take the calls out of the batches not submitted yet, return the ids taken out. The calls of a batch
+        #   being submitted cannot be taken out
+        ids = set(ids)
+        removed = []
+        with self.__batch_lock:
+            for key, batch in list(self.__batches.items()):
+                kept = [(func_id, arguments) for func_id, arguments in zip(batch['ids'], batch['args']) if func_id not in ids]
+                if len(kept) == len(batch['ids']):
+                    continue
+                removed.extend([func_id for func_id in batch['ids'] if func_id in ids])
+                batch['ids'] = [func_id for func_id, arguments in kept]
+                batch['args'] = [arguments for func_id, arguments in kept]
+                for index, func_id in enumerate(batch['ids']):
+                    self.__func_d[func_id]['index'] = index
+                if len(kept) == 0:
+                    batch['timer'].cancel()
+                    del self.__batches[key]
+        for func_id in removed:
+            value = self.__func_d[func_id]
+            with self.__funcLock(func_id):
+                value['status'] = 'Exit'
+                value['message'] = 'The function was canceled.'
+        return removed
+
+
+    def __getBatched(self, id, value):
+        with self.__funcLock(id):
+            batch_id = value['batch']
+            if batch_id is None and value['status'] == 'Exit':
+                print('Task status is Exit')
+                return value['message']
+        if batch_id is None:
+            # not submitted yet
+            return None
+        # taken from the output of the batch every time, so it is cached once
+        output = self.get(batch_id)
+        status = self.__func_d[batch_id]['status']
+        if status == 'Done':
+            # the result of the call, or the traceback of its exception
+            success, output = output[value['index']]
+            with self.__funcLock(id):
+                value['status'] = 'Done' if success else 'Exit'
+            if success:
+                return output
+            print('Task status is Exit')
+            return output
+        if status == 'Exit':
+            with self.__funcLock(id):
+                value['status'] = status
+            return output
+        return None
+
+
+    def __cacheOutput(self, id, value):
+        # count the output in memory, and drop the least recently used ones above cache_size
+        path = os.sep.join([self.work_dir, str(id), OUTPUT_FILE_NAME])
+        if not os.path.exists(path):
+            # an output not downloaded from a job is serialized to be counted and reloaded
+            import dill
+            try:
+                content = dill.dumps(value['output'])
+            except Exception as e:
+                print('Failed to serialize the output of the function %s, it is kept in memory: %s' % (id, str(e)))
+                return
+            if not self.__keepOutput(id, content):
+                return
+        size = os.path.getsize(path)
+        evicted = []
+        with self.__cache_lock:
+            self.__cache_bytes += size - self.__cache.pop(id, 0)
+            self.__cache[id] = size
+            while self.cache_size is not None and self.__cache_bytes > self.cache_size and len(self.__cache) > 1:
+                old_id, old_size = self.__cache.popitem(last = False)
+                self.__cache_bytes -= old_size
+                evicted.append((old_id, old_size))
+        # the outputs are dropped out of the cache lock, under the lock of their function
+        for old_id, old_size in evicted:
+            self.__evict(old_id, old_size)
+
+
+    def __keepOutput(self, id, content):
+        # write the serialized output to work_dir/id, where get() reloads it from
+        cur_workdir = os.sep.join([self.work_dir, str(id)])
+        path = os.sep.join([cur_workdir, OUTPUT_FILE_NAME])
+        try:
+            if not os.path.exists(cur_workdir):
+                os.makedirs(cur_workdir)
+            temporary = '%s.%d.tmp' % (path, threading.get_ident())
+            f = open(temporary, 'wb')
+            f.write(content)
+            f.close()
+            os.replace(temporary, path)
+            return True
+        except Exception as e:
+            print('Failed to write the output of the function %s to %s, it is kept in memory: %s' % (id, path, str(e)))
+            return False
+
+
+    def __evict(self, id, size):
+        # a function busy in another thread (such as in get()) is used right now: it is kept as recently used
+        lock = self.__funcLock(id)
+        if not lock.acquire(blocking = False):
+            with self.__cache_lock:
+                if id not in self.__cache:
+                    self.__cache[id] = size
+                    self.__cache_bytes += size
+            return
+        try:
+            with self.__cache_lock:
+                if id in self.__cache:
+                    # cached again meanwhile
+                    return
+            value = self.__func_d.get(id)
+            if value is not None:
+                value['evicted'] = True
+                value.pop('output', None)
+        finally:
+            lock.release()
+
+
+    def __cachedOutput(self, id, value):
+        # the output of a Done function, reloaded from work_dir if it was dropped
+        with self.__cache_lock:
+            if id in self.__cache:
+                self.__cache.move_to_end(id)
+                return value['output']
+            output = value.get('output')
+        if value.get('evicted'):
+            cur_workdir = os.sep.join([self.work_dir, str(id)])
+            try:
+                output = readJobOutput(cur_workdir)['output']
+            except Exception as e:
+                print('Failed to reload the output from %s: %s' % (cur_workdir, str(e)))
+                return None
+            value['output'] = output
+            value['evicted'] = False
+        self.__cacheOutput(id, value)
+        return output
+
+
+    def memoryUsage(self):
+        """
+        Get the memory used by the outputs of the functions kept in memory.
+
+        Return a dict: 'results' is the number of outputs in memory, 'bytes' is their serialized size,
+          'evicted' is the number of outputs dropped to work_dir and 'limit' is cache_size.
+
+        Examples:
+        >>>
+        >>> lsf.cache_size = 2 * 1024 ** 3
+        >>> lsf.memoryUsage()
+        {'results': 120, 'bytes': 1834006512, 'evicted': 35, 'limit': 2147483648}
+        """
+        with self.__cache_lock:
+            usage = {'results': len(self.__cache), 'bytes': self.__cache_bytes}
+        usage['evicted'] = len([value for value in list(self.__func_d.values()) if value.get('evicted')])
+        usage['limit'] = self.cache_size
+        return usage
+
+
+    def transfers(self):
+        """
+        Get the throughput of the uploads (job submissions with their files) and downloads (outputs and files)
+          made by all the clients of this process.
+
+        Return a dict: 'upload' and 'download' give the number of finished transfers ('count'), their 'bytes',
+          the 'seconds' spent and the average 'rate' in bytes per second; 'active' is the list of the transfers
+          in progress, as given to the progress callback.
+
+        Examples:
+        >>>
+        >>> lsf.progress = lambda id, info: print(id, info['bytes'], info['total'], info['rate'], info['eta'])
+        >>> id = lsf.sub(myfun, files = '/tmp/big.bin', asynchronous = True)
+        >>> lsf.transfers()['upload']
+        {'count': 12, 'bytes': 402653184, 'seconds': 35.2, 'rate': 11438982.5}
+        """
+        return getTransfers()
+
+
+    def flush(self):
+        """
+        Submit the sub() calls waiting in the micro-batching window (see batch_window) now.
+        """
+        with self.__batch_lock:
+            keys = list(self.__batches.keys())
+        for key in keys:
+            self.__flushBatch(key)
+
+
+    def logon(self, username = getpass.getuser(), password = '123456', host = 'localhost', port=8080, isHttps = False, session = None, limit = None, native = False):
+        """
+        Use the specified username/password to log on the specified AC web server.
+
+        Return True if success, otherwise return false.
+
+        Parameters:
+        session: The name of the session, to use several clusters at once, each behind its own AC web server.
+          The token (and cacert.pem for https) of a named session is kept in work_dir/sessions/name. Once a named
+          session is logged on, each call is sent to one of the named sessions, chosen by routing ('queue' by default:
+          the shortest observed queue wait, or 'load': the fewest running functions for its limit), or to the session
+          given to sub(), exe() or map(). When a server is down, the call is sent to the next session.
+          By default, it is None which is the default session.
+        limit: The maximum number of functions running in the named session at once. When all the sessions are full,
+          sub() waits for functions to finish. By default, it is None which is unlimited.
+        native: On an LSF submission host, True to use the LSF commands (bsub, bjobs and bkill) instead of an AC web server,
+          or the directory holding them. username, password, host, port and isHttps are not used. The jobs run in
+          work_dir/jobs (work_dir/sessions/name/jobs for a named session), which must be shared with the execution hosts.
+          By default, it is False.
+
+        Examples:
+        >>>
+        >>> lsf.logon('user', 'password', 'ac1.example.com', session = 'east', limit = 500)
+        >>> lsf.logon('user', 'password', 'ac2.example.com', session = 'west', limit = 200)
+        >>> id = lsf.sub(myfun, arg1)
+        >>> id = lsf.sub(myfun, arg1, session = 'west')
+        >>>
+        >>> lsf.logon(native = True)
+        >>> lsf.logon(native = '/opt/lsf/10.1/linux3.10-glibc2.17-x86_64/bin', session = 'local')
+        """
+        session_dir = self.__sessionDir(session)
+        if not os.path.exists(session_dir):
+            os.makedirs(session_dir)
+        # remove old token
+        removeToken(session_dir)
+        nativelib.logoutAC(session_dir)
+        self.__native.discard(session_dir)
+        if native:
+            success, content = nativelib.logon(session_dir, None if native is True else native)
+            if success:
+                self.__native.add(session_dir)
+        else:
+            # always logon as server may be shutdown or terminated
+            success, content = logonAC(username, password, host, port, isHttps, session_dir)
+        if session is None and success:
+            with self.__session_lock:
+                self.__sessions[None]['url'] = getToken(session_dir)[0]
+        if session is not None:
+            if success:
+                self.__addSession(session, limit)
+                return True
+            print(content)
+            return False
+        if success:
+            self.__is_logged = True
+            return True
+        else:
+            print(content)
+            self.__is_logged = False
+            return False
+
+
+    def logout(self, session = None):
+        """
+        Log out from AC web server.
+
+        Parameters:
+        session: The name of the session to log out from. By default, it is None which is the default session.
+        """
+        if session is not None:
+            if session not in self.__sessions:
+                print('Unknown session %s.' % session)
+                return
+            success, content = self.__backend(logoutAC, [self.__sessionDir(session)])(self.__sessionDir(session))
+            removeToken(self.__sessionDir(session))
+            self.__native.discard(self.__sessionDir(session))
+            with self.__session_lock:
+                del self.__sessions[session]
+            if not success:
+                print(content)
+            return
+
+        if self.__isLogged():
+            success, content = self.__backend(logoutAC, [self.work_dir])(self.work_dir)
+            self.__native.discard(self.work_dir)
+            # no matter success or not, also force logout
+            self.__is_logged =False
+            removeToken(self.work_dir)
+            with self.__pool_lock:
+                if self.__thread_pool != None:
+                    self.__thread_pool.shutdown()
+                    self.__thread_pool = None
+            if not success:
+                print(content)
+        else:
+            print ('You are not logged yet.' )
+
+
+    def sessions(self):
+        """
+        Get the named sessions logged on (see logon()) and how loaded they are.
+
+        Return a dict mapping each session name to a dict: 'limit' is the limit given to logon(),
+          'running' is the number of functions submitted and not finished yet, 'queue' is the observed
+          queue wait in seconds (None before any function has started) and 'available' is whether
+          the session has a token and its server is not marked down.
+
+        Examples:
+        >>>
+        >>> lsf.sessions()
+        {'east': {'limit': 500, 'running': 500, 'queue': 42.3, 'available': True},
+         'west': {'limit': 200, 'running': 17, 'queue': 3.1, 'available': True}}
+        """
+        sessions = {}
+        with self.__session_lock:
+            for name, record in self.__sessions.items():
+                if name is not None:
+                    sessions[name] = {'limit': record['limit'], 'running': len(record['running']), 'queue': record['queue']}
+        for name in sessions:
+            sessions[name]['available'] = isAvailable(self.__sessionDir(name))
+        return sessions
+
+
+    def get(self, id, session = None):
+        """
+        Get the output based on the specified function id (which returned by sub()).
+
+        Parameters:
+        id: The function id returned by sub(), or a job id.
+        session: The named session a job id was sent to, see logon(). It is only used for a job id not submitted by
+          this client. By default, it is None which is the default session.
+
+        Return the return value(if any) of function if succeeds, or error string if error found,
+          or 'None' if function is uploading/pending/running...
+
+        As this routine returns an indefinite number of values. To avoid number of arguments does not match,
+          please use an argument to receive the return value. If no error message is printed, then iterate the output on demand.
+        """
+        # assume the id is func_id by default
+        if id is None:
+            print('Input id is null.')
+            return None
+        value = self.__func_d.get(id)
+        if value is not None and 'batch' in value:
+            # the batch job is got under its own lock
+            return self.__getBatched(id, value)
+        if value is not None and 'tree' in value:
+            return self.__getReduced(value)
+        with self.__funcLock(id):
+            return self.__get(id, session)
+
+
+    def __get(self, id, session = None):
+        import dill
+        try:
+            value = self.__func_d[id]
+            status = value['status']
+            if status == 'Done':
+                return self.__cachedOutput(id, value)
+            if status == 'Exit':
+                print('Task status is %s' % status)
+                return value['message']
+            if status == 'uploading':
+                 print('uploading...')
+                 return None
+            if value.get('speculating'):
+                # the speculation monitor decides which job gives the result
+                return None
+            if value.get('local'):
+                # still running in the local pool
+                return None
+            if value.get('prefetched'):
+                cur_workdir = os.sep.join([self.work_dir , str(id)])
+                value.update(readJobOutput(cur_workdir))
+                value['status'] = value.pop('prefetched')
+                self.__settleStaged(value.get('staged', []), value['status'], value.get('message'), value.get('session'))
+                return self.__get(id)
+
+            # if task is not finished, just receive status from the server
+            jobid = value['jobid']
+            cur_workdir = os.sep.join([self.work_dir , str(id)])
+        except Exception as e:
+            # no key exists: try to restore data from work_dir
+            jobid = id
+            cur_workdir = os.sep.join([self.work_dir, str(id)])
+            is_exists = os.path.exists(cur_workdir)
+            if is_exists:
+                value = {}
+                for root,dirs,files in os.walk(cur_workdir):
+                    for file in files:
+                        if LSF_ERRPUT_FILE_NAME in file:
+                            f = open(os.sep.join([cur_workdir , file]), "rb")
+                            content = f.read().decode('utf-8')
+                            f.close()
+                            value['message'] =  content
+                            if len(content) > 0:
+                                print('Task status is Exit')
+                                value['status'] = 'Exit'
+                                self.__func_d[id] = value
+                                return value['message']
+                        if OUTPUT_FILE_NAME in file:
+                            value['output'] = loadOutput(os.sep.join([cur_workdir , file]))
+                            if len(content) > 0:
+                                value['status'] = 'Done'
+                                self.__func_d[id] = value
+                                return self.__cachedOutput(id, value)
+
+            # may be the id is job id.
+            for func_id, value in list(self.__func_d.items()):
+                if id == value.get('jobid'):
+                    status = value['status']
+                    if status == 'Done':
+                        with self.__funcLock(func_id):
+                            return self.__cachedOutput(func_id, value)
+                    if status == 'Exit':
+                        print('Task status is %s' % status)
+                        return value['message']
+
+
+        # not found: we will send request to the server to recontruct the data
+        if not self.__isLogged():
+            print('Please logon before using this function.')
+            return None
+
+        if not isinstance(jobid,int):
+            print('You must use job id when you want to reconstruct the data.')
+            return None
+
+        session = self.__func_d.get(id, {}).get('session', session)
+        success, content = self.__getJobOutput(jobid, id, cur_workdir, session)
+        if success :
+            # keep what was recorded at submission
+            value = self.__func_d.get(id, {})
+            value.update(content)
+            self.__func_d[id] = value
+            status = content['status']
+            self.__observe(id, value, status)
+            self.__settleStaged(value.get('staged', []), status, content.get('message'), session)
+            if status == 'Done':
+                return self.__cachedOutput(id, value)
+            elif status == 'Exit':
+                print('Task status is %s' % status)
+                return content['message']
+            else:
+                return None
+        else:
+            self.__checkMessage(content, session)
+            return None
+
+
+    def put(self, obj):
+        """
+        Store an object once on the cluster, to pass it to many functions without uploading it each time.
+        The object is serialized to work_dir/objects and uploaded by a staging job to staging_dir (see bundle)
+          the first time a function using it is submitted to a cluster. A job loads it from a copy on the local
+          disk of its execution host, which is shared by the jobs running on that host and read through a memory map.
+          The same object is uploaded only once per cluster.
+
+        Parameters:
+        obj: The object to store.
+
+        Return an ObjectRef to pass as an argument of sub(), exe() or map(), or None if error found.
+
+        Examples:
+        >>>
+        >>> ref = lsf.put(df)
+        >>> ids = [lsf.sub(myfun, ref, x) for x in range(500)]
+        >>> ids = lsf.map(myfun, [ref] * 500, range(500))
+        """
+        import dill
+        import hashlib
+        # nothing is sent to the server until a function using it is submitted
+        object_dir = os.sep.join([self.work_dir, OBJECT_DIR_NAME])
+        tmp_path = os.sep.join([object_dir, '.%s.%d' % (uuid.uuid4(), os.getpid())])
+        try:
+            if not os.path.exists(object_dir):
+                os.makedirs(object_dir)
+            # serialized to disk then hashed in blocks, not to hold a second copy of a large object in memory
+            f = open(tmp_path, 'wb')
+            dill.dump(obj, f)
+            f.close()
+            digest = hashlib.sha1()
+            f = open(tmp_path, 'rb')
+            for block in iter(functools.partial(f.read, 1024 * 1024), b''):
+                digest.update(block)
+            f.close()
+            path = os.sep.join([object_dir, digest.hexdigest()])
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print('Failed to serialize the object: %s' % str(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        return ObjectRef(OBJECT_DIR_NAME + '/' + os.path.basename(path), os.path.getsize(path), path)
+
+
+    def scatter(self, array, n):
+        """
+        Store an array once on the cluster and split it into n slices along its first axis, to pass one slice
+          to each function without embedding it in the job script.
+        The array is written to work_dir/objects in the raw .npy format and staged like put() does. Each slice is
+          described by its offset and shape in the file, and the job maps only its slice, read-only, with no copy.
+
+        Parameters:
+        array: The array, or anything numpy.asarray() accepts. An array of Python objects cannot be mapped.
+        n: The number of slices. They differ by one row at most, like numpy.array_split().
+
+        Return a list of n ArrayShard to pass as arguments of sub(), exe() or map(), or None if error found.
+          A job gets its slice as a numpy.memmap.
+
+        Examples:
+        >>>
+        >>> shards = lsf.scatter(a, 100)
+        >>> ids = [lsf.sub(myfun, shard) for shard in shards]
+        >>> ids = lsf.map(myfun, shards, chunksize = 10)
+        """
+        import hashlib
+        import numpy
+        # staged like put(), when a function using a slice is submitted
+        if n is None or n < 1:
+            print('n must be a positive integer.')
+            return None
+        # the slices of a C ordered array are contiguous in the file
+        array = numpy.ascontiguousarray(array)
+        if array.ndim == 0 or array.dtype.hasobject:
+            print('Only an array of numbers with at least one dimension can be scattered.')
+            return None
+
+        object_dir = os.sep.join([self.work_dir, OBJECT_DIR_NAME])
+        tmp_path = os.sep.join([object_dir, '.%s.%d' % (uuid.uuid4(), os.getpid())])
+        try:
+            if not os.path.exists(object_dir):
+                os.makedirs(object_dir)
+            f = open(tmp_path, 'wb')
+            numpy.save(f, array, allow_pickle = False)
+            f.close()
+            digest = hashlib.sha1()
+            f = open(tmp_path, 'rb')
+            for block in iter(functools.partial(f.read, 1024 * 1024), b''):
+                digest.update(block)
+            f.close()
+            path = os.sep.join([object_dir, digest.hexdigest() + '.npy'])
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print('Failed to save the array: %s' % str(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        name = OBJECT_DIR_NAME + '/' + os.path.basename(path)
+        # the data follows the header
+        offset = os.path.getsize(path) - array.nbytes
+        row = array.strides[0]
+        descr = numpy.lib.format.dtype_to_descr(array.dtype)
+        size, extra = divmod(len(array), n)
+        shards = []
+        start = 0
+        for i in range(n):
+            stop = start + size + (1 if i < extra else 0)
+            shards.append(ArrayShard(name, (stop - start) * row, path, offset + start * row, (stop - start,) + tuple(int(d) for d in array.shape[1:]), descr))
+            start = stop
+        return shards
+
+
+    def profile(self, id = None, format = 'pstats'):
+        """
+        Get the profile of a function submitted with profile=True or profile='memory'.
+
+        Parameters:
+        id: The function id returned by sub(). By default, it is the last exe() with profile.
+        format: 'pstats' returns a pstats.Stats, also saved as work_dir/id/profile.prof for other viewers.
+          'collapsed' returns the collapsed stacks ('caller;callee microseconds' lines) for flame graph tools.
+          'memory' returns a dict: 'peak' is the peak traced memory in bytes, 'memory' is the top 100 allocations
+          as (traceback, size, count), only for profile='memory'.
+
+        Return the profile in the format, or None if error found or the function is not finished.
+
+        Examples:
+        >>>
+        >>> id = lsf.sub(myfun, arg1, profile = 'memory')
+        >>> lsf.profile(id).sort_stats('cumulative').print_stats(10)
+        >>> open('myfun.folded', 'w').write('\\n'.join(lsf.profile(id, 'collapsed')))
+        >>> lsf.profile(id, 'memory')['peak']
+        """
+        import dill
+        if id is None:
+            id = self.__last_profiled
+        value = self.__func_d.get(id)
+        if value is None or not value.get('profile'):
+            print('The function %s is not profiled.' % id)
+            return None
+        if format not in ('pstats', 'collapsed', 'memory'):
+            print('Invalid format %s is specified, it must be pstats, collapsed or memory.' % format)
+            return None
+
+        cur_workdir = os.sep.join([self.work_dir, str(id)])
+        path = os.sep.join([cur_workdir, PROFILE_FILE_NAME])
+        if not os.path.exists(path):
+            if not self.__isLogged():
+                print('Please logon before using this function.')
+                return None
+            if not os.path.exists(cur_workdir):
+                os.makedirs(cur_workdir)
+            success, content = self.__request(downloadFiles, str(value['jobid']), cur_workdir, PROFILE_FILE_NAME, self.__sessionDir(value.get('session')), False, self.__progress(id))
+            if not success:
+                self.__checkMessage(content, value.get('session'))
+                return None
+
+        f = open(path, 'rb')
+        profile = dill.load(f)
+        f.close()
+        if format == 'collapsed':
+            return collapseStats(profile['stats'])
+        if format == 'memory':
+            if 'memory' not in profile:
+                print('The memory of the function %s is not traced, submit it with profile = "memory".' % id)
+                return None
+            return {'peak': profile['peak'], 'memory': profile['memory']}
+
+        import marshal
+        import pstats
+        path = os.sep.join([cur_workdir, 'profile.prof'])
+        f = open(path, 'wb')
+        marshal.dump(profile['stats'], f)
+        f.close()
+        return pstats.Stats(path)
+
+
+    def __telemetry(self, id, value):
+        # the telemetry of a finished function, merged with the job times, downloaded once
+        import json
+        if 'telemetry' in value or value.get('local'):
+            return value.get('telemetry')
+        cur_workdir = os.sep.join([self.work_dir, str(id)])
+        path = os.sep.join([cur_workdir, TELEMETRY_FILE_NAME])
+        if not os.path.exists(path):
+            if not os.path.exists(cur_workdir):
+                os.makedirs(cur_workdir)
+            success, content = self.__request(downloadFiles, str(value['jobid']), cur_workdir, TELEMETRY_FILE_NAME, self.__sessionDir(value.get('session')), False, self.__progress(id))
+            if not success:
+                self.__checkMessage(content, value.get('session'))
+                return None
+        f = open(path, 'r')
+        telemetry = json.loads(f.read())
+        f.close()
+        telemetry['func'] = value.get('func')
+        telemetry['jobid'] = value['jobid']
+        telemetry['session'] = value.get('session')
+        success, content = self.__request(getJobTimes, value['jobid'], self.__sessionDir(value.get('session')))
+        if success:
+            telemetry.update(content)
+        value['telemetry'] = telemetry
+        return telemetry
+
+
+    def telemetry(self, id = None):
+        """
+        Get how the functions ran: the job script measures its wall and CPU time (with the pool workers of map()),
+          the time spent before the call (imports, staged files and arguments) and in the call, the max RSS,
+          the execution host and the Python version. They are merged with the submit, start and end times
+          of the job given by the server, when it gives them, and the queue and run times derived from them.
+
+        Parameters:
+        id: The function id returned by sub() or map(). By default, the telemetry of all the finished functions
+          is aggregated per function name.
+
+        Return a dict of the measures of the function, or for each function name a dict of the number of calls,
+          the mean and the maximum of each measure and the calls and the mean call time per host. Return None if error found.
+
+        Examples:
+        >>>
+        >>> lsf.telemetry(id)
+        {'host': 'node12', 'python': '3.8.5', 'wall': 12.4, 'cpu': 11.9, 'import': 0.6, 'call': 11.7, 'max_rss': 512000000, ...}
+        >>> lsf.telemetry()['myfun']['hosts']
+        {'node12': {'calls': 40, 'call': 11.5}, 'node31': {'calls': 38, 'call': 19.8}}
+        """
+        if not self.__isLogged():
+            print('Please logon before using this function.')
+            return None
+
+        if id is not None:
+            value = self.__func_d.get(id)
+            if value is None or value.get('jobid') is None and not value.get('local'):
+                print('Invalid id %s is specified, you can specify the funct_id returned by sub/map' % id)
+                return None
+            if value['status'] not in ('Done', 'Exit'):
+                print('The function %s is not finished.' % id)
+                return None
+            return self.__telemetry(id, value)
+
+        records = {}
+        for func_id, value in list(self.__func_d.items()):
+            if value.get('jobid') is None and not value.get('local') or value['status'] not in ('Done', 'Exit'):
+                continue
+            telemetry = self.__telemetry(func_id, value)
+            if telemetry is not None:
+                records.setdefault(value.get('func'), []).append(telemetry)
+        return dict((func, aggregateTelemetry(records[func])) for func in records)
+
+
+    def download(self, id, files, destination = None, asynchronous = False):
+        """
+        Download function data files from AC server to the specified destination.
+        Currently, only can download files that belong to the specified function id (the files must be the function input/output files).
+
+        Return True if success, otherwise return false.
+
+        Parameters:
+        id: The function id.
+        files: Only support relative path(eg: a.txt or ./a.txt). To specify multiple files, separate with a comma(,).
+        destination: Specify the absolute path. If destination is None, download to work_dir/id.
+        asynchronous: Whether download the files your specified asynchronously. Only use with the 'files' parameter specified.
+
+        Examples:
+        # Download the function' file a.txt to /tmp/
         >>> lsf.download(id,'a.txt','/tmp/')
         # Download the function' file a.txt and b.txt to work_dir/id
         >>> lsf.download(id,'a.txt,b.txt')
@@ -474,7 +2450,7 @@ class lsf(object):
         # Download the function' file a.txt and b.txt to work_dir/id asynchronously
         >>> lsf.download(id,'a.txt,b.txt',asynchronous = True)
         """
-        if not self.__is_logged:
+        if not self.__isLogged():
             print('Please logon before using this function.')
             return False
 
@@ -482,9 +2458,11 @@ class lsf(object):
         if id is None:
             print('Input id is null.')
             return False
+        session = None
         try:
             value = self.__func_d[id]
             jobid = value['jobid']
+            session = value.get('session')
         except Exception as e:
             # rrror found, it may be jobid
             try:
@@ -544,23 +2522,20 @@ class lsf(object):
                 return False
 
         if asynchronous:
-            if self.__thread_pool is None:
-                self.__thread_pool = ThreadPoolExecutor(max_workers=5)
-
-            future_task = self.__thread_pool.submit(downloadFiles, str(jobid), destination, paths, self.work_dir, asynchronous)
+            future_task = self.__threadPool().submit(self.__request, downloadFiles, str(jobid), destination, paths, self.__sessionDir(session), asynchronous, self.__progress(id))
             future_task.add_done_callback(functools.partial(self.__getDownloadResult, files = files, destination =destination))
             print('Downloading...')
             return True
 
-        success, content = downloadFiles(str(jobid), destination, paths, self.work_dir, asynchronous)
+        success, content = self.__request(downloadFiles, str(jobid), destination, paths, self.__sessionDir(session), asynchronous, self.__progress(id))
         if not success:
-            self.__checkMessage(content)
+            self.__checkMessage(content, session)
             return False
         else:
             return True
 
 
-    def sub(self, func, *arguments, files = None, asynchronous = False):
+    def sub(self, func, *arguments, files = None, asynchronous = False, tags = None, profile = False, session = None):
         """
         Send function calls(especially for time-consuming) with arguments as jobs to LSF without blocking.
 
@@ -572,6 +2547,11 @@ class lsf(object):
         files: If the function has some dependency files you can upload files by set to the file absolute path
           which will be uploaded from local to server. To specify multiple files, separate with a comma(,).
         asynchronous: Whether upload the files your specified asynchronously. Only use together with the 'files' parameter.
+        tags: A tag or a list of tags of the call, to cancel a group of calls together by cancelAll().
+        profile: Whether run the function under cProfile, or 'memory' to trace the memory allocations with tracemalloc too.
+          The stats are read by profile(). By default, it is False.
+        session: The named session to send the call to, see logon(). By default, it is None which routes the call
+          to one of the named sessions, or sends it to the default session when no named session is logged on.
 
         Examples:
         >>>
@@ -589,11 +2569,33 @@ class lsf(object):
         # then in 'myfun' you can use relative path(eg: a.txt or ./a.txt) to read/write the file
         >>> id = lsf.sub(myfun, files='/tmp/a.txt', asynchronous = True)
         >>>
+        # Submit the 'myfun' function tagged as 'sweep1'
+        >>> id = lsf.sub(myfun, arg1, tags = 'sweep1')
+        >>>
+        # Submit the 'myfun' function and profile it
+        >>> id = lsf.sub(myfun, arg1, profile = True)
+        >>> lsf.profile(id).sort_stats('cumulative').print_stats(10)
+        >>>
+        # Submit the 'myfun' function to the cluster of the session 'west'
+        >>> id = lsf.sub(myfun, arg1, session = 'west')
+        >>>
         """
-        return self.__submit(func, *arguments, files=files, block = False, asynchronous = asynchronous)
+        learn = None
+        if self.local and files is None and not profile and session is None:
+            payload = self.__localPayload(func, arguments)
+            if payload is not None:
+                return self.__submitLocal(func, payload, tags = tags)
+            learn = self.__probe(func)
+        if learn is None and self.batch_window is not None and not asynchronous and not profile and session is None:
+            return self.__batch(func, arguments, files, tags)
+        func_id = self.__submit(func, *arguments, files=files, block = False, asynchronous = asynchronous, tags = tags, profile = profile, session = session, learn = learn)
+        if func_id is None and learn is not None:
+            with self.__local_lock:
+                self.__probes.pop(learn, None)
+        return func_id
 
 
-    def exe(self, func, *arguments, files= None, timeout = 60):
+    def exe(self, func, *arguments, files= None, timeout = 60, profile = False, session = None):
         """
         Send function calls(especially for time-consuming) with arguments as jobs on LSF.
         It will block until job finished/timeout/error found.
@@ -610,6 +2612,9 @@ class lsf(object):
         files: If the function has some dependency files you can set files to the file absolute path
                      which will be uploaded from local to server. To specify multiple files, separate with a comma(,).
         timeout(in seconds): If not specified, use timeout = 60. If timeout or press 'CTRL-C', the function will be canceled.
+        profile: Whether run the function under cProfile, or 'memory' to trace the memory allocations with tracemalloc too.
+          The stats are read by profile() without id. By default, it is False.
+        session: The named session to send the call to, see logon(). By default, it is None which routes the call.
 
         Examples:
         >>>
@@ -624,25 +2629,491 @@ class lsf(object):
         >>> output = lsf.exe(myfun, arg1, arg2, timeout = 300)
         >>> output = lsf.exe(myfun, files='/tmp/a.txt', timeout = 300)
         """
-        return self.__submit(func, *arguments, files=files, block = True, timeout = timeout)
+        learn = None
+        if self.local and files is None and not profile and session is None:
+            payload = self.__localPayload(func, arguments)
+            if payload is not None:
+                return self.__submitLocal(func, payload, block = True, timeout = timeout)
+            learn = self.__probe(func)
+        output = self.__submit(func, *arguments, files=files, block = True, timeout = timeout, profile = profile, session = session, learn = learn)
+        if learn is not None:
+            with self.__local_lock:
+                if learn in self.__probes and self.__runtimes.get(learn) is None:
+                    # not finished in time
+                    self.__probes.pop(learn, None)
+        return output
+
+
+    def map(self, func, *iterables, chunksize = 100, slots = None, files = None, tags = None, speculative = False, session = None):
+        """
+        Send a function over many inputs to LSF, grouping the calls into chunks instead of one job per call.
+        Each chunk is run by one job, which fans the calls out over a local process pool sized from
+          the slots allocated on the execution host (LSB_DJOB_NUMPROC).
+
+        Return a list of function ids, one per chunk (None for a chunk failed to submit).
+          get() on a chunk id returns the list of return values of the calls in that chunk.
+
+        Parameters:
+        func: function name.
+        iterables: one or more iterables, the calls are func(*args) for args in zip(*iterables) like the builtin map.
+        chunksize: The maximum number of calls in one job. By default, it is 100.
+        slots: The number of slots requested on one host for each job. If not specified, use the LSF default.
+        files: If the function has some dependency files you can set files to the file absolute path
+                     which will be uploaded from local to server. To specify multiple files, separate with a comma(,).
+        tags: A tag or a list of tags of the chunks, to cancel them together by cancelAll().
+        speculative: Whether duplicate the straggler chunks, see speculate(). By default, it is False.
+        session: The named session to send all the chunks to, see logon(). By default, it is None which routes
+          each chunk on its own, so the chunks may spread over several clusters.
+
+        Examples:
+        >>>
+        # Run 'myfun' over 10000 values, 500 calls per job on 8 slots each
+        >>> ids = lsf.map(myfun, range(10000), chunksize = 500, slots = 8)
+        >>> results = [r for id in ids for r in lsf.get(id)]
+        >>>
+        # Run 'myfun' with two arguments taken from two lists
+        >>> ids = lsf.map(myfun, [1, 2, 3], ['a', 'b', 'c'])
+        """
+        if chunksize is None or chunksize < 1:
+            print('Invalid chunksize %s is specified, it must be a positive integer.' % chunksize)
+            return None
+
+        inputs = list(zip(*iterables))
+        ids = []
+        for i in range(0, len(inputs), chunksize):
+            ids.append(self.__submit(func, files = files, chunk = inputs[i : i + chunksize], slots = slots, tags = tags, session = session))
+        if speculative:
+            self.speculate([id for id in ids if id is not None])
+        return ids
+
+
+    def map_reduce(self, mapper, reducer, inputs, fan_in = 8, chunksize = 100, slots = None, files = None, tags = None, session = None):
+        """
+        Send a function over many inputs to LSF like map(), and reduce the results on the cluster by a tree of jobs.
+        Each map job reduces the results of its chunk, then each reduce job reduces the results of up to fan_in
+          jobs of the level below as soon as they are done, until one result is left. The intermediate results
+          are kept in staging_dir on the cluster, only the final value is downloaded.
+
+        Return the function id of the whole reduction, or None if error found. get() on it returns the reduced value,
+          status() and cancel() apply to the whole tree.
+
+        Parameters:
+        mapper: function name, called with each input.
+        reducer: A function combining two results into one. It must be associative, as the results are reduced
+          in the order of the inputs but grouped by the tree. It is passed by value, so it can be a lambda or a builtin
+          such as operator.add.
+        inputs: An iterable, the calls are mapper(x) for x in inputs.
+        fan_in: The maximum number of results reduced by one job. By default, it is 8.
+        chunksize: The maximum number of calls in one map job. By default, it is 100.
+        slots: The number of slots requested on one host for each map job. If not specified, use the LSF default.
+        files: The dependency files of the map jobs, as in map().
+        tags: A tag or a list of tags of the reduction, to cancel it by cancelAll().
+        session: The named session to send all the jobs to, see logon(). By default, it is None which routes the
+          reduction as a whole: its jobs share the intermediate results, so they run on one cluster.
+
+        Examples:
+        >>>
+        # Sum 'myfun' over 100000 values, 1000 calls per map job, 4 results per reduce job
+        >>> import operator
+        >>> id = lsf.map_reduce(myfun, operator.add, range(100000), fan_in = 4, chunksize = 1000)
+        >>> total = lsf.get(id)
+        """
+        if chunksize is None or chunksize < 1:
+            print('chunksize must be a positive integer.')
+            return None
+        if fan_in is None or fan_in < 2:
+            print('fan_in must be at least 2.')
+            return None
+        inputs = [(x,) for x in inputs]
+        if len(inputs) == 0:
+            print('No input is given.')
+            return None
+        if not self.__isLogged():
+            print('Please logon before using this function.')
+            return None
+        if session is None:
+            session = self.__route()[0]
+
+        tree_id = str(uuid.uuid4())
+        value = {}
+        value['status'] = 'Send'
+        # the id of the last reduce job, once it is submitted
+        value['tree'] = None
+        # the ids of the jobs whose results are not reduced yet
+        value['nodes'] = []
+        value['func'] = mapper.__name__
+        value['session'] = session
+        # the intermediate results in staging_dir, removed by the last reduce job or by __cleanTree()
+        value['run'] = None
+        if tags is None:
+            value['tags'] = set()
+        elif isinstance(tags, str):
+            value['tags'] = set([tags])
+        else:
+            value['tags'] = set(tags)
+        self.__func_d[tree_id] = value
+
+        chunks = [inputs[i : i + chunksize] for i in range(0, len(inputs), chunksize)]
+        if len(chunks) > 1:
+            value['run'] = '/'.join([REDUCE_DIR_NAME, tree_id])
+        names = []
+        for i, chunk in enumerate(chunks):
+            # a single map job gives the final value
+            name = None if len(chunks) == 1 else '/'.join([REDUCE_DIR_NAME, tree_id, '0-%d' % i])
+            func_id = self.__submit(mapper, files = files, chunk = chunk, slots = slots, tags = tags, session = session,
+                                    reduce = {'tree': tree_id, 'reducer': reducer, 'sources': None, 'target': name})
+            if func_id is None:
+                self.cancel(tree_id)
+                self.__cleanTree(tree_id)
+                self.__func_d.pop(tree_id, None)
+                return None
+            with self.__funcLock(tree_id):
+                value['nodes'].append(func_id)
+            names.append(name)
+        with self.__funcLock(tree_id):
+            value['status'] = 'Run'
+            if len(chunks) == 1:
+                value['tree'] = value['nodes'][0]
+        if len(chunks) > 1:
+            threading.Thread(target = self.__reduceTree, args = (tree_id, mapper, reducer, list(value['nodes']), names, fan_in, tags, session), daemon = True).start()
+        return tree_id
+
+
+    def __reduceTree(self, tree_id, mapper, reducer, nodes, names, fan_in, tags, session):
+        # submit the reduce jobs level by level, each one when the jobs it reduces are done. nodes are the jobs
+        #   of the level below and names their results in staging_dir
+        value = self.__func_d[tree_id]
+        try:
+            self.__reduceLevels(tree_id, mapper, reducer, nodes, names, fan_in, tags, session)
+        finally:
+            # failed, canceled or stopped by an error before the last reduce job, which removes the results
+            if value['tree'] is None or value.get('canceled'):
+                self.__cleanTree(tree_id)
+
+
+    def __reduceLevels(self, tree_id, mapper, reducer, nodes, names, fan_in, tags, session):
+        value = self.__func_d[tree_id]
+        level = 0
+        while True:
+            level += 1
+            groups = [list(range(i, min(i + fan_in, len(nodes)))) for i in range(0, len(nodes), fan_in)]
+            is_last = len(groups) == 1
+            parents = [None] * len(groups)
+            parent_names = [None] * len(groups)
+            waiting = list(range(len(groups)))
+            while len(waiting) > 0:
+                found = self.__marker_found
+                statuses = self.__treeStatus([nodes[i] for g in waiting for i in groups[g]], session)
+                for g in list(waiting):
+                    children = [nodes[i] for i in groups[g]]
+                    if value.get('canceled'):
+                        return
+                    failed = [child for child in children if statuses.get(child) == 'Exit']
+                    if len(failed) > 0:
+                        self.__failTree(tree_id, failed[0])
+                        return
+                    if len(children) == 1 and not is_last:
+                        # left over, reduced at the next level
+                        parents[g] = children[0]
+                        parent_names[g] = names[groups[g][0]]
+                        waiting.remove(g)
+                        continue
+                    if any(statuses.get(child) != 'Done' for child in children):
+                        continue
+                    name = None if is_last else '/'.join([REDUCE_DIR_NAME, tree_id, '%d-%d' % (level, g)])
+                    func_id = self.__submit(mapper, tags = tags, session = session,
+                                            reduce = {'tree': tree_id, 'reducer': reducer, 'sources': [names[i] for i in groups[g]], 'target': name})
+                    if func_id is None:
+                        with self.__funcLock(tree_id):
+                            value['message'] = 'Failed to submit the reduce job of the function.'
+                            value['status'] = 'Exit'
+                        self.cancel(tree_id)
+                        return
+                    with self.__funcLock(tree_id):
+                        value['nodes'] = [node for node in value['nodes'] if node not in children] + [func_id]
+                        canceled = value.get('canceled')
+                    if canceled:
+                        self.cancel(func_id)
+                        return
+                    for child in children:
+                        self.__func_d.pop(child, None)
+                    parents[g] = func_id
+                    parent_names[g] = name
+                    waiting.remove(g)
+                if len(waiting) > 0:
+                    self.__waitMarker(None, self.interval, found)
+            if is_last:
+                with self.__funcLock(tree_id):
+                    value['tree'] = parents[0]
+                return
+            nodes = parents
+            names = parent_names
+
+
+    def __cleanTree(self, tree_id):
+        # remove the intermediate results of a map_reduce() tree by a job on its cluster, then reduce/ once
+        #   it is empty. The jobs of the tree are canceled before, it is done once
+        value = self.__func_d[tree_id]
+        with self.__funcLock(tree_id):
+            run = value['run']
+            value['run'] = None
+        if run is None:
+            return
+        success, content = self.__scriptBytes([
+            'import os',
+            'import shutil',
+            '',
+            'path = os.path.join(os.path.expanduser(' + json.dumps(self.staging_dir) + '), ' + json.dumps(run) + ')',
+            'shutil.rmtree(path, ignore_errors = True)',
+            'try:',
+            '    os.rmdir(os.path.dirname(path))',
+            'except OSError:',
+            '    pass'])
+        if success:
+            success, content = self.__request(submitJob, content, None, self.__sessionDir(value['session']), False)
+        if not success:
+            print('Failed to remove the intermediate results of the function %s: %s' % (tree_id, content))
+
+
+    def __treeStatus(self, ids, session):
+        # the status of the jobs of a map_reduce() tree, from their completion markers or one request;
+        #   a job unknown to the server is finished
+        statuses = {}
+        jobs = {}
+        for id in ids:
+            marker = self.__marker(id)
+            if marker is not None:
+                statuses[id] = marker['status']
+            else:
+                jobs[self.__func_d[id]['jobid']] = id
+        if len(jobs) > 0:
+            success, content = self.__request(getJobsStatus, list(jobs), self.__sessionDir(session))
+            if success:
+                for jobid, id in jobs.items():
+                    statuses[id] = content.get(jobid, 'Done')
+        for id, status in statuses.items():
+            with self.__funcLock(id):
+                self.__func_d[id]['status'] = status
+            self.__observe(id, self.__func_d[id], status)
+        return statuses
+
+
+    def __failTree(self, tree_id, func_id):
+        # the error message of the failed job is the message of the tree
+        value = self.__func_d[tree_id]
+        node = self.__func_d[func_id]
+        cur_workdir = os.sep.join([self.work_dir, func_id])
+        success, content = self.__getJobOutput(node['jobid'], func_id, cur_workdir, node.get('session'))
+        with self.__funcLock(tree_id):
+            value['message'] = content['message'] if success else content
+            value['status'] = 'Exit'
+        self.cancel(tree_id)
+
+
+    def gather(self, ids, out = None, timeout = None):
+        """
+        Gather the results of many functions into one numpy array, waiting for them to finish.
+        The job script writes a numpy array result in the .npy format, which is read straight into its slot of
+          the array, without unpickling it or building a list. The other results are got and converted.
+          The array is allocated once, from the shape and dtype of the first result, unless out is given.
+
+        Parameters:
+        ids: The function ids returned by sub() (one slot each) or by map() (one slot per call of the chunk), in order.
+        out: The array to write into, of shape (number of slots,) + the shape of a result.
+          By default, it is None which allocates it.
+        timeout: The maximum seconds to wait. By default, it is None which waits until all are finished.
+
+        Return the array, or None if a function failed, the timeout expired or error found.
+
+        Examples:
+        >>>
+        >>> ids = [lsf.sub(myfun, x) for x in range(1000)]
+        >>> results = lsf.gather(ids)
+        >>>
+        >>> results = lsf.gather(lsf.map(myfun, range(1000)))
+        """
+        import numpy
+        from concurrent.futures import ThreadPoolExecutor
+        ids = list(ids)
+        for id in ids:
+            if id not in self.__func_d:
+                print('Invalid id %s is specified, you must specify a function id returned by sub or map.' % id)
+                return None
+        if len(ids) == 0:
+            return out
+
+        end_time = None if timeout is None else time.time() + timeout
+        statuses = self.__waitAll(ids, end_time)
+        if statuses is None:
+            print('Timeout. The functions are not finished.')
+            return None
+        for id in ids:
+            if statuses[id] == 'Exit':
+                print('The function %s failed: %s' % (id, self.get(id)))
+                return None
+
+        with ThreadPoolExecutor(max_workers = self.prefetch_workers) as pool:
+            paths = list(pool.map(self.__gatherPath, ids))
+        # a map() chunk gives a list of results
+        chunked = ['calls' in self.__func_d[id] for id in ids]
+        counts = [self.__func_d[id].get('calls', 1) for id in ids]
+        try:
+            if out is None:
+                # allocated from the header of the first result, if it is a numpy array
+                header = readArrayHeader(paths[0]) if paths[0] is not None else None
+                if header is None:
+                    first = self.get(ids[0])
+                    first = numpy.asarray(first[0] if chunked[0] else first)
+                    header = (first.shape, first.dtype)
+                out = numpy.empty((sum(counts),) + tuple(header[0]), header[1])
+
+            def fill(i):
+                offset = sum(counts[:i])
+                if not chunked[i]:
+                    slot = out[offset] if out.ndim > 1 else out[offset : offset + 1].reshape(())
+                    if paths[i] is not None and readArray(paths[i], slot):
+                        return
+                    slot[...] = self.get(ids[i])
+                else:
+                    out[offset : offset + counts[i]] = self.get(ids[i])
+            with ThreadPoolExecutor(max_workers = self.prefetch_workers) as pool:
+                list(pool.map(fill, range(len(ids))))
+        except Exception as e:
+            print('Failed to gather the results: %s' % str(e))
+            return None
+        return out
+
+
+    def __waitAll(self, ids, end_time = None):
+        # wait for the functions to finish, without downloading their outputs. Return their status,
+        #   or None when end_time is passed
+        while True:
+            found = self.__marker_found
+            statuses = {}
+            # session -> job id -> the functions of that job
+            sessions = {}
+            for id in ids:
+                value = self.__func_d[id]
+                if 'batch' in value or 'tree' in value:
+                    # the function of its job
+                    target = value['batch'] if 'batch' in value else value['tree']
+                    if value['status'] in ('Done', 'Exit') or target is None:
+                        statuses[id] = value['status']
+                        continue
+                    value = self.__func_d[target]
+                else:
+                    target = id
+                status = value['status']
+                if status not in ('Done', 'Exit') and value.get('prefetched'):
+                    status = value['prefetched']
+                elif status not in ('Done', 'Exit') and self.__marker(target) is not None:
+                    status = self.__marker(target)['status']
+                if status in ('Done', 'Exit') or value.get('local') or value.get('jobid') is None:
+                    statuses[id] = status
+                else:
+                    sessions.setdefault(value.get('session'), {}).setdefault(value['jobid'], []).append(id)
+            for session, jobs in sessions.items():
+                success, content = self.__request(getJobsStatus, list(jobs), self.__sessionDir(session))
+                if not success:
+                    continue
+                for jobid, job_ids in jobs.items():
+                    for id in job_ids:
+                        # the jobs the server does not know any more are finished
+                        statuses[id] = content.get(jobid, 'Done')
+            if all(statuses.get(id) in ('Done', 'Exit') for id in ids):
+                return statuses
+            if end_time is not None and time.time() >= end_time:
+                return None
+            wait = self.interval if end_time is None else min(self.interval, end_time - time.time())
+            self.__waitMarker(None, max(0, wait), found)
+
+
+    def __gatherPath(self, id):
+        # the output file of a finished job, downloaded if needed; None if the output is got by get()
+        value = self.__func_d[id]
+        if 'batch' in value or 'tree' in value or value.get('local') or 'calls' in value:
+            return None
+        with self.__funcLock(id):
+            if value['status'] == 'Done' and not value.get('evicted'):
+                # in memory
+                return None
+            cur_workdir = os.sep.join([self.work_dir, str(id)])
+            path = os.sep.join([cur_workdir, OUTPUT_FILE_NAME])
+            if os.path.exists(path):
+                return path
+            if not os.path.exists(cur_workdir):
+                os.makedirs(cur_workdir)
+            success, content = self.__request(downloadFiles, str(value['jobid']), cur_workdir, OUTPUT_FILE_NAME, self.__sessionDir(value.get('session')), False, self.__progress(id))
+            if not success or not os.path.exists(path):
+                return None
+            if value['status'] != 'Done':
+                # get() loads the downloaded file without asking the server
+                value['prefetched'] = 'Done'
+            return path
+
+
+    def __getReduced(self, value):
+        if value['tree'] is None:
+            if value['status'] == 'Exit':
+                print('Task status is Exit')
+                return value['message']
+            # not reduced yet
+            return None
+        # the output is cached with the last job
+        output = self.get(value['tree'])
+        status = self.__func_d[value['tree']]['status']
+        if status in ('Done', 'Exit'):
+            value['status'] = status
+        return output
 
 
     def cancel(self, id):
         """
         Cancel to the function based on specified function id.
+        A function running in the local pool (see local) can only be canceled before it starts.
 
         Return True if success, otherwise return False.
         """
-        if not self.__is_logged:
+        value = self.__func_d.get(id) if isinstance(id, str) else None
+        if value is not None and value.get('local'):
+            future = value.get('future')
+            if future is not None and future.cancel():
+                return True
+            print('The local function %s is running or finished, it cannot be canceled.' % id)
+            return False
+        if not self.__isLogged():
             print('Please logon before using this function.')
             return False
 
         if id is None:
             print('Input id is null.')
             return False
+        if value is not None and 'tree' in value:
+            # the jobs of a map_reduce() not reduced yet, no more job is submitted
+            with self.__funcLock(id):
+                value['canceled'] = True
+                nodes = list(value['nodes'])
+                if value['status'] not in ('Done', 'Exit'):
+                    value['message'] = 'The function was canceled.'
+                    value['status'] = 'Exit'
+            success = True
+            for node in nodes:
+                if self.__func_d.get(node, {}).get('status') not in (None, 'Done', 'Exit'):
+                    success = self.cancel(node) and success
+            if value['tree'] is not None and self.__func_d.get(value['tree'], {}).get('status') != 'Done':
+                # the last reduce job is canceled, else __reduceTree() removes the results
+                self.__cleanTree(id)
+            return success
+        session = None
         try:
             value = self.__func_d[id]
+            if 'batch' in value:
+                if value['batch'] is None:
+                    # the batch must be a job to be canceled
+                    self.flush()
+                return self.cancel(value['batch'])
             jobid = value['jobid']
+            session = value.get('session')
         except Exception as e:
             try:
                 jobid = int(id)
@@ -650,19 +3121,500 @@ class lsf(object):
                 print('Invalid id %s is specified, you can specify either funct_id returned by sub/exe or known job id' %id)
                 return False
 
-        success, content = doAction(str(jobid), 'kill', self.work_dir)
+        success, content = self.__request(doAction, str(jobid), 'kill', self.__sessionDir(session))
         if not success:
-            self.__checkMessage(content)
+            self.__checkMessage(content, session)
+        elif isinstance(id, str):
+            # a killed job may not write its marker
+            self.__unwatch(id)
 
         return success
 
 
+    def __speculate(self, ids):
+        import math
+        start = {}
+        runtimes = []
+        # rounded up, so a small group gets a copy too
+        budget = int(math.ceil(len(ids) * self.speculative_budget))
+        pending = list(ids)
+        try:
+            while len(pending) > 0:
+                statuses = self.__speculationStatuses(pending)
+                for func_id in list(pending):
+                    if self.__resolveSpeculation(func_id, start, runtimes, statuses):
+                        pending.remove(func_id)
+
+                if len(runtimes) >= max(1, min(3, (len(ids) + 1) // 2)) and budget > 0:
+                    median = sorted(runtimes)[len(runtimes) // 2]
+                    for func_id in pending:
+                        value = self.__func_d[func_id]
+                        jobid = value['jobid']
+                        if budget > 0 and len(value['replicas']) == 0 and jobid in start and \
+                                time.time() - start[jobid] > self.speculative_threshold * median:
+                            success, content = self.__replicate(func_id, value)
+                            if success:
+                                with self.__funcLock(func_id):
+                                    value['replicas'].append(int(content))
+                                budget -= 1
+                if len(pending) > 0:
+                    time.sleep(self.interval)
+        finally:
+            # get() works as usual for the members left, if any error stopped the monitor
+            for func_id in pending:
+                with self.__funcLock(func_id):
+                    self.__func_d[func_id]['speculating'] = False
+
+
+    def __replicate(self, func_id, value):
+        # submit the job again, with the script downloaded from the directory of the running job
+        session_dir = self.__sessionDir(value.get('session'))
+        cur_workdir = os.sep.join([self.work_dir, func_id])
+        if not os.path.exists(cur_workdir):
+            os.makedirs(cur_workdir)
+        success, content = self.__request(downloadFiles, str(value['jobid']), cur_workdir, SCRIPT_FILE_NAME, session_dir, False, None)
+        if not success:
+            return False, content
+        path = os.sep.join([cur_workdir, SCRIPT_FILE_NAME])
+        try:
+            return self.__request(submitJob, path, value['paths'], session_dir, False, value['slots'], self.__progress(func_id))
+        finally:
+            os.remove(path)
+
+
+    def __speculationStatuses(self, ids):
+        # the status of all the jobs of the functions, by (session, job id), asked in one request per session
+        sessions = {}
+        for func_id in ids:
+            value = self.__func_d[func_id]
+            with self.__funcLock(func_id):
+                sessions.setdefault(value.get('session'), []).extend([value['jobid']] + value['replicas'])
+        statuses = {}
+        for session, jobs in sessions.items():
+            success, content = self.__request(getJobsStatus, jobs, self.__sessionDir(session))
+            if success:
+                for jobid, status in content.items():
+                    statuses[(session, jobid)] = status
+        return statuses
+
+
+    def __resolveSpeculation(self, func_id, start, runtimes, statuses):
+        # return True when the function is finished by one of its jobs, from the statuses of __speculationStatuses().
+        #   The kill requests are sent out of the lock of the function, which is taken to change its jobs
+        value = self.__func_d[func_id]
+        with self.__funcLock(func_id):
+            jobs = [value['jobid']] + value['replicas']
+        for jobid in jobs:
+            status = statuses.get((value.get('session'), jobid))
+            if status is None:
+                # not known yet, such as a copy submitted after the statuses were asked
+                continue
+            if status == 'Run' and jobid not in start:
+                start[jobid] = time.time()
+            elif status == 'Done':
+                # the first result wins, the others are canceled
+                if jobid in start:
+                    runtimes.append(time.time() - start[jobid])
+                with self.__funcLock(func_id):
+                    value['jobid'] = jobid
+                for other in jobs:
+                    if other != jobid:
+                        self.__request(doAction, str(other), 'kill', self.__sessionDir(value.get('session')))
+                break
+            elif status == 'Exit':
+                if len(jobs) == 1:
+                    break
+                # keep waiting for the other copy
+                jobs = [other for other in jobs if other != jobid]
+                with self.__funcLock(func_id):
+                    value['jobid'] = jobs[0]
+                    value['replicas'] = jobs[1:]
+                return False
+        else:
+            return False
+
+        with self.__funcLock(func_id):
+            value['replicas'] = []
+            value['speculating'] = False
+        return True
+
+
+    def speculate(self, ids):
+        """
+        Watch a group of functions in background and duplicate the stragglers (speculative execution).
+        When a function runs longer than speculative_threshold (2.0 by default) times the median runtime of
+          the finished functions of the group, the same job is submitted again (its script is downloaded from the
+          directory of the running job); the first result is kept and the other job is canceled. At most
+          speculative_budget (0.1 by default) times the group size duplicates, rounded up, are submitted. Until the group member
+          finishes, get() returns None for it.
+
+        Parameters:
+        ids: The function ids returned by sub() or map().
+
+        Examples:
+        >>>
+        >>> ids = [lsf.sub(myfun, x) for x in range(100)]
+        >>> lsf.speculate(ids)
+        >>> lsf.speculative_threshold = 3.0
+        >>> ids = lsf.map(myfun, range(10000), chunksize = 100, speculative = True)
+        """
+        group = []
+        for func_id in ids:
+            value = self.__func_d.get(func_id)
+            if value is None or value.get('jobid') is None:
+                print('Cannot speculate on the function %s, it is unknown or still uploading.' % func_id)
+                continue
+            with self.__funcLock(func_id):
+                if value['status'] in ('Done', 'Exit') or value.get('speculating'):
+                    continue
+                value['replicas'] = []
+                value['speculating'] = True
+            group.append(func_id)
+        if len(group) > 0:
+            threading.Thread(target = self.__speculate, args = (group,), daemon = True).start()
+
+
+    def cancelAll(self, tags = None, predicate = None, workers = 8):
+        """
+        Cancel all the in-flight functions matching the specified tags and/or predicate, concurrently.
+
+        Return a dict summarizing the result: 'killed' and 'finished' (already done or exited) are the lists of
+          function ids, 'failed' maps the function ids to the error messages. Return None if error found.
+          The calls waiting in the micro-batching buffer (see batch_window) are taken out of their batch and
+          never submitted; the submitted calls of a batch are canceled with the job of their batch.
+
+        Parameters:
+        tags: A tag or a list of tags. The functions having any of them are canceled. If not specified, do not filter by tags.
+        predicate: A callable receiving the function id and a dict of its information ('jobid', 'status', 'func', 'tags').
+          The functions for which it returns True are canceled. If not specified, do not filter by predicate.
+        workers: The number of kill requests sent at the same time. By default, it is 8.
+
+        Examples:
+        >>>
+        # Cancel all the functions tagged as 'sweep1'
+        >>> summary = lsf.cancelAll(tags = 'sweep1')
+        >>>
+        # Cancel all the calls of 'myfun'
+        >>> summary = lsf.cancelAll(predicate = lambda id, info: info['func'] == 'myfun')
+        """
+        if not self.__isLogged():
+            print('Please logon before using this function.')
+            return None
+
+        if tags is not None and isinstance(tags, str):
+            tags = [tags]
+
+        summary = {'killed': [], 'finished': [], 'failed': {}}
+        targets = []
+        buffered = []
+        for func_id, value in list(self.__func_d.items()):
+            if ('batch' in value and value['batch'] is not None) or 'reduce' in value:
+                # canceled with the job of the batch, or with the map_reduce() tree
+                continue
+            if tags is not None and len(value.get('tags', set()).intersection(tags)) == 0:
+                continue
+            info = {'jobid': value.get('jobid'), 'status': value.get('status'), 'func': value.get('func'), 'tags': set(value.get('tags', set()))}
+            if predicate is not None and not predicate(func_id, info):
+                continue
+            if info['status'] in ('Done', 'Exit'):
+                summary['finished'].append(func_id)
+            elif 'batch' in value:
+                # still waiting in the micro-batching buffer, it is dropped from its batch
+                buffered.append(func_id)
+            elif value.get('local'):
+                future = value.get('future')
+                if future is not None and future.cancel():
+                    summary['killed'].append(func_id)
+                else:
+                    summary['failed'][func_id] = 'The local function is running, it cannot be canceled.'
+            elif 'tree' in value:
+                if self.cancel(func_id):
+                    summary['killed'].append(func_id)
+                else:
+                    summary['failed'][func_id] = 'Failed to cancel some jobs of the reduction.'
+            elif info['jobid'] is None:
+                summary['failed'][func_id] = 'The function is still uploading.'
+            else:
+                targets.append((func_id, info['jobid']))
+
+        removed = self.__unbatch(buffered)
+        summary['killed'].extend(removed)
+        for func_id in set(buffered).difference(removed):
+            if self.__func_d[func_id]['status'] in ('Done', 'Exit'):
+                summary['finished'].append(func_id)
+            else:
+                summary['failed'][func_id] = 'The batch of the function is being submitted.'
+
+        def kill(target):
+            # speculative copies, if any, are killed too
+            session_dir = self.__sessionDir(self.__func_d[target[0]].get('session'))
+            for jobid in self.__func_d[target[0]].get('replicas', []):
+                self.__request(doAction, str(jobid), 'kill', session_dir)
+            return self.__request(doAction, str(target[1]), 'kill', session_dir)
+
+        if len(targets) > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                results = list(pool.map(kill, targets))
+            for (func_id, jobid), (success, content) in zip(targets, results):
+                if success:
+                    summary['killed'].append(func_id)
+                    self.__unwatch(func_id)
+                elif 'finished' in content.lower():
+                    summary['finished'].append(func_id)
+                else:
+                    summary['failed'][func_id] = content
+
+        print('Killed: %d, already finished: %d, failed: %d' % (len(summary['killed']), len(summary['finished']), len(summary['failed'])))
+        for content in set(summary['failed'].values()):
+            if SESSION_LOGOUT in content or CANNOT_CONNECT_SERVER == content or SERVER_UNAVAILABLE == content or TOKEN_IS_DELETED == content:
+                self.__checkMessage(content)
+        return summary
+
+
+    def status(self, id):
+        """
+        Get the status of the function based on the specified function id or job id, without downloading its output.
+
+        Return the status string, such as 'uploading', 'Pend', 'Run', 'Done' or 'Exit', or None if error found.
+        """
+        value = self.__func_d.get(id) if isinstance(id, str) else None
+        if value is not None and value.get('local'):
+            return value['status']
+        if not self.__isLogged():
+            print('Please logon before using this function.')
+            return None
+
+        if id is None:
+            print('Input id is null.')
+            return None
+        value = {}
+        try:
+            value = self.__func_d[id]
+            if value['status'] in ('Done', 'Exit', 'uploading', 'batched'):
+                return value['status']
+            if 'batch' in value:
+                return self.status(value['batch'])
+            if 'tree' in value:
+                return value['status'] if value['tree'] is None else self.status(value['tree'])
+            jobid = value['jobid']
+        except Exception as e:
+            try:
+                jobid = int(id)
+            except Exception as e:
+                print('Invalid id %s is specified, you can specify either funct_id returned by sub/exe or known job id' %id)
+                return None
+
+        success, content = self.__request(getJobStatus, jobid, self.__sessionDir(value.get('session')))
+        if not success:
+            self.__checkMessage(content, value.get('session'))
+            return None
+        self.__observe(id, value, content['status'])
+        return content['status']
+
+
+    def tail(self, id, follow = True, timeout = None):
+        """
+        Show the output (stdout and stderr) of a running function as it is written, for a function submitted
+          with tail_output = True. Its job script copies its output to segment files, each one closed when it is
+          tail_period seconds old or tail_segment bytes long, and only the segments not read by the previous tail() of
+          the function are downloaded. A segment is deleted by the job once it has been closed for twice the longest
+          wait of tail() between two reads (see follow). The job does not wait for its segments to be read when it exits:
+          the last ones are left in its directory, and removed once read with the LSF commands (see logon()).
+          The output of the processes of the map() pool is not copied.
+
+        Parameters:
+        id: The function id returned by sub() or map().
+        follow: Whether print the output until the function is finished, like tail -f. The segments are checked every
+          tail_period seconds while the output is written, and less often, up to every interval seconds, while it is not.
+          If False, return the new output at once.
+        timeout: The maximum seconds to follow. By default, it is None which follows until the function is finished.
+
+        Return the new output if not follow, otherwise None. Return None if error found.
+
+        Examples:
+        >>>
+        >>> lsf.tail_output = True
+        >>> id = lsf.sub(train, epochs)
+        >>> lsf.tail(id)
+        >>>
+        >>> text = lsf.tail(id, follow = False)
+        """
+        value = self.__func_d.get(id)
+        if value is not None and 'batch' in value and value['batch'] is not None:
+            # run by the job of the batch
+            id = value['batch']
+            value = self.__func_d.get(id)
+        if value is None or value.get('jobid') is None:
+            print('The function %s is not running in LSF.' % id)
+            return None
+        if 'tail' not in value:
+            print('The output of the function %s is not copied, please set tail_output = True before submitting it.' % id)
+            return None
+        if not self.__isLogged():
+            print('Please logon before using this function.')
+            return None
+        if not follow:
+            return self.__tailRead(id, value)
+
+        end_time = None if timeout is None else time.time() + timeout
+        delay = self.tail_period
+        try:
+            while True:
+                text = self.__tailRead(id, value)
+                if len(text) > 0:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                    delay = self.tail_period
+                    continue
+                # the last segments are closed before the job exits
+                status = value['status']
+                if status not in ('Done', 'Exit') and self.__marker(id) is not None:
+                    status = self.__marker(id)['status']
+                if status not in ('Done', 'Exit'):
+                    status = self.status(id)
+                if status in ('Done', 'Exit') or status is None:
+                    sys.stdout.write(self.__tailRead(id, value))
+                    sys.stdout.flush()
+                    return None
+                if end_time is not None and time.time() >= end_time:
+                    return None
+                self.__waitMarker(id, delay if end_time is None else max(0, min(delay, end_time - time.time())))
+                delay = min(delay * 2, max(self.interval, self.tail_period))
+        except KeyboardInterrupt:
+            return None
+
+
+    def __tailRead(self, id, value):
+        # download the segments of the output not read yet, in order, and return their text. When the next one
+        #   was deleted by the job, the reading goes on from the first one left. The segments the job left when it
+        #   exited stay in its directory on the AC web server, they are removed once read with the LSF commands
+        texts = []
+        deleted = 0
+        cur_workdir = os.sep.join([self.work_dir, str(id)])
+        session_dir = self.__sessionDir(value.get('session'))
+        with self.__funcLock(id):
+            index = value.get('tail', 0)
+            if not os.path.exists(cur_workdir):
+                os.makedirs(cur_workdir)
+            while True:
+                name = TAIL_FILE_NAME + '.' + str(index)
+                path = os.sep.join([cur_workdir, name])
+                success, content = self.__request(downloadFiles, str(value['jobid']), cur_workdir, name, session_dir, False, None)
+                if not success or not os.path.exists(path):
+                    first = self.__tailFirst(value, cur_workdir, session_dir)
+                    if first is None or first <= index:
+                        break
+                    deleted += first - index
+                    index = first
+                    continue
+                if deleted > 0:
+                    texts.append('[the output of %d segments was deleted before it was read]\n' % deleted)
+                    deleted = 0
+                f = open(path, 'rb')
+                texts.append(f.read().decode('utf-8', 'replace'))
+                f.close()
+                os.remove(path)
+                if session_dir in self.__native:
+                    # read: removed from the job directory, which is on this host
+                    try:
+                        os.remove(os.sep.join([nativelib.jobDir(value['jobid'], session_dir), name]))
+                    except OSError:
+                        pass
+                index += 1
+            if deleted > 0:
+                texts.append('[the output of %d segments was deleted before it was read]\n' % deleted)
+            value['tail'] = index
+        return ''.join(texts)
+
+
+    def __tailFirst(self, value, cur_workdir, session_dir):
+        # the index of the first segment the job has not deleted, None if it has deleted none
+        path = os.sep.join([cur_workdir, TAIL_FILE_NAME])
+        success, content = self.__request(downloadFiles, str(value['jobid']), cur_workdir, TAIL_FILE_NAME, session_dir, False, None)
+        if not success or not os.path.exists(path):
+            return None
+        try:
+            f = open(path, 'r')
+            first = int(f.read().strip())
+            f.close()
+            return first
+        except (OSError, ValueError):
+            return None
+        finally:
+            os.remove(path)
+
+
+    def jobId(self, id):
+        """
+        Get the LSF job id of the function based on the specified function id.
+
+        Return the job id, or None if the function is unknown or still uploading.
+        """
+        try:
+            value = self.__func_d[id]
+            if 'batch' in value:
+                return self.jobId(value['batch'])
+            if 'tree' in value:
+                return self.jobId(value['tree'])
+            return value['jobid']
+        except Exception as e:
+            return None
+
+
+    def jobSession(self, id):
+        """
+        Get the named session (see logon()) the function was sent to, based on the specified function id.
+
+        Return the session name, or None if it is the default session or the function is unknown.
+        """
+        try:
+            value = self.__func_d[id]
+            if 'batch' in value:
+                return self.jobSession(value['batch'])
+            if 'tree' in value and value['tree'] is not None:
+                return self.jobSession(value['tree'])
+            return value.get('session')
+        except Exception as e:
+            return None
+
+
+    def statuses(self, ids, session = None):
+        """
+        Get the status of many jobs in one request, without downloading their outputs.
+
+        Parameters:
+        ids: The job ids.
+        session: The named session the jobs were sent to, see logon(). By default, it is None which is the default session.
+
+        Return a dict mapping each job id still known to LSF to its status string, or None if error found.
+
+        Examples:
+        >>>
+        >>> lsf.statuses([1201, 1202], session = 'west')
+        {1201: 'Run', 1202: 'Done'}
+        """
+        if not self.__isLogged():
+            print('Please logon before using this function.')
+            return None
+        if session not in self.__sessions:
+            print('Unknown session %s, please logon with it first.' % session)
+            return None
+        if len(ids) == 0:
+            return {}
+        success, content = self.__request(getJobsStatus, [int(id) for id in ids], self.__sessionDir(session))
+        if not success:
+            self.__checkMessage(content, session)
+            return None
+        return content
+
+
     def printDict(self,id = None):
         """
         Print diretocy, it is used to debug. If id is not specified, print all.
         """
         if id is None:
-            print(self.__func_d)
+            print(dict(self.__func_d))
             return
         else:
             try:
@@ -670,8 +3622,8 @@ class lsf(object):
                 return
             except Exception as e:
                 # not found, may be jobid
-                for value in self.__func_d.values():
-                    jobid = value['jobid']
+                for value in list(self.__func_d.values()):
+                    jobid = value.get('jobid')
                     if id == jobid:
                         print(value)
                         return
@@ -680,18 +3632,14 @@ class lsf(object):
         return
 
 if __name__ == "__main__":
-    ipython = get_ipython()
-    if ipython is None:
-        sys.exit('Import Failed. This tool can only be used in IPYTHON context.')
-    else:
-        lsf = lsf()
-        def bsub(func):
-            @wraps(func)
-            def with_bsub(*arguments, files = None, asynchronous = False):
-                return lsf.sub(func,  *arguments, files = files, asynchronous = asynchronous)
-            return with_bsub
-        def bexe(func):
-            @wraps(func)
-            def with_bexe(*arguments, files = None, timeout = 60):
-                return lsf.exe(func, *arguments, files = files, timeout = timeout)
-            return with_bexe
+    lsf = lsf()
+    def bsub(func):
+        @wraps(func)
+        def with_bsub(*arguments, files = None, asynchronous = False):
+            return lsf.sub(func,  *arguments, files = files, asynchronous = asynchronous)
+        return with_bsub
+    def bexe(func):
+        @wraps(func)
+        def with_bexe(*arguments, files = None, timeout = 60):
+            return lsf.exe(func, *arguments, files = files, timeout = timeout)
+        return with_bexe
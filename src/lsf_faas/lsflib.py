@@ -12,24 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# dill, httplib2 and the xml parsers are imported on first use, importing this module stays cheap.
 import base64
-import dill
-import getopt
-import http.client as httplib
-import httplib2
-import locale
 import os
+import random
 import re
-import sys
-import urllib
-import urllib.request as urllib2
-from xml.dom import minidom
-from xml.etree import ElementTree as ET
-from xml.parsers.expat import ExpatError
+import threading
+import time
 
 
 TOKEN_FILE = '.lsfpass'
+STAGED_FILE = '.staged'
+CLEANED_FILE = '.cleaned'
 WORK_DIR_NAME = '.lsf_faas'
+# work_dir/sessions/<name> keeps the token and the cacert.pem of a named session
+SESSION_DIR_NAME = 'sessions'
+# kept instead of the token by a session using the LSF commands, see native
+NATIVE_FILE = '.native'
 MULTIPLE_ACCEPT_TYPE = 'text/plain,application/xml,text/xml,multipart/mixed'
 ERROR_STRING = 'errMsg'
 ERROR_TAG = '<' + ERROR_STRING + '>'
@@ -38,12 +37,124 @@ ACTION_TAG = '<' + ACTION_STRING + '>'
 
 SCRIPT_FILE_NAME = 'lsf_faas.py'
 OUTPUT_FILE_NAME = 'output.out'
+PROFILE_FILE_NAME = 'profile.out'
+TELEMETRY_FILE_NAME = 'telemetry.out'
+# written by the job script when it exits, see lsf.marker_dir
+MARKER_FILE_NAME = 'lsf_faas.done'
+# the segments of the output of the job script, <name>.0, <name>.1... see lsf.tail()
+TAIL_FILE_NAME = 'lsf_faas.tail'
+# the files written by the job script in base64
+BASE64_FILE_NAMES = (OUTPUT_FILE_NAME, PROFILE_FILE_NAME)
+# a numpy array output is in the .npy format instead of dill, it starts with the magic string
+NPY_MAGIC = b'\x93NUMPY'
 LSF_OUTPUT_FILE_NAME = 'lsf.output'
 LSF_ERRPUT_FILE_NAME = 'lsf.errput'
 SESSION_LOGOUT = 'Your current login session was logout'
 CANNOT_CONNECT_SERVER = 'Cannot connect to the server.'
 TOKEN_IS_DELETED = 'Your token is empty or was deleted.'
 
+SERVER_UNAVAILABLE = 'The server failed too many times, the requests are paused for a while.'
+
+# per thread cache of httplib2.Http objects
+HTTP_POOL = threading.local()
+# token file path -> ((mtime, size, inode), url, token)
+TOKEN_CACHE = {}
+
+# the idempotent requests are retried HTTP_RETRIES times, waiting HTTP_BACKOFF * 2^n seconds (with jitter) before the n-th retry
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+# after BREAKER_THRESHOLD failures in a row, no request is sent to the server during BREAKER_COOLDOWN seconds
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+# server url -> [failures in a row, time until the requests are paused]
+BREAKERS = {}
+BREAKERS_LOCK = threading.Lock()
+
+# a request body is sent, and its progress reported, in blocks of PROGRESS_BLOCK bytes
+PROGRESS_BLOCK = 256 * 1024
+# 'upload'/'download' -> number, bytes and seconds of the finished transfers
+TRANSFERS = {'upload': {'count': 0, 'bytes': 0, 'seconds': 0.0}, 'download': {'count': 0, 'bytes': 0, 'seconds': 0.0}}
+# the transfers in progress
+TRANSFERS_ACTIVE = set()
+TRANSFERS_LOCK = threading.Lock()
+
+
+class ServerUnavailable(Exception):
+    pass
+
+
+class Transfer(object):
+    # the progress of one upload or download, given to callback(info) and counted in TRANSFERS when it is finished
+
+    def __init__(self, direction, name, total = None, callback = None):
+        self.direction = direction
+        self.name = name
+        self.total = total
+        self.callback = callback
+        self.start = time.time()
+        self.done = 0
+        with TRANSFERS_LOCK:
+            TRANSFERS_ACTIVE.add(self)
+
+    def info(self):
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed > 0 else None
+        eta = None
+        if self.total is not None and rate:
+            eta = (self.total - self.done) / rate
+        return {'direction': self.direction, 'name': self.name, 'bytes': self.done, 'total': self.total,
+                'elapsed': elapsed, 'rate': rate, 'eta': eta}
+
+    def report(self):
+        if self.callback is not None:
+            try:
+                self.callback(self.info())
+            except Exception:
+                # a failing callback must not fail the transfer
+                pass
+
+    def update(self, size):
+        self.done += size
+        self.report()
+
+    def finish(self, success):
+        with TRANSFERS_LOCK:
+            TRANSFERS_ACTIVE.discard(self)
+            if success:
+                stats = TRANSFERS[self.direction]
+                stats['count'] += 1
+                stats['bytes'] += self.done
+                stats['seconds'] += time.time() - self.start
+
+
+class ProgressBody(object):
+    # a request body sent in blocks, reporting the bytes sent. http.client iterates it again
+    #   if the request is sent again, so the progress starts over
+
+    def __init__(self, body, transfer):
+        self.body = body
+        self.transfer = transfer
+
+    def __iter__(self):
+        self.transfer.done = 0
+        view = memoryview(self.body)
+        for i in range(0, len(view), PROGRESS_BLOCK):
+            block = view[i : i + PROGRESS_BLOCK]
+            yield block
+            # the previous block is sent when the next one is asked
+            self.transfer.update(len(block))
+
+
+def getTransfers():
+    # a copy of the transfer counters, with the average rate, and the progress of the transfers in progress
+    with TRANSFERS_LOCK:
+        transfers = dict((direction, dict(stats)) for direction, stats in TRANSFERS.items())
+        active = list(TRANSFERS_ACTIVE)
+    for stats in transfers.values():
+        stats['rate'] = stats['bytes'] / stats['seconds'] if stats['seconds'] > 0 else None
+    transfers['active'] = [transfer.info() for transfer in active]
+    return transfers
+
 
 def checkField(field):
     if field != None:
@@ -89,27 +200,101 @@ def prepareUpload(upload_files):
 
 
 def getHttp(url, work_dir, timeout=5):
+    import httplib2
 
     is_https = False
     if ( (len(url) != 0) & ('https' in url.lower())):
         is_https = True
 
+    pem_file = None
     if is_https == True:
         pem_file= os.sep.join([work_dir , 'cacert.pem'])
-        if os.path.isfile(pem_file):
-            if timeout is None:
-                return httplib2.Http(ca_certs = pem_file)
-            else:
-                return httplib2.Http(ca_certs = pem_file, timeout = timeout)
-        else:
+        if not os.path.isfile(pem_file):
             raise Exception('The https certificate \'cacert.pem\' is missing. Please copy the \'cacert.pem\' file from the GUI_CONFDIR/https/cacert.pem on the IBM Spectrum Application Center to %s.' % work_dir)
 
-    if timeout is None:
-        return  httplib2.Http()
-    else:
-        return  httplib2.Http(timeout = timeout)
+    # httplib2.Http keeps its connections alive, so reuse one per thread (it is not thread safe)
+    # instead of opening a new connection for every request
+    key = (pem_file, timeout)
+    pool = HTTP_POOL.__dict__.setdefault('pool', {})
+    if key not in pool:
+        if pem_file is None:
+            pool[key] = httplib2.Http(timeout = timeout)
+        else:
+            pool[key] = httplib2.Http(ca_certs = pem_file, timeout = timeout)
+    return pool[key]
+
+
+
+def serverOf(url):
+    return url.split('/webservice/')[0]
 
 
+def recordSuccess(url):
+    with BREAKERS_LOCK:
+        BREAKERS.pop(serverOf(url), None)
+
+
+def recordFailure(url):
+    with BREAKERS_LOCK:
+        breaker = BREAKERS.setdefault(serverOf(url), [0, 0])
+        breaker[0] += 1
+        if breaker[0] >= BREAKER_THRESHOLD:
+            breaker[1] = time.time() + BREAKER_COOLDOWN
+
+
+def checkBreaker(url):
+    with BREAKERS_LOCK:
+        breaker = BREAKERS.get(serverOf(url))
+        if breaker is not None and breaker[1] > time.time():
+            raise ServerUnavailable(SERVER_UNAVAILABLE)
+
+
+def isAvailable(work_dir):
+    # whether the session has a token and its server is not paused by the circuit breaker
+    if os.path.exists(os.sep.join([work_dir, NATIVE_FILE])):
+        return True
+    url, token = getToken(work_dir)
+    if token == '':
+        return False
+    try:
+        checkBreaker(url)
+    except ServerUnavailable:
+        return False
+    return True
+
+
+def requestError(e):
+    if isinstance(e, ServerUnavailable):
+        return str(e)
+    return CANNOT_CONNECT_SERVER
+
+
+def httpRequest(http, url, method, body = None, headers = None, idempotent = False):
+    # send the request unless the circuit breaker of the server is open.
+    # Only the idempotent requests are retried on connection errors and gateway errors (502, 503, 504):
+    # sending a job or a kill again may do it twice.
+    attempts = 1
+    if idempotent:
+        attempts += HTTP_RETRIES
+    for attempt in range(attempts):
+        checkBreaker(url)
+        try:
+            response, content = http.request(url, method, body = body, headers = headers)
+        except Exception as e:
+            recordFailure(url)
+            if attempt + 1 >= attempts:
+                raise
+        else:
+            # a gateway error is a failure of the server even when it is not retried
+            if response['status'] not in ('502', '503', '504'):
+                recordSuccess(url)
+                return response, content
+            recordFailure(url)
+            if attempt + 1 >= attempts:
+                return response, content
+        delay = HTTP_BACKOFF * (2 ** attempt)
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
 
 def saveToken(url, token, jtoken, work_dir):
 
@@ -117,8 +302,10 @@ def saveToken(url, token, jtoken, work_dir):
         token = token + ",JSESSIONID=" + jtoken[0].childNodes[0].nodeValue
 
     fpath = os.sep.join([work_dir , TOKEN_FILE])
+    # write a temporary file and rename it, so a concurrent reader never sees a partial token
+    tmp_path = '%s.%d.%d' % (fpath, os.getpid(), threading.get_ident())
     try:
-        f = open(fpath, "w")
+        f = open(tmp_path, "w")
     except IOError as e:
         raise  Exception('Cannot open file "%s": %s' % (fpath, str(e)))
     else:
@@ -126,22 +313,34 @@ def saveToken(url, token, jtoken, work_dir):
         f.write('\n')
         f.write(token)
         f.close()
+        os.replace(tmp_path, fpath)
 
 def getToken(work_dir):
     token = ''
     url = ''
     fpath = os.sep.join([work_dir, TOKEN_FILE])
 
+    # the token is kept in memory, the file is read again only when it changes
+    try:
+        stat = os.stat(fpath)
+    except OSError:
+        TOKEN_CACHE.pop(fpath, None)
+        return url, token
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    cached = TOKEN_CACHE.get(fpath)
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2]
+
     try:
         f = open(fpath, "r")
         url_token = f.read().split('\n')
         f.close()
         url = url_token[0]
         token = url_token[1].replace('"', '#quote#')
-        if len(token) <= 0:
-            return url, ''
-        else:
-            return url, 'platform_token='+token
+        if len(token) > 0:
+            token = 'platform_token='+token
+        TOKEN_CACHE[fpath] = (key, url, token)
+        return url, token
     except IOError:
         return url, token
     except Exception as e:
@@ -152,11 +351,17 @@ def removeToken(work_dir):
 
     fpath = os.sep.join([work_dir , TOKEN_FILE])
 
+    TOKEN_CACHE.pop(fpath, None)
     if (os.path.exists(fpath)):
-        os.remove(fpath)
+        try:
+            os.remove(fpath)
+        except OSError:
+            # removed by another thread
+            pass
 
 
 def doAction(jobId, action, work_dir):
+    from xml.dom import minidom
 
     url, token = getToken(work_dir)
     if token == '':
@@ -169,9 +374,9 @@ def doAction(jobId, action, work_dir):
 
     headers = {'Content-Type': 'text/plain', 'Cookie': token, 'Accept': 'application/xml', 'Accept-Language': 'en-us'}
     try:
-        response, content = http.request(url + 'webservice/pacclient/jobOperation/' + action +'/' + jobId, 'GET', headers=headers)
+        response, content = httpRequest(http, url + 'webservice/pacclient/jobOperation/' + action +'/' + jobId, 'GET', headers=headers)
     except Exception as e:
-        return False, CANNOT_CONNECT_SERVER
+        return False, requestError(e)
 
     try:
         content = content.decode('utf-8')
@@ -196,7 +401,9 @@ def doAction(jobId, action, work_dir):
         return False, 'Failed to parse content: %s' % str(e)
 
 
-def downloadFiles(jobId, destination, files, work_dir, asynchronous = False):
+def downloadFiles(jobId, destination, files, work_dir, asynchronous = False, progress = None):
+    # progress: called with the progress info of the download, see Transfer.
+    #   httplib2 reads a response at once, so it is called once when the download is complete
 
     url,token = getToken(work_dir)
     if token == '':
@@ -212,10 +419,15 @@ def downloadFiles(jobId, destination, files, work_dir, asynchronous = False):
     body = os.path.basename(files)
 
     headers = {'Content-Type': 'text/plain', 'Cookie': token, 'Accept': MULTIPLE_ACCEPT_TYPE, 'Accept-Language': 'en-us'}
+    transfer = Transfer('download', jobId + ':' + body, callback = progress)
     try:
-        response, content = http.request( url + 'webservice/pacclient/file/' + jobId, 'GET', body = body, headers = headers)
+        response, content = httpRequest(http, url + 'webservice/pacclient/file/' + jobId, 'GET', body = body, headers = headers, idempotent = True)
     except Exception as e:
-        return False, CANNOT_CONNECT_SERVER
+        transfer.finish(False)
+        return False, requestError(e)
+    transfer.total = len(content)
+    transfer.update(len(content))
+    transfer.finish(len(content) > 0)
 
     if len(content) <= 0:
         if response['status'] == '404':
@@ -301,7 +513,7 @@ def parseDownloadContentString(destination, content):
                 end = lengths - 2
             data = sections[start : end]
 
-            if OUTPUT_FILE_NAME in fname:
+            if os.path.basename(fname) in BASE64_FILE_NAMES:
                 f = open(fname,'wb')
                 # encode data as it received bytes
                 orig_bytes = data.encode('utf-8')
@@ -318,6 +530,7 @@ def parseDownloadContentString(destination, content):
 
 
 def logonAC(username, password, host, port, isHttps, work_dir):
+    from xml.dom import minidom
 
     if isHttps:
         url='https://' + host + ':' + str(port) + '/platform/'
@@ -349,6 +562,8 @@ def logonAC(username, password, host, port, isHttps, work_dir):
         return False, 'Failed to decode the content "%s": %s' % (content, str(e))
 
     if response['status'] == '200':
+        # the server is back
+        recordSuccess(url)
         xdoc = minidom.parseString(content)
         tk = xdoc.getElementsByTagName("token")
         jtk = xdoc.getElementsByTagName("jtoken")
@@ -384,10 +599,10 @@ def logoutAC(work_dir):
     url_logout= url + 'webservice/pacclient/logout/'
     headers = {'Content-Type': 'text/plain', 'Cookie': token, 'Accept': MULTIPLE_ACCEPT_TYPE, 'Accept-Language': 'en-us'}
     try:
-        response, content = http.request(url_logout, 'GET', headers = headers)
+        response, content = httpRequest(http, url_logout, 'GET', headers = headers, idempotent = True)
 
     except Exception as e:
-        return False, CANNOT_CONNECT_SERVER
+        return False, requestError(e)
     try:
         content = content.decode('utf-8')
     except Exception as e:
@@ -413,9 +628,9 @@ def verifyToken(work_dir):
 
     headers = {'Content-Type': 'application/xml', 'Cookie': token, 'Accept': MULTIPLE_ACCEPT_TYPE, 'Accept-Language': 'en-us'}
     try:
-        response, content = http.request(url + 'webservice/pacclient/ping', 'GET', headers = headers)
+        response, content = httpRequest(http, url + 'webservice/pacclient/ping', 'GET', headers = headers, idempotent = True)
     except Exception as e:
-        return False, CANNOT_CONNECT_SERVER
+        return False, requestError(e)
 
     try:
         content = content.decode('utf-8')
@@ -429,6 +644,7 @@ def verifyToken(work_dir):
 
 
 def getJobs(parameter, work_dir):
+    from xml.etree import ElementTree as ET
     url, token = getToken(work_dir)
     if token == '':
         return False, TOKEN_IS_DELETED
@@ -439,9 +655,9 @@ def getJobs(parameter, work_dir):
 
     headers = {'Content-Type': 'application/xml', 'Cookie': token, 'Accept': MULTIPLE_ACCEPT_TYPE, 'Accept-Language': 'en-us'}
     try:
-        response, content = http.request(url + 'webservice/pacclient/jobs?' + parameter, 'GET', headers = headers)
+        response, content = httpRequest(http, url + 'webservice/pacclient/jobs?' + parameter, 'GET', headers = headers, idempotent = True)
     except Exception as e:
-        return False, CANNOT_CONNECT_SERVER
+        return False, requestError(e)
 
     try:
         content = content.decode('utf-8')
@@ -451,12 +667,12 @@ def getJobs(parameter, work_dir):
     if response['status'] == '200':
         xdoc = ET.fromstring(content)
         if ERROR_TAG in content:
-            tree = xdoc.getiterator("Jobs")
+            tree = xdoc.iter("Jobs")
             for xdoc in tree:
                 error = xdoc.find(ERROR_STRING)
             return False, checkField(error)
         elif 'note' in content:
-            tree = xdoc.getiterator("Jobs")
+            tree = xdoc.iter("Jobs")
             for xdoc in tree:
                 note=xdoc.find('note')
             return False, checkField(note)
@@ -466,14 +682,25 @@ def getJobs(parameter, work_dir):
         return False, CANNOT_CONNECT_SERVER
 
 
-def submitJob(scriptname, files, work_dir, asynchronous):
+def submitJob(script, files, work_dir, asynchronous, slots = None, progress = None):
+    # script is the path of the job script, or its content as bytes, sent from memory.
+    # progress: called with the progress info of the upload as the body is sent, see Transfer
+    from xml.dom import minidom
     params = {}
     params['COMMANDTORUN'] = 'python3 ' + SCRIPT_FILE_NAME
     params['ERROR_FILE'] = './' + LSF_ERRPUT_FILE_NAME
     params['OUTPUT_FILE'] = './' + LSF_OUTPUT_FILE_NAME
+    if slots != None:
+        # keep all slots on one host, they are used by a local process pool
+        params['EXTRA_PARAMS'] = '-n %d -R "span[hosts=1]"' % int(slots)
 
     input_files={}
-    input_files['INPUT_FILE'] = scriptname + ',upload'
+    contents = {}
+    if isinstance(script, bytes):
+        contents[SCRIPT_FILE_NAME] = script
+        input_files['INPUT_FILE'] = SCRIPT_FILE_NAME + ',upload'
+    else:
+        input_files['INPUT_FILE'] = script + ',upload'
 
     if files != None:
         paths = files.split(',')
@@ -492,7 +719,7 @@ def submitJob(scriptname, files, work_dir, asynchronous):
             http = getHttp(url, work_dir, timeout = None)
         else:
             http = getHttp(url, work_dir)
-        body = encodeBody(boundary, 'generic', params, input_files)
+        body = encodeBody(boundary, 'generic', params, input_files, contents)
     except Exception as e:
         return False, str(e)
 
@@ -500,10 +727,13 @@ def submitJob(scriptname, files, work_dir, asynchronous):
                    'Accept': 'text/xml,application/xml;', 'Cookie': token,
                    'Content-Length': str(len(body)), 'Accept-Language': 'en-us'}
 
+    transfer = Transfer('upload', files or SCRIPT_FILE_NAME, len(body), progress)
     try:
-        response, content = http.request(url + 'webservice/pacclient/submitapp', 'POST', body = body, headers = headers)
+        response, content = httpRequest(http, url + 'webservice/pacclient/submitapp', 'POST', body = ProgressBody(body, transfer), headers = headers)
     except Exception as e:
-        return False, CANNOT_CONNECT_SERVER
+        transfer.finish(False)
+        return False, requestError(e)
+    transfer.finish(response['status'] == '200')
     try:
         content = content.decode('utf-8')
     except Exception as e:
@@ -524,7 +754,9 @@ def submitJob(scriptname, files, work_dir, asynchronous):
 # in python-3.x:
 # str.joinReturn a string which is the concatenation of the strings in the iterable iterable.
 # a TypeError will be raised if there are any non-string values in iterable, including bytes objects.
-def encodeBody(boundary, appName, params, input_files):
+# contents maps the file paths of input_files to the data kept in memory, which are not read from disk
+def encodeBody(boundary, appName, params, input_files, contents = {}):
+    from urllib.parse import quote
 
     boundary2 = '_lsf_faas_file_boundary'
     def encodeAppname():
@@ -560,15 +792,18 @@ def encodeBody(boundary, appName, params, input_files):
         ('<AppParam><id>%s</id><value>%s</value><type>file</type></AppParam>' %(param_name, param_value)).encode('utf-8'))
 
     def encodeFile(file_path, filename):
-        f= open(file_path, 'rb')
-        content = f.read ()
-        f.close()
+        if file_path in contents:
+            content = contents[file_path]
+        else:
+            f= open(file_path, 'rb')
+            content = f.read ()
+            f.close()
         return ( ('--' + boundary).encode('utf-8'),
             ('Content-Disposition: form-data; name="%s"; filename="%s"' %(filename, filename)).encode('utf-8'),
             'Content-Type: application/octet-stream'.encode('utf-8'),
             'Content-Transfer-Encoding: binary'.encode('utf-8'),
             ('Accept-Language: en-us').encode('utf-8'),
-            ('Content-ID: <%s>' % urllib2.quote(filename)).encode('utf-8'),
+            ('Content-ID: <%s>' % quote(filename)).encode('utf-8'),
             ''.encode('utf-8'),
             content )
 
@@ -632,42 +867,148 @@ def encodeBody(boundary, appName, params, input_files):
     return b'\r\n'.join (lines)
 
 
-def getJobOutput(id, cur_work_dir, work_dir):
+def getJobStatus(id, work_dir):
+    from xml.etree import ElementTree as ET
+    success, content = getJobs('id=' + str(id), work_dir)
+    if not success:
+        return False, content
+
+    try:
+        value = {}
+        value['jobid'] = id
+        for xdoc in ET.fromstring(content).iter("Job"):
+            value['status'] = checkField(xdoc.find('status'))
+        if 'status' not in value:
+            return False, 'Cannot find the job %s' % str(id)
+        return True, value
+    except Exception as e:
+        return False, 'Failed to parse content: %s' % str(e)
+
+
+def getJobsStatus(ids, work_dir):
+    """
+    Get the status of many jobs in one request.
+
+    Return a tuple (success, content): content maps the job id to its status if success, otherwise it is the error message.
+    """
+    from xml.etree import ElementTree as ET
+    success, content = getJobs('id=' + ','.join(str(id) for id in ids), work_dir)
+    if not success:
+        return False, content
+
+    try:
+        statuses = {}
+        for xdoc in ET.fromstring(content).iter("Job"):
+            statuses[int(checkField(xdoc.find('id')))] = checkField(xdoc.find('status'))
+        return True, statuses
+    except Exception as e:
+        return False, 'Failed to parse content: %s' % str(e)
+
+
+def parseTime(text):
+    # the job times given by the server, as seconds since the epoch, milliseconds or a date
+    try:
+        value = float(text)
+        return value / 1000 if value > 100000000000 else value
+    except (TypeError, ValueError):
+        pass
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%a %b %d %H:%M:%S %Y'):
+        try:
+            return time.mktime(time.strptime(text.strip(), time_format))
+        except (AttributeError, ValueError):
+            pass
+    return None
+
+
+def getJobTimes(id, work_dir):
+    """
+    Get the execution host and the submit, start and end times of the job.
+
+    Return a tuple (success, content): content is a dict of the fields found if success, otherwise the error message.
+    """
+    from xml.etree import ElementTree as ET
+    success, content = getJobs('id=' + str(id), work_dir)
+    if not success:
+        return False, content
+
+    try:
+        value = {}
+        for xdoc in ET.fromstring(content).iter("Job"):
+            for field in ('execHost', 'submitTime', 'startTime', 'endTime'):
+                text = checkField(xdoc.find(field))
+                if text not in ('', '-'):
+                    value[field] = text
+        for field in ('submitTime', 'startTime', 'endTime'):
+            if field in value:
+                value[field] = parseTime(value[field])
+        if value.get('submitTime') and value.get('startTime'):
+            value['queue'] = value['startTime'] - value['submitTime']
+        if value.get('startTime') and value.get('endTime'):
+            value['run'] = value['endTime'] - value['startTime']
+        return True, value
+    except Exception as e:
+        return False, 'Failed to parse content: %s' % str(e)
+
+
+def readJobOutput(cur_work_dir):
+    # the output and error message downloaded to cur_work_dir, '' if not there
     value = {}
+    value['output'] = ''
+    value['message'] = ''
+    for root,dirs,files in os.walk(cur_work_dir):
+        for file in files:
+            if LSF_ERRPUT_FILE_NAME in file:
+                f = open(os.sep.join([cur_work_dir, file]), "rb")
+                content = f.read().decode('utf-8')
+                f.close()
+                value['message'] =  content
+            if OUTPUT_FILE_NAME in file:
+                value['output'] = loadOutput(os.sep.join([cur_work_dir, file]))
+    return value
 
+
+def loadOutput(path):
+    # the return value in the output file, a numpy array or dill serialized
+    import dill
+    f = open(path, "rb")
     try:
-        if not os.path.exists(cur_work_dir):
-            os.makedirs(cur_work_dir)
+        if f.read(len(NPY_MAGIC)) == NPY_MAGIC:
+            import numpy
+            f.seek(0)
+            return numpy.load(f, allow_pickle = False)
+        f.seek(0)
+        return dill.load(f)
+    finally:
+        f.close()
 
+
+def getJobOutput(id, cur_work_dir, work_dir, progress = None):
+    from xml.etree import ElementTree as ET
+    value = {}
+
+    try:
         value['jobid'] = id
         value['output'] = ''
         value['message'] = ''
         success, content = getJobs('id=' +str(id), work_dir)
         if success:
             tree = ET.fromstring(content)
-            jobs = tree.getiterator("Job")
+            jobs = tree.iter("Job")
             for xdoc in jobs:
                 status = checkField(xdoc.find('status'))
                 value['status'] = status
                 if status == 'Done' or status == 'Exit':
+                    # created only when there is something to download
+                    if not os.path.exists(cur_work_dir):
+                        os.makedirs(cur_work_dir)
                     # assume the output of the task is not too big, so download files synchronously
-                    success, content = downloadFiles(str(id), cur_work_dir, OUTPUT_FILE_NAME + ',' + LSF_ERRPUT_FILE_NAME, work_dir)
+                    success, content = downloadFiles(str(id), cur_work_dir, OUTPUT_FILE_NAME + ',' + LSF_ERRPUT_FILE_NAME, work_dir, progress = progress)
                     if not success:
                         return False, content
                 else:
                     pass
 
-                for root,dirs,files in os.walk(cur_work_dir):
-                    for file in files:
-                        if LSF_ERRPUT_FILE_NAME in file:
-                            f = open(os.sep.join([cur_work_dir, file]), "rb")
-                            content = f.read().decode('utf-8')
-                            f.close()
-                            value['message'] =  content
-                        if OUTPUT_FILE_NAME in file:
-                            f = open(os.sep.join([cur_work_dir, file]), "rb")
-                            value['output'] = dill.load(f)
-                            f.close()
+                value.update(readJobOutput(cur_work_dir))
 
             return True, value
         else:
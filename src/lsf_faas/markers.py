@@ -0,0 +1,108 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The completion markers written by the job scripts, see lsf.marker_dir. A directory of markers is watched
+# with inotify where it is available (Linux), and scanned otherwise.
+
+import json
+import os
+import struct
+import time
+
+
+MARKER_SUFFIX = '.done'
+# from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# struct inotify_event: wd, mask, cookie, len, then the name padded with zeros
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def openWatch(path):
+    """
+    Watch the files written or moved into the directory path with inotify.
+
+    Return the inotify file descriptor, or None if inotify is not available.
+    """
+    try:
+        import ctypes
+        import ctypes.util
+        name = ctypes.util.find_library('c')
+        if name is None:
+            return None
+        libc = ctypes.CDLL(name, use_errno = True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except Exception:
+        return None
+
+
+def waitEvents(fd, timeout):
+    """
+    Wait at most timeout seconds for files written in the directory watched by fd (see openWatch()),
+      or sleep for timeout seconds if fd is None.
+
+    Return the names of the files written.
+    """
+    import select
+    if fd is None:
+        time.sleep(timeout)
+        return []
+    if len(select.select([fd], [], [], timeout)[0]) == 0:
+        return []
+    try:
+        data = os.read(fd, 64 * 1024)
+    except OSError:
+        return []
+    names = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset : offset + length].rstrip(b'\0')
+        offset += length
+        if len(name) > 0:
+            names.append(os.fsdecode(name))
+    return names
+
+
+def scanMarkers(path):
+    # the names of the markers in the directory
+    try:
+        return [entry.name for entry in os.scandir(path) if entry.name.endswith(MARKER_SUFFIX)]
+    except OSError:
+        return []
+
+
+def readMarker(path):
+    """
+    Read a completion marker: a dict of 'status' ('Done' or 'Exit'), 'size' (of the output in bytes),
+      'jobid' and 'time' (when the job script finished).
+
+    Return None if it cannot be read.
+    """
+    try:
+        f = open(path, 'r')
+        marker = json.loads(f.read())
+        f.close()
+        return marker
+    except Exception:
+        return None
@@ -0,0 +1,340 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The requests of lsflib run with the LSF commands (bsub, bjobs and bkill) of the host instead of the AC web
+# server, for a client running on an LSF submission host. The functions have the names, arguments and results
+# of their lsflib counterparts; work_dir is the directory of the session, where the jobs run in jobs/<jobid>,
+# so it must be on a file system shared with the execution hosts.
+
+import base64
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+import uuid
+
+from lsf_faas.lsflib import *
+
+
+NATIVE_JOB_DIR_NAME = 'jobs'
+# the seconds an LSF command may take
+COMMAND_TIMEOUT = 60
+# bjobs STAT -> the status given by the AC web server
+STATUSES = {'PEND': 'Pend', 'RUN': 'Run', 'DONE': 'Done', 'EXIT': 'Exit'}
+
+
+def logon(work_dir, bindir = None):
+    """
+    Use the LSF commands in bindir (by default, LSF_BINDIR or the PATH) for the session of work_dir.
+
+    Return a tuple (success, content): content is the error message if not success.
+    """
+    if bindir is None:
+        bindir = os.environ.get('LSF_BINDIR', '')
+    for name in ('bsub', 'bjobs', 'bkill'):
+        command = os.path.join(bindir, name) if bindir else name
+        if shutil.which(command) is None:
+            return False, 'Cannot find the LSF command %s.' % command
+    try:
+        if not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        f = open(os.sep.join([work_dir, NATIVE_FILE]), 'w')
+        f.write(json.dumps({'bindir': bindir}))
+        f.close()
+    except Exception as e:
+        return False, str(e)
+    return True, ''
+
+
+def command(name, work_dir):
+    f = open(os.sep.join([work_dir, NATIVE_FILE]), 'r')
+    bindir = json.loads(f.read()).get('bindir')
+    f.close()
+    return os.path.join(bindir, name) if bindir else name
+
+
+def run(arguments, check = True):
+    # run the LSF command, return a tuple (success, content): content is its output, or the error message.
+    #   If not check, the output is returned even if the command fails
+    try:
+        process = subprocess.run(arguments, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                 universal_newlines = True, timeout = COMMAND_TIMEOUT)
+    except Exception as e:
+        return False, 'Failed to run %s: %s' % (arguments[0], str(e))
+    if process.returncode != 0 and (check or process.stdout.strip() == ''):
+        return False, (process.stderr.strip() or process.stdout.strip() or '%s failed with exit code %d' % (arguments[0], process.returncode))
+    return True, process.stdout
+
+
+def jobDir(jobId, work_dir):
+    return os.sep.join([work_dir, NATIVE_JOB_DIR_NAME, str(jobId)])
+
+
+def cleanJobs(work_dir, days):
+    """
+    Delete the job directories (and their job id links) not modified for days in the session of work_dir,
+      one by one: the jobs directory itself is kept, new jobs are created in it meanwhile.
+
+    Return the paths deleted.
+    """
+    jobs_dir = os.sep.join([work_dir, NATIVE_JOB_DIR_NAME])
+    deleted = []
+    try:
+        names = os.listdir(jobs_dir)
+    except OSError:
+        return deleted
+    current = time.time()
+    for name in names:
+        path = os.sep.join([jobs_dir, name])
+        try:
+            if (current - os.lstat(path).st_mtime) / 60 / 60 / 24 < days:
+                continue
+            if os.path.islink(path) or not os.path.isdir(path):
+                os.remove(path)
+            else:
+                shutil.rmtree(path)
+            deleted.append(path)
+        except OSError:
+            pass
+    return deleted
+
+
+def verifyToken(work_dir):
+    if not os.path.exists(os.sep.join([work_dir, NATIVE_FILE])):
+        return False, TOKEN_IS_DELETED
+    return True, 'ok'
+
+
+def logoutAC(work_dir):
+    try:
+        os.remove(os.sep.join([work_dir, NATIVE_FILE]))
+    except OSError:
+        pass
+    return True, 'You have logout successfully.'
+
+
+def submitJob(script, files, work_dir, asynchronous, slots = None, progress = None):
+    # the script and the files are copied to a new directory, where the job runs
+    job_dir = os.sep.join([work_dir, NATIVE_JOB_DIR_NAME, '.' + str(uuid.uuid4())])
+    paths = [] if files is None else files.split(',')
+    transfer = Transfer('upload', files or SCRIPT_FILE_NAME, None, progress)
+    try:
+        os.makedirs(job_dir)
+        script_path = os.sep.join([job_dir, SCRIPT_FILE_NAME])
+        if isinstance(script, bytes):
+            f = open(script_path, 'wb')
+            f.write(script)
+            f.close()
+        else:
+            shutil.copyfile(script, script_path)
+        for path in paths:
+            shutil.copyfile(path, os.sep.join([job_dir, os.path.basename(path)]))
+        transfer.total = sum(os.path.getsize(os.sep.join([job_dir, name])) for name in os.listdir(job_dir))
+    except Exception as e:
+        transfer.finish(False)
+        shutil.rmtree(job_dir, ignore_errors = True)
+        return False, 'Submit job failed: %s' % str(e)
+
+    arguments = [command('bsub', work_dir), '-cwd', job_dir,
+                 '-o', os.sep.join([job_dir, LSF_OUTPUT_FILE_NAME]), '-e', os.sep.join([job_dir, LSF_ERRPUT_FILE_NAME])]
+    if slots != None:
+        # keep all slots on one host, they are used by a local process pool
+        arguments.extend(['-n', str(int(slots)), '-R', 'span[hosts=1]'])
+    arguments.extend(['python3', SCRIPT_FILE_NAME])
+    success, content = run(arguments)
+    match = re.search(r'Job <(\d+)>', content)
+    if not success or match is None:
+        transfer.finish(False)
+        shutil.rmtree(job_dir, ignore_errors = True)
+        return False, content.strip() or 'Failed to submit the job.'
+    # found by its id, it runs in the directory it was submitted in. LSF reuses the job ids: the link of an
+    #   older job is replaced
+    link = jobDir(match.group(1), work_dir)
+    tmp_link = '%s.%s' % (link, uuid.uuid4())
+    try:
+        os.symlink(os.path.basename(job_dir), tmp_link)
+        os.replace(tmp_link, link)
+    except OSError as e:
+        # not to leave a job nobody can find
+        run([command('bkill', work_dir), match.group(1)])
+        transfer.finish(False)
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        return False, 'Submit job failed: %s' % str(e)
+    transfer.update(transfer.total)
+    transfer.finish(True)
+    return True, match.group(1)
+
+
+def getJobs(ids, fields, work_dir):
+    """
+    Query many jobs with one bjobs -json.
+
+    Return a tuple (success, content): content maps the job id to its record (a dict of the fields) if success,
+      otherwise it is the error message. The jobs unknown to LSF are not in it.
+    """
+    # bjobs fails if a job is unknown, the others are still in its output
+    success, content = run([command('bjobs', work_dir), '-json', '-o', ' '.join(['jobid'] + fields)] + [str(id) for id in ids], check = False)
+    if not success:
+        return False, content
+    try:
+        records = {}
+        for record in json.loads(content).get('RECORDS', []):
+            if 'ERROR' in record or 'JOBID' not in record:
+                continue
+            records[int(record['JOBID'])] = record
+        return True, records
+    except Exception as e:
+        return False, 'Failed to parse content: %s' % str(e)
+
+
+def finishedStatus(jobId, work_dir):
+    # the status of a job LSF does not know any more, from the files left in its directory
+    job_dir = jobDir(jobId, work_dir)
+    try:
+        f = open(os.sep.join([job_dir, MARKER_FILE_NAME]), 'r')
+        status = json.loads(f.read()).get('status')
+        f.close()
+        return status
+    except Exception:
+        pass
+    if os.path.exists(os.sep.join([job_dir, OUTPUT_FILE_NAME])):
+        return 'Done'
+    if os.path.exists(os.sep.join([job_dir, LSF_OUTPUT_FILE_NAME])):
+        return 'Exit'
+    return None
+
+
+def getJobsStatus(ids, work_dir):
+    """
+    Get the status of many jobs in one bjobs.
+
+    Return a tuple (success, content): content maps the job id to its status if success, otherwise it is the error message.
+    """
+    success, content = getJobs(ids, ['stat'], work_dir)
+    if not success:
+        return False, content
+    statuses = {}
+    for id in ids:
+        record = content.get(int(id))
+        status = STATUSES.get(record['STAT'], record['STAT']) if record is not None else finishedStatus(id, work_dir)
+        if status is not None:
+            statuses[int(id)] = status
+    return True, statuses
+
+
+def getJobStatus(id, work_dir):
+    success, content = getJobsStatus([id], work_dir)
+    if not success:
+        return False, content
+    if int(id) not in content:
+        return False, 'Cannot find the job %s' % str(id)
+    return True, {'jobid': id, 'status': content[int(id)]}
+
+
+def parseJobTime(text):
+    # bjobs gives the times like "Oct 19 10:22" or "Oct 19 10:22:05", without the year
+    value = parseTime(text)
+    if value is not None:
+        return value
+    text = text.rstrip(' LEA').strip()
+    for time_format in ('%b %d %H:%M:%S %Y', '%b %d %H:%M %Y'):
+        try:
+            return time.mktime(time.strptime('%s %d' % (text, time.localtime().tm_year), time_format))
+        except ValueError:
+            pass
+    return None
+
+
+def getJobTimes(id, work_dir):
+    """
+    Get the execution host and the submit, start and end times of the job.
+
+    Return a tuple (success, content): content is a dict of the fields found if success, otherwise the error message.
+    """
+    fields = {'exec_host': 'execHost', 'submit_time': 'submitTime', 'start_time': 'startTime', 'finish_time': 'endTime'}
+    success, content = getJobs([id], list(fields), work_dir)
+    if not success:
+        return False, content
+    value = {}
+    record = content.get(int(id), {})
+    for field, name in fields.items():
+        text = record.get(field.upper(), '')
+        if text not in ('', '-'):
+            value[name] = text if name == 'execHost' else parseJobTime(text)
+    if value.get('submitTime') and value.get('startTime'):
+        value['queue'] = value['startTime'] - value['submitTime']
+    if value.get('startTime') and value.get('endTime'):
+        value['run'] = value['endTime'] - value['startTime']
+    return True, value
+
+
+def downloadFiles(jobId, destination, files, work_dir, asynchronous = False, progress = None):
+    # copied from the directory of the job, the files written in base64 by the job script are decoded
+    job_dir = jobDir(jobId, work_dir)
+    transfer = Transfer('download', str(jobId) + ':' + files, callback = progress)
+    copied = 0
+    try:
+        for name in files.split(','):
+            name = os.path.basename(name)
+            path = os.sep.join([job_dir, name])
+            if not os.path.exists(path):
+                continue
+            f = open(path, 'rb')
+            data = f.read()
+            f.close()
+            if name in BASE64_FILE_NAMES:
+                data = base64.b64decode(data)
+            f = open(os.sep.join([destination, name]), 'wb')
+            f.write(data)
+            f.close()
+            transfer.update(len(data))
+            copied += 1
+    except Exception as e:
+        transfer.finish(False)
+        return False, 'Failed to download the file: %s' % str(e)
+    transfer.finish(copied > 0)
+    if copied == 0:
+        return False, 'Failed to download the file. The specified file does not exist: ' + files
+    return True, ''
+
+
+def getJobOutput(id, cur_work_dir, work_dir, progress = None):
+    value = {}
+    try:
+        value['jobid'] = id
+        value['output'] = ''
+        value['message'] = ''
+        success, content = getJobStatus(id, work_dir)
+        if not success:
+            return False, content
+        value['status'] = content['status']
+        if value['status'] == 'Done' or value['status'] == 'Exit':
+            # created only when there is something to download
+            if not os.path.exists(cur_work_dir):
+                os.makedirs(cur_work_dir)
+            downloadFiles(str(id), cur_work_dir, OUTPUT_FILE_NAME + ',' + LSF_ERRPUT_FILE_NAME, work_dir, progress = progress)
+        value.update(readJobOutput(cur_work_dir))
+        return True, value
+    except Exception as e:
+        return False, str(e)
+
+
+def doAction(jobId, action, work_dir):
+    if action != 'kill':
+        return False, 'Failed to %s the task' % action
+    success, content = run([command('bkill', work_dir), str(jobId)])
+    return success, content.strip()
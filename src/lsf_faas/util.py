@@ -0,0 +1,175 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The helpers of the client run out of the requests to the AC web server: the calls of the local pool
+# (see lsf.local), the telemetry summaries, the numpy array outputs and the profile stacks.
+
+import os
+import time
+
+from lsf_faas.lsflib import NPY_MAGIC
+
+
+def aggregateTelemetry(records):
+    """
+    Aggregate the telemetry of many calls: the mean and the maximum of each measure, and the calls
+      and the mean call time per execution host.
+    """
+    summary = {'calls': len(records)}
+    for measure in ('wall', 'cpu', 'import', 'call', 'max_rss', 'queue', 'run'):
+        values = [record[measure] for record in records if record.get(measure) is not None]
+        if len(values) > 0:
+            summary[measure] = {'mean': sum(values) / len(values), 'max': max(values)}
+    hosts = {}
+    for record in records:
+        host = hosts.setdefault(record.get('host'), {'calls': 0, 'call': 0})
+        host['calls'] += 1
+        host['call'] += record.get('call') or 0
+    for host in hosts.values():
+        host['call'] = host['call'] / host['calls']
+    summary['hosts'] = hosts
+    return summary
+
+
+# path -> object loaded from a file of lsf.put(), kept by each process of the local pool
+LOCAL_REFS = {}
+
+
+def runLocal(payload):
+    """
+    Run a call in a process of the local pool. payload is the dill serialized (func, arguments, refs),
+      refs maps the positions of the ObjectRef arguments to the files of the objects, or for an ArrayShard,
+      to (file, offset, shape, descr).
+
+    Return a tuple (success, content, telemetry): content is the dill serialized return value if success,
+      otherwise the traceback; telemetry gives the measures of the call like the job script does.
+    """
+    import dill
+    import platform
+    import socket
+    import traceback
+    start = time.time()
+    start_cpu = time.process_time()
+    telemetry = {'host': socket.gethostname(), 'python': platform.python_version()}
+    try:
+        func, arguments, refs = dill.loads(payload)
+        arguments = list(arguments)
+        for i, path in refs.items():
+            if isinstance(path, tuple):
+                # the slice of an array, see lsf.scatter()
+                import numpy
+                path, offset, shape, descr = path
+                dtype = numpy.lib.format.descr_to_dtype(descr)
+                arguments[i] = numpy.empty(shape, dtype) if 0 in shape else numpy.memmap(path, dtype = dtype, mode = 'r', offset = offset, shape = shape)
+                continue
+            if path not in LOCAL_REFS:
+                f = open(path, 'rb')
+                LOCAL_REFS[path] = dill.load(f)
+                f.close()
+            arguments[i] = LOCAL_REFS[path]
+        call = time.time()
+        telemetry['import'] = call - start
+        output = func(*arguments)
+        telemetry['call'] = time.time() - call
+        success, content = True, dill.dumps(output)
+    except Exception:
+        success, content = False, traceback.format_exc()
+    telemetry['wall'] = time.time() - start
+    telemetry['cpu'] = time.process_time() - start_cpu
+    return success, content, telemetry
+
+
+def arrayHeader(f):
+    # (shape, fortran_order, dtype) of the .npy file open at its start, None if it is not a numpy array;
+    #   the file is left at the data
+    import numpy
+    if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+        return None
+    f.seek(0)
+    if numpy.lib.format.read_magic(f) == (1, 0):
+        return numpy.lib.format.read_array_header_1_0(f)
+    return numpy.lib.format.read_array_header_2_0(f)
+
+
+def readArrayHeader(path):
+    # the shape and dtype of the numpy array in the output file, None if it is not a numpy array
+    f = open(path, "rb")
+    try:
+        header = arrayHeader(f)
+        return None if header is None else (header[0], header[2])
+    finally:
+        f.close()
+
+
+def readArray(path, out):
+    """
+    Read the numpy array in the output file straight into out, an array of its shape.
+    The data is read into out without a temporary copy if it has the same dtype and out is C contiguous,
+      otherwise it is converted.
+
+    Return False if the output is not a numpy array.
+    """
+    import numpy
+    f = open(path, "rb")
+    try:
+        header = arrayHeader(f)
+        if header is None:
+            return False
+        shape, fortran_order, dtype = header
+        if tuple(shape) != out.shape:
+            raise ValueError('The output of shape %s does not fit in %s.' % (str(tuple(shape)), str(out.shape)))
+        if dtype == out.dtype and not fortran_order and out.flags['C_CONTIGUOUS']:
+            if out.nbytes > 0 and f.readinto(memoryview(out.reshape(-1).view(numpy.uint8))) != out.nbytes:
+                raise ValueError('The output file %s is truncated.' % path)
+        else:
+            f.seek(0)
+            out[...] = numpy.load(f, allow_pickle = False)
+        return True
+    finally:
+        f.close()
+
+
+def collapseStats(stats):
+    """
+    Turn cProfile stats into collapsed stacks, one 'caller;callee microseconds' line per stack, as read by flame graph tools.
+    cProfile only records the caller -> callee edges, so the time of a function is shared among its stacks by the edge times.
+    """
+    def label(func):
+        filename, line, name = func
+        if filename == '~':
+            return name
+        return '%s:%d(%s)' % (os.path.basename(filename), line, name)
+
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    times = {}
+    def visit(func, path, funcs, share):
+        # share is the part of the cumulative time of func spent in this stack
+        path = path + [label(func)]
+        key = ';'.join(path)
+        times[key] = times.get(key, 0) + stats[func][2] * share
+        for callee, edge_time in callees.get(func, []):
+            callee_time = stats[callee][3]
+            # recursive calls are counted in the first frame
+            if callee in funcs or callee_time <= 0 or edge_time * share < 1e-6:
+                continue
+            visit(callee, path, funcs | set([callee]), edge_time * share / callee_time)
+
+    for func, value in stats.items():
+        if len(value[4]) == 0:
+            visit(func, [], set([func]), 1.0)
+    return ['%s %d' % (key, int(times[key] * 1000000)) for key in sorted(times) if int(times[key] * 1000000) > 0]
@@ -0,0 +1,39 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The tests run the jobs on this host through the stand-ins of bsub, bjobs and bkill in tests/stubs,
+#   with a client using the LSF commands (see lsf.logon(native = ...)).
+
+import os
+import sys
+
+import pytest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+STUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+sys.path.insert(0, SOURCE_DIR)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from lsf_faas.lsf import lsf
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    monkeypatch.setenv('STUB_STATE', str(tmp_path / 'lsf'))
+    # the job scripts run with the python of the tests
+    monkeypatch.setenv('PATH', os.path.dirname(sys.executable) + os.pathsep + os.environ.get('PATH', ''))
+    monkeypatch.setenv('PYTHONPATH', SOURCE_DIR)
+    client = lsf(capture_imports = False)
+    client.interval = 0.2
+    assert client.logon(native = STUB_DIR)
+    return client
@@ -0,0 +1,74 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A stand-in of the AC web server, answering the logon and the job status requests on a local port.
+#   The jobs it knows are all Done.
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Server(object):
+
+    def __init__(self, jobs = ()):
+        self.jobs = set(jobs)
+        self.logons = 0
+        self.requests = []
+        self.token = 'token0'
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *arguments):
+                pass
+
+            def reply(self, body):
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                server.requests.append(self.path)
+                if '/pacclient/logon' in self.path:
+                    server.logons += 1
+                    return self.reply('<User><token>%s</token></User>' % server.token)
+                if server.token not in (self.headers.get('Cookie') or ''):
+                    return self.reply('<Jobs><errMsg>Your current login session was logout</errMsg></Jobs>')
+                if '/pacclient/ping' in self.path:
+                    return self.reply('<Ping>ok</Ping>')
+                if '/pacclient/jobs' in self.path:
+                    ids = re.search(r'id=([\d,]+)', self.path).group(1).split(',')
+                    return self.reply('<Jobs>%s</Jobs>' % ''.join('<Job><id>%s</id><status>Done</status></Job>' % id
+                                                                  for id in ids if int(id) in server.jobs))
+                return self.reply('<Jobs><errMsg>Unknown request</errMsg></Jobs>')
+
+            do_POST = do_GET
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+    def expire(self):
+        # the tokens given so far are refused
+        self.token = 'token%d' % (int(self.token[5:]) + 1)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,333 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The client using the LSF commands (bsub, bjobs and bkill) of the host, see lsf.logon(native = ...).
+
+import operator
+import os
+import time
+
+from conftest import STUB_DIR
+from lsf_faas import native
+
+TIMEOUT = 60
+
+
+def add(x, y):
+    return x + y
+
+
+def fail():
+    raise ValueError('bad input')
+
+
+def slow():
+    import time
+    time.sleep(60)
+
+
+def nap(seconds):
+    import time
+    time.sleep(seconds)
+    return seconds
+
+
+def straggle(path):
+    # slow the first time only: its copy is fast
+    import os, time
+    if not os.path.exists(path):
+        open(path, 'w').close()
+        time.sleep(60)
+        return 'first'
+    return 'copy'
+
+
+def inv(x):
+    return 1 / x
+
+
+def total(x):
+    return sum(x)
+
+
+def shard_total(shard):
+    return int(shard.sum())
+
+
+def chatty(n):
+    import time
+    for i in range(n):
+        print('step', i)
+        time.sleep(0.1)
+    return n
+
+
+def result(client, id):
+    end_time = time.time() + TIMEOUT
+    while time.time() < end_time:
+        output = client.get(id)
+        if output is not None:
+            return output
+        time.sleep(0.2)
+    raise AssertionError('The function %s is not finished.' % id)
+
+
+def jobs_dir(client):
+    return os.sep.join([client.work_dir, native.NATIVE_JOB_DIR_NAME])
+
+
+def stub_job(jobid):
+    return os.path.join(os.environ['STUB_STATE'], str(jobid))
+
+
+def removed(path):
+    end_time = time.time() + TIMEOUT
+    while os.path.exists(path) and time.time() < end_time:
+        time.sleep(0.2)
+    return not os.path.exists(path)
+
+
+def test_sub_and_get(client):
+    id = client.sub(add, 1, 2)
+    jobid = client.jobId(id)
+    assert isinstance(jobid, int)
+    assert os.path.islink(os.sep.join([jobs_dir(client), str(jobid)]))
+    assert client.status(id) in ('Pend', 'Run', 'Done')
+    assert result(client, id) == 3
+    assert client.status(id) == 'Done'
+    assert client.statuses([jobid]) == {jobid: 'Done'}
+
+
+def test_exe_and_exit(client):
+    assert client.exe(add, 'a', 'b', timeout = TIMEOUT) == 'ab'
+    message = client.exe(fail, timeout = TIMEOUT)
+    assert 'ValueError: bad input' in message
+
+
+def test_cancel(client):
+    id = client.sub(slow)
+    assert client.cancel(id)
+    assert os.path.exists(os.path.join(stub_job(client.jobId(id)), 'killed'))
+    assert client.status(id) == 'Exit'
+
+
+def test_finished_job_unknown_to_lsf(client):
+    # LSF forgets the finished jobs, their status is read from their directory
+    id = client.sub(add, 2, 2)
+    assert result(client, id) == 4
+    jobid = client.jobId(id)
+    os.rename(stub_job(jobid), stub_job(jobid) + '.forgotten')
+    assert client.status(id) == 'Done'
+    assert client.statuses([jobid, 999]) == {jobid: 'Done'}
+
+
+def test_link_of_reused_job_id_is_replaced(client):
+    # the stubs give the job ids from 1001
+    os.makedirs(jobs_dir(client))
+    os.symlink('.old', os.sep.join([jobs_dir(client), '1001']))
+    id = client.sub(add, 3, 4)
+    assert client.jobId(id) == 1001
+    assert result(client, id) == 7
+
+
+def test_job_is_killed_when_it_cannot_be_linked(client):
+    os.makedirs(os.sep.join([jobs_dir(client), '1001', 'files']))
+    assert client.sub(slow) is None
+    assert os.path.exists(os.path.join(stub_job(1001), 'killed'))
+
+
+def test_clean_jobs(client):
+    id = client.sub(add, 5, 6)
+    assert result(client, id) == 11
+    link = os.sep.join([jobs_dir(client), str(client.jobId(id))])
+    job_dir = os.path.realpath(link)
+    old = time.time() - 31 * 24 * 60 * 60
+    os.utime(job_dir, (old, old))
+    os.utime(link, (old, old), follow_symlinks = False)
+    recent = client.sub(add, 7, 8)
+
+    assert sorted(native.cleanJobs(client.work_dir, 30)) == sorted([link, job_dir])
+    assert os.path.isdir(jobs_dir(client))
+    assert not os.path.lexists(link)
+    assert result(client, recent) == 15
+
+
+def test_tail(client, capsys):
+    plain = client.sub(chatty, 2)
+    assert client.tail(plain, follow = False) is None
+    assert 'tail_output = True' in capsys.readouterr().out
+
+    client.tail_output = True
+    client.tail_period = 0.2
+    id = client.sub(chatty, 5)
+    client.tail(id, timeout = TIMEOUT)
+    assert capsys.readouterr().out == ''.join('step %d\n' % i for i in range(5))
+    assert result(client, id) == 5
+    # the segments are removed once read
+    assert client.tail(id, follow = False) == ''
+    job_dir = os.path.realpath(os.sep.join([jobs_dir(client), str(client.jobId(id))]))
+    assert [name for name in os.listdir(job_dir) if name.startswith('.lsf_faas.tail')] == []
+    assert [name for name in os.listdir(job_dir) if name.startswith('lsf_faas.tail.')] == []
+
+
+def test_cancel_all_buffered_calls(client):
+    client.batch_window = 60000
+    ids = [client.sub(add, x, 1, tags = 'sweep') for x in range(4)]
+    assert [client.status(id) for id in ids] == ['batched'] * 4
+
+    # the calls are taken out of their batch, the others are submitted together
+    summary = client.cancelAll(predicate = lambda id, info: id in ids[1:3])
+    assert sorted(summary['killed']) == sorted(ids[1:3])
+    assert [client.status(id) for id in ids[1:3]] == ['Exit', 'Exit']
+    client.flush()
+    assert [result(client, id) for id in (ids[0], ids[3])] == [1, 4]
+    assert client.jobId(ids[0]) == client.jobId(ids[3])
+
+    # no job is submitted for a batch whose calls are all canceled
+    left = [client.sub(add, x, 1, tags = 'sweep') for x in range(2)]
+    summary = client.cancelAll(tags = 'sweep')
+    assert sorted(summary['killed']) == sorted(left)
+    # the submitted calls are counted by the job of their batch
+    assert set(ids[1:3]).issubset(summary['finished'])
+    client.flush()
+    assert [client.jobId(id) for id in left] == [None, None]
+    assert len([name for name in os.listdir(os.environ['STUB_STATE']) if name.isdigit()]) == 1
+
+
+def test_failed_call_of_a_batch(client):
+    # a call raising does not fail the other calls of its batch
+    client.batch_window = 60000
+    ids = [client.sub(inv, x) for x in (0, 1, 2, 4)]
+    client.flush()
+    assert len(set(client.jobId(id) for id in ids)) == 1
+    assert 'ZeroDivisionError' in result(client, ids[0])
+    assert client.status(ids[0]) == 'Exit'
+    assert [result(client, id) for id in ids[1:]] == [1.0, 0.5, 0.25]
+    assert [client.status(id) for id in ids[1:]] == ['Done'] * 3
+
+
+def test_local_auto_measures_on_lsf_first(client):
+    client.local = 'auto'
+    client.local_runtime = 1.0
+    # a function never measured runs on LSF, where it can be canceled
+    id = client.sub(slow)
+    assert isinstance(client.jobId(id), int)
+    assert client.cancel(id)
+
+    first = client.sub(add, 1, 2)
+    assert isinstance(client.jobId(first), int)
+    assert result(client, first) == 3
+    end_time = time.time() + TIMEOUT
+    while True:
+        id = client.sub(add, 3, 4)
+        if client.jobId(id) is None or time.time() > end_time:
+            break
+        result(client, id)
+    # measured below local_runtime, it runs locally
+    assert client.jobId(id) is None
+    assert result(client, id) == 7
+
+    long = client.sub(nap, 1.5)
+    assert isinstance(client.jobId(long), int)
+    assert result(client, long) == 1.5
+    time.sleep(1)
+    assert isinstance(client.jobId(client.sub(nap, 0.1)), int)
+
+
+def test_failed_asynchronous_upload(client, tmp_path):
+    data = tmp_path / 'data.txt'
+    data.write_text('data')
+    os.makedirs(os.environ['STUB_STATE'], exist_ok = True)
+    with open(os.path.join(os.environ['STUB_STATE'], 'reject'), 'w') as f:
+        f.write('Bad queue name. Job not submitted.')
+    id = client.sub(add, 1, 2, files = str(data), asynchronous = True)
+    end_time = time.time() + TIMEOUT
+    while client.status(id) == 'uploading' and time.time() < end_time:
+        time.sleep(0.1)
+    assert client.status(id) == 'Exit'
+    assert 'Bad queue name' in client.get(id)
+    assert client.cancelAll()['finished'] == [id]
+
+
+def test_work_dir_is_created_when_the_output_is_downloaded(client):
+    id = client.sub(nap, 1)
+    assert client.get(id) is None
+    assert not os.path.exists(os.path.join(client.work_dir, id))
+    assert result(client, id) == 1
+    assert os.path.exists(os.path.join(client.work_dir, id, 'output.out'))
+
+
+def test_speculate_small_group(client, tmp_path):
+    ids = [client.sub(nap, 0.2), client.sub(nap, 0.2), client.sub(straggle, str(tmp_path / 'started'))]
+    jobs = [str(client.jobId(id)) for id in ids]
+    client.speculate(ids)
+    # one copy of a group of 3, the first result wins
+    assert result(client, ids[2]) == 'copy'
+    assert [result(client, id) for id in ids[:2]] == [0.2, 0.2]
+    assert os.path.exists(os.path.join(stub_job(jobs[2]), 'killed'))
+    # the jobs of the group are asked together
+    f = open(os.path.join(os.environ['STUB_STATE'], 'bjobs.log'))
+    asked = [line.split() for line in f]
+    f.close()
+    assert any(set(jobs).issubset(line) for line in asked)
+
+
+def test_tail_does_not_hold_the_job(client):
+    client.tail_output = True
+    # kept 10 seconds for a reader behind
+    client.tail_period = 5
+    id = client.sub(chatty, 3)
+    assert result(client, id) == 3
+    assert client.telemetry(id)['wall'] < 5
+    assert client.tail(id, follow = False) == ''.join('step %d\n' % i for i in range(3))
+    job_dir = os.path.realpath(os.sep.join([jobs_dir(client), str(client.jobId(id))]))
+    assert [name for name in os.listdir(job_dir) if name.startswith('lsf_faas.tail.')] == []
+
+
+def test_map_reduce_removes_its_results(client):
+    reduce_dir = os.path.join(os.path.expanduser(client.staging_dir), 'reduce')
+    id = client.map_reduce(inv, operator.add, [1, 2, 4, 8], fan_in = 2, chunksize = 1)
+    assert result(client, id) == 1.875
+    assert removed(reduce_dir)
+    # failed
+    id = client.map_reduce(inv, operator.add, [1, 2, 0, 4], fan_in = 2, chunksize = 1)
+    assert 'ZeroDivisionError' in result(client, id)
+    assert client.status(id) == 'Exit'
+    assert removed(reduce_dir)
+    # canceled
+    id = client.map_reduce(nap, operator.add, [0.1, 0.1, 60], fan_in = 2, chunksize = 1)
+    end_time = time.time() + TIMEOUT
+    while not os.path.exists(reduce_dir) and time.time() < end_time:
+        time.sleep(0.2)
+    client.cancel(id)
+    assert client.status(id) == 'Exit'
+    assert removed(reduce_dir)
+
+
+def test_put_before_logon(client):
+    client.logout()
+    # stored locally, it is staged when the function is submitted
+    ref = client.put([1, 2, 3])
+    assert ref is not None
+    assert client.logon(native = STUB_DIR)
+    assert result(client, client.sub(total, ref)) == 6
+
+
+def test_scatter_before_logon(client):
+    import numpy
+    client.logout()
+    shards = client.scatter(numpy.arange(10), 3)
+    assert [shard.shape for shard in shards] == [(4,), (3,), (3,)]
+    assert client.logon(native = STUB_DIR)
+    assert [result(client, client.sub(shard_total, shard)) for shard in shards] == [6, 15, 24]
@@ -0,0 +1,69 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The named sessions of a client logged on to several AC web servers, see the stand-in server in pac.py.
+
+import pytest
+
+from pac import Server
+
+
+@pytest.fixture
+def servers():
+    east, west = Server(jobs = [101]), Server(jobs = [202])
+    yield east, west
+    east.close()
+    west.close()
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    from lsf_faas.lsf import lsf
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    return lsf(capture_imports = False)
+
+
+def test_expired_session_logs_on_again_to_its_server(servers, remote):
+    east, west = servers
+    assert remote.logon('user', 'password', '127.0.0.1', east.port, session = 'east')
+    assert remote.logon('user', 'password', '127.0.0.1', west.port, session = 'west')
+    # the host of the provider is the one of the default session
+    remote.credential_provider = lambda: ('user', 'password', '127.0.0.1', east.port, False)
+
+    west.expire()
+    assert remote.statuses([202], session = 'west') == {202: 'Done'}
+    assert (east.logons, west.logons) == (1, 2)
+
+    east.expire()
+    west.expire()
+    assert remote.statuses([101], session = 'east') == {101: 'Done'}
+    assert remote.statuses([202], session = 'west') == {202: 'Done'}
+    assert (east.logons, west.logons) == (2, 3)
+
+
+def test_expired_session_fails_without_credential_provider(servers, remote):
+    east, west = servers
+    assert remote.logon('user', 'password', '127.0.0.1', west.port, session = 'west')
+    west.expire()
+    assert remote.statuses([202], session = 'west') is None
+    assert west.logons == 1
+
+
+def test_expired_default_session_logs_on_again(servers, remote):
+    east, west = servers
+    assert remote.logon('user', 'password', '127.0.0.1', east.port)
+    remote.credential_provider = lambda: ('user', 'password', '127.0.0.1', east.port, False)
+    east.expire()
+    assert remote.statuses([101]) == {101: 'Done'}
+    assert east.logons == 2
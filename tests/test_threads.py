@@ -0,0 +1,142 @@
+# Copyright International Business Machines Corp, 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Stress tests of one client shared by many threads, the guarantees listed in Threads of docs/api.md:
+#  - sub() from many threads at once gives each call its own id, and every call is recorded and run.
+#  - get() of the same functions from many threads gives their results while the outputs are dropped from
+#    memory by cache_size and reloaded, an output is never dropped while a get() of its function uses it.
+#  - the calls buffered by micro-batching from many threads are all submitted once and resolved.
+
+import random
+import threading
+import time
+
+THREADS = 8
+CALLS = 6
+TIMEOUT = 120
+
+
+def square(x):
+    return [x * x] * 100
+
+
+def run(threads):
+    errors = []
+
+    def target(work):
+        try:
+            work()
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target = target, args = (work,)) for work in threads]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(TIMEOUT)
+    assert errors == []
+
+
+def wait(client, ids):
+    # the results, got from many threads at once in random order until all are finished
+    results = {}
+    lock = threading.Lock()
+    end_time = time.time() + TIMEOUT
+
+    def work():
+        while time.time() < end_time:
+            with lock:
+                left = [id for id in ids if id not in results]
+            if len(left) == 0:
+                return
+            id = random.choice(left)
+            output = client.get(id)
+            if output is not None:
+                with lock:
+                    results[id] = output
+            time.sleep(0.05)
+
+    run([work] * THREADS)
+    return results
+
+
+def submit(client, calls):
+    # sub() from many threads at once, return the ids of each argument
+    ids = {}
+    lock = threading.Lock()
+
+    def work(k):
+        for x in range(k * CALLS, (k + 1) * CALLS):
+            id = client.sub(square, x)
+            with lock:
+                ids[x] = id
+
+    run([lambda k = k: work(k) for k in range(calls // CALLS)])
+    return ids
+
+
+def test_sub_and_get_from_many_threads(client):
+    # holds about two outputs, the others are dropped and reloaded
+    client.cache_size = 1500
+    ids = submit(client, THREADS * CALLS)
+    assert len(ids) == THREADS * CALLS
+    assert None not in ids.values()
+    assert len(set(ids.values())) == len(ids)
+
+    results = wait(client, list(ids.values()))
+    assert len(results) == len(ids)
+    for x, id in ids.items():
+        assert results[id] == square(x)
+
+    # read again while they keep evicting each other
+    checked = []
+
+    def work():
+        for x in random.sample(list(ids), len(ids)):
+            assert client.get(ids[x]) == square(x)
+        checked.append(True)
+
+    run([work] * THREADS)
+    assert len(checked) == THREADS
+    assert client.memoryUsage()['evicted'] > 0
+
+
+def test_batched_calls_from_many_threads(client):
+    client.batch_window = 200
+    client.batch_size = 10
+    ids = submit(client, THREADS * CALLS)
+    assert None not in ids.values()
+
+    results = wait(client, list(ids.values()))
+    assert len(results) == len(ids)
+    for x, id in ids.items():
+        assert results[id] == square(x)
+    # each batch is one job
+    jobs = set(client.jobId(id) for id in ids.values())
+    assert None not in jobs
+    assert len(jobs) < len(ids)
+
+
+def test_local_outputs_are_counted(client):
+    # the outputs of the local pool are bounded by cache_size as well
+    client.local = True
+    client.cache_size = 1500
+    ids = submit(client, THREADS * CALLS)
+    results = wait(client, list(ids.values()))
+    assert len(results) == len(ids)
+    usage = client.memoryUsage()
+    assert 0 < usage['bytes'] <= client.cache_size
+    assert usage['evicted'] > 0
+    for x, id in ids.items():
+        assert client.get(id) == square(x)